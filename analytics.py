@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import counters
+
+# dashboard figures, one aggregation per collection so a refresh is two round trips.
+# the headline totals and category splits come from the stats counters instead
+
+AGE_BINS = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+GENDERS = ["Male", "Female", "Other"]
+
+
+def month_group(field):
+    return [
+        {"$group": {
+            "_id": {"year": {"$year": f"${field}"}, "month": {"$month": f"${field}"}},
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"_id.year": 1, "_id.month": 1}}
+    ]
+
+
+def select(facets, names):
+    return {name: facets[name] for name in names} if names else facets
+
+
+def patient_facet_pipeline(names=None):
+    # the last bin is closed like the old histogram (90-100 includes 100), anything
+    # outside 0-100 or without an age lands in "other" and isn't charted
+    boundaries = AGE_BINS[:-1] + [AGE_BINS[-1] + 1]
+    return [{"$facet": select({
+        "summary": [{"$group": {"_id": None, "total": {"$sum": 1}, "avgAge": {"$avg": "$age"}}}],
+        "gender": [{"$group": {"_id": "$gender", "count": {"$sum": 1}}}],
+        "insurance": [{"$group": {"_id": "$insurance", "count": {"$sum": 1}}}],
+        "ages": [{"$bucket": {
+            "groupBy": "$age",
+            "boundaries": boundaries,
+            "default": "other",
+            "output": {"count": {"$sum": 1}}
+        }}],
+        "registrations": month_group("registration_date"),
+    }, names)}]
+
+
+def appointment_facet_pipeline(today, tomorrow, names=None):
+    return [{"$facet": select({
+        "today": [
+            {"$match": {"date": {"$gte": today, "$lt": tomorrow}}},
+            {"$count": "count"}
+        ],
+        "revenue": [
+            {"$match": {"status": "Completed"}},
+            {"$group": {
+                "_id": "$consultation_type",
+                "total": {"$sum": "$bill_amount"},
+                "count": {"$sum": 1}
+            }},
+            {"$sort": {"total": -1}}
+        ],
+        "monthly": month_group("date"),
+    }, names)}]
+
+
+def age_bucket_counts(buckets):
+    counts = dict.fromkeys(AGE_BINS[:-1], 0)
+    for bucket in buckets:
+        if bucket["_id"] in counts:
+            counts[bucket["_id"]] = bucket["count"]
+    return [counts[edge] for edge in AGE_BINS[:-1]]
+
+
+PATIENT_FACETS = ("ages", "registrations")
+APPOINTMENT_FACETS = ("today", "monthly")
+
+
+def load_facets(patients_col, appointments_col, facets, now=None):
+    # runs only the named facets, a collection is skipped when none of its facets are asked for
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    tomorrow = today + timedelta(days=1)
+    patient_facets = [name for name in PATIENT_FACETS if name in facets]
+    appointment_facets = [name for name in APPOINTMENT_FACETS if name in facets]
+
+    data = {}
+    if patient_facets:
+        data.update(next(patients_col.aggregate(patient_facet_pipeline(patient_facets))))
+    if appointment_facets:
+        data.update(next(appointments_col.aggregate(
+            appointment_facet_pipeline(today, tomorrow, appointment_facets))))
+
+    if "ages" in data:
+        data["ages"] = age_bucket_counts(data["ages"])
+    if "today" in data:
+        data["today"] = data["today"][0]["count"] if data["today"] else 0
+    return data
+
+
+def load_dashboard(patients_col, appointments_col, stats_col, facets=(), now=None):
+    # the headline figures plus whatever chart facets are asked for
+    # totals, gender, insurance and revenue are O(1) reads of the counters document
+    stats = counters.read(patients_col, appointments_col, stats_col)
+    revenue = sorted(
+        ({"_id": key, "total": entry["total"], "count": entry["count"]}
+         for key, entry in stats.get("revenue_by_type", {}).items() if entry["count"] > 0),
+        key=lambda item: item["total"], reverse=True
+    )
+
+    data = {
+        "total_patients": stats.get("patients", 0),
+        "avg_age": stats["age_sum"] / stats["age_count"] if stats.get("age_count") else 0,
+        "total_revenue": stats.get("revenue", 0),
+        "gender": [stats.get("gender", {}).get(g, 0) for g in GENDERS],
+        "insurance": {key: count for key, count in stats.get("insurance", {}).items() if count > 0},
+        "revenue": revenue,
+    }
+    data.update(load_facets(patients_col, appointments_col, ("today",) + tuple(facets), now))
+    return data
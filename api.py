@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import db
+import exporters
+import name_search
+import service
+
+# HTTP/JSON API over service.RegistryService, for kiosks and anything else that
+# shouldn't need a desktop window (or its own MongoClient) per user.
+#   python api.py [--host 127.0.0.1] [--port 8080] [--mongomock]
+# one process, one connection pool (db.POOL_SIZE). the service calls block, each
+# runs on a thread of a pool no bigger than the connection pool, requests past
+# MAX_WAITING get 503 rather than queueing without end.
+#
+#   GET    /health
+#   GET    /patients?sort=name&after=<id>&limit=50
+#   GET    /patients/search?name=&min_age=&max_age=&from=&to=&insurance=&after=&limit=
+#   POST   /patients                          {"name", "age", "gender", "insurance", "medical_history"}
+#   GET    /patients/<id>
+#   PATCH  /patients/<id>                     any of the fields above
+#   DELETE /patients/<id>
+#   GET    /appointments?status=&from=&to=&limit=
+#   POST   /appointments[?force=1]            {"patient_name" or "patient_id", "date", "time", ...}
+#   GET    /appointments/<id>
+#   POST   /appointments/<id>/complete
+#   POST   /appointments/<id>/cancel
+#   GET    /dashboard?facets=ages,registrations,today,monthly
+#   GET    /audit?entity=&from=&to=&before=<id>&limit=
+#   GET    /export/patients, /export/appointments   streamed NDJSON
+
+HOST = os.environ.get("PATIENT_REGISTRY_API_HOST", "127.0.0.1")
+PORT = int(os.environ.get("PATIENT_REGISTRY_API_PORT", "8080"))
+CONCURRENCY = db.POOL_SIZE
+MAX_WAITING = 200
+MAX_BODY = 1024 * 1024
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def encode(value):
+    return json.dumps(value, default=exporters.json_default, ensure_ascii=False).encode("utf-8")
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path.rstrip("/") or "/"
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, "Body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        return data
+
+    def number(self, name, default=None, integer=True):
+        value = self.query.get(name)
+        if value in (None, ""):
+            return default
+        try:
+            return int(value) if integer else float(value)
+        except ValueError:
+            raise HttpError(400, f"{name} must be a number")
+
+    def day(self, name):
+        value = self.query.get(name)
+        return service.day(value, name) if value else None
+
+
+class Api:
+    def __init__(self, registry, concurrency=CONCURRENCY, max_waiting=MAX_WAITING):
+        self.registry = registry
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="api")
+        self.slots = asyncio.Semaphore(concurrency)
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.routes = [
+            ("GET", r"/health", self.health),
+            ("GET", r"/patients", self.list_patients),
+            ("GET", r"/patients/search", self.search_patients),
+            ("POST", r"/patients", self.add_patient),
+            ("GET", r"/patients/(?P<id>\w+)", self.get_patient),
+            ("PATCH", r"/patients/(?P<id>\w+)", self.update_patient),
+            ("DELETE", r"/patients/(?P<id>\w+)", self.delete_patient),
+            ("GET", r"/appointments", self.list_appointments),
+            ("POST", r"/appointments", self.schedule_appointment),
+            ("GET", r"/appointments/(?P<id>\w+)", self.get_appointment),
+            ("POST", r"/appointments/(?P<id>\w+)/(?P<action>complete|cancel)", self.set_status),
+            ("GET", r"/dashboard", self.dashboard),
+            ("GET", r"/audit", self.audit_entries),
+            ("GET", r"/export/(?P<collection>\w+)", self.export),
+        ]
+        self.routes = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in self.routes]
+
+    async def call(self, fn, *args, **kwargs):
+        # a service call on the pool, at most CONCURRENCY at once
+        if self.waiting >= self.max_waiting:
+            raise HttpError(503, "Too many requests waiting, try again shortly")
+        self.waiting += 1
+        try:
+            async with self.slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.waiting -= 1
+
+    # handlers return (status, value) or write a streamed response themselves and return None
+
+    async def health(self, request):
+        return 200, {"status": "ok", "waiting": self.waiting}
+
+    async def list_patients(self, request):
+        return 200, await self.call(self.registry.list_patients, request.query.get("sort", "name"),
+                                    request.query.get("after"), request.number("limit", 50))
+
+    async def search_patients(self, request):
+        return 200, await self.call(
+            self.registry.search_patients, request.query.get("name"), request.number("min_age"),
+            request.number("max_age"), request.day("from"), request.day("to"), request.query.get("insurance"),
+            request.query.get("after"), request.number("limit", 50))
+
+    async def add_patient(self, request):
+        return 201, await self.call(self.registry.add_patient, request.json())
+
+    async def get_patient(self, request, id):
+        return self.found(await self.call(self.registry.get_patient, id), "Patient")
+
+    async def update_patient(self, request, id):
+        before, after = await self.call(self.registry.update_patient, id, request.json())
+        return self.found(after, "Patient")
+
+    async def delete_patient(self, request, id):
+        return self.found(await self.call(self.registry.delete_patient, id), "Patient")
+
+    async def list_appointments(self, request):
+        start, end = request.day("from"), request.day("to")
+        if (start is None) != (end is None):
+            raise HttpError(400, "from and to go together")
+        return 200, await self.call(self.registry.list_appointments, request.query.get("status"), start,
+                                    end + timedelta(days=1) if end else None, request.number("limit", 200))
+
+    async def schedule_appointment(self, request):
+        appointment, clash = await self.call(self.registry.schedule_appointment, request.json(),
+                                             request.query.get("force") in ("1", "true"))
+        if clash:
+            return 409, {"error": "Overlaps with other appointments, send again with ?force=1 to book anyway",
+                         "conflicts": clash}
+        return 201, appointment
+
+    async def get_appointment(self, request, id):
+        return self.found(await self.call(self.registry.get_appointment, id), "Appointment")
+
+    async def set_status(self, request, id, action):
+        status = "Completed" if action == "complete" else "Cancelled"
+        before, after = await self.call(self.registry.set_appointment_status, id, status)
+        return self.found(after, "Appointment")
+
+    async def dashboard(self, request):
+        facets = [name for name in request.query.get("facets", "").split(",") if name]
+        return 200, await self.call(self.registry.dashboard, facets)
+
+    async def audit_entries(self, request):
+        until = request.day("to")
+        return 200, await self.call(self.registry.audit_entries, request.query.get("entity"), request.day("from"),
+                                    until + timedelta(days=1) if until else None, request.query.get("before"),
+                                    request.number("limit", 100))
+
+    async def export(self, request, collection, writer=None):
+        # chunked, one batch of lines per chunk, each batch read on the pool. the first batch
+        # is read before the headers go out, so a failure that early still gets its own status
+        if collection not in exporters.SCHEMAS:
+            raise HttpError(404, f"No collection {collection}")
+        lines = self.registry.export_ndjson(collection)
+        try:
+            chunk = await self.call(next, lines, None)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                         b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+            try:
+                while chunk is not None:
+                    data = chunk.encode("utf-8")
+                    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    # a slow client holds up its own export, not the pool
+                    await writer.drain()
+                    chunk = await self.call(next, lines, None)
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            except Exception as e:
+                # the status is sent, closing without the last chunk is how the client learns it's cut short
+                print(f"export of {collection} stopped: {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            lines.close()
+        return None
+
+    def found(self, value, what):
+        if value is None:
+            raise HttpError(404, f"{what} not found")
+        return 200, value
+
+    async def dispatch(self, request, writer):
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            allowed = True
+            if method != request.method:
+                continue
+            if handler == self.export:
+                return await handler(request, writer=writer, **match.groupdict())
+            return await handler(request, **match.groupdict())
+        raise HttpError(405 if allowed else 404, "Method not allowed" if allowed else "Not found")
+
+    async def handle(self, reader, writer):
+        # one connection, requests are read one after another while it's kept alive
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "Content-Length must be a whole number"},
+                                       keep_alive=False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "Body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                request = Request(method.upper(), target, headers, body)
+                try:
+                    result = await self.dispatch(request, writer)
+                except HttpError as e:
+                    result = e.status, {"error": str(e)}
+                except LookupError as e:
+                    result = 404, {"error": str(e).strip("'")}
+                except ValueError as e:
+                    result = 400, {"error": str(e)}
+                except Exception as e:
+                    result = 500, {"error": f"{type(e).__name__}: {e}"}
+                if result is None:
+                    # streamed, the connection is done
+                    break
+                await self.respond(writer, *result, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, value, keep_alive=True):
+        body = encode(value)
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}\r\n"
+                     f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def load_name_index(self):
+        # typo tolerant, ranked name search once this is in, literal matching until then
+        index = name_search.NameIndex()
+        await self.call(index.load, self.registry.patients)
+        self.registry.name_index = index
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        loading = asyncio.create_task(self.load_name_index())
+        print(f"listening on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            loading.cancel()
+            self.executor.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON API for the patient registry")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--mongomock", action="store_true", help="an in-memory database, for trying out or load tests")
+    args = parser.parse_args(argv)
+
+    if args.mongomock:
+        import mongomock
+
+        registry = service.RegistryService(mongomock.MongoClient()[db.DATABASE].get_collection)
+    else:
+        import indexes
+
+        indexes.ensure_indexes(db.get_database())
+        registry = service.RegistryService()
+    try:
+        asyncio.run(Api(registry).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        registry.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
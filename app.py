@@ -1,21 +1,49 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from pymongo import MongoClient
-from datetime import datetime
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pandas as pd
-import numpy as np
+from datetime import datetime, timedelta
 from bson import ObjectId
-import json
-
-# MONGOSH connection
-client = MongoClient("mongodb://localhost:27017/")
-
-db = client["hospital"]
-patients_col = db["patients"]
-appointments_col = db["appointments"]
-audit_logs_col = db["audit_logs"]
+from virtual_tree import KeysetPager, VirtualTree
+from calendar_view import CalendarView
+from worker import DataWorker
+import analytics
+import charts
+import counters
+import db
+import indexes
+import name_search
+import autocomplete
+import search_query
+import exporters
+import importer
+import audit
+import patient_cache
+import schedule
+import sync
+import service
+import perf
+
+# MONGOSH connection, opened lazily on the first query (see db.py for the settings)
+patients_col = db.collection("patients")
+appointments_col = db.collection("appointments")
+audit_logs_col = db.collection("audit_logs")
+stats_col = db.collection("stats")
+tombstones_col = db.collection("tombstones")
+
+# patient list columns that can be sorted server side, each backed by a (field, _id) index
+PATIENT_SORT_FIELDS = {"name": "name", "age": "age", "gender": "gender", "insurance": "insurance"}
+# the search results count stops here at first, past it the count is shown as e.g. 1,000+
+SEARCH_COUNT_LIMIT = 1000
+# the audit tab count with filters on stops here at first, like the search tab
+AUDIT_COUNT_LIMIT = 10000
+# what the calendar draws, the rest of an appointment is loaded when it's clicked
+CALENDAR_PROJECTION = {"patient_name": 1, "start": 1, "end": 1, "status": 1, "consultation_type": 1}
+# the appointment list columns and its (start, _id) sort key
+APPOINTMENT_LIST_PROJECTION = {"patient_name": 1, "date": 1, "time": 1, "consultation_type": 1, "status": 1,
+                               "bill_amount": 1, "start": 1}
+# how long typing has to pause before the name suggestions update
+SUGGESTION_DELAY_MS = 150
+# how often the Performance tab refreshes while it's open
+PERFORMANCE_REFRESH_MS = 2000
 
 class PatientRegistryApp:
     def __init__(self, root):
@@ -31,6 +59,41 @@ class PatientRegistryApp:
         self.style.configure('TEntry', font=('Arial', 12), padding=5)
         self.style.configure('TLabel', font=('Arial', 12))
         self.style.configure('Treeview', font=('Arial', 12), rowheight=30)  
+
+        # database calls run here, off the Tk thread
+        self.worker = DataWorker(root)
+        self.worker.on_busy = self.show_busy
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # audit events are queued and written in batches, the tab shows them as they're recorded
+        self.audit = audit.AuditLogger(audit_logs_col)
+        self.audit.on_event = lambda event: self.worker.post(self.append_audit_row, event)
+        self.audit.on_error = lambda e: self.worker.post(self.show_error("Failed to write audit logs"), e)
+
+        # patient names for the fuzzy search, loaded after startup and kept in sync by the writes
+        self.name_index = name_search.NameIndex()
+        self.name_prefixes = autocomplete.PrefixIndex()
+        # the one copy of patient documents the list, search results, form and scheduling share
+        self.patient_cache = patient_cache.PatientCache(patients_col)
+        self.suggestion_job = None
+        # picked in the appointment list or on the calendar
+        self.selected_appointment = None
+
+        # changes made at the other stations, see sync.py
+        self.poller = sync.Poller({"patients": patients_col, "appointments": appointments_col}, tombstones_col,
+                                  {"patients": dict(patient_cache.PROJECTION, updated_at=1, version=1)})
+
+        # the writes themselves, shared with api.py
+        self.service = service.RegistryService(audit_log=self.audit)
+        self.service.name_index = self.name_index
+        self.service.on_write = self.poller.mark
+
+        # status bar with a busy indicator while queries are running
+        self.status_bar = ttk.Frame(root)
+        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=2)
+        self.busy_label = ttk.Label(self.status_bar, text="")
+        self.busy_label.pack(side=tk.LEFT)
+        self.busy_bar = ttk.Progressbar(self.status_bar, mode="indeterminate", length=150)
         
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(fill=tk.BOTH, expand=True)
@@ -41,8 +104,140 @@ class PatientRegistryApp:
         self.create_appointments_tab()
         self.create_export_tab()
         self.create_audit_logs_tab()
+        self.create_performance_tab()
+
+        # the first queries go out once the window is on screen
+        self.root.after_idle(self.root.after, 0, self.load_initial_data)
+
+    def load_initial_data(self):
+        self.worker.submit(None, lambda: indexes.ensure_indexes(db.get_database()),
+                           on_error=self.show_error("Failed to create indexes"))
+        self.worker.submit(None, self.name_index.load, patients_col,
+                           on_error=self.show_error("Failed to load the name search index"))
+        self.worker.submit(None, self.name_prefixes.load, patients_col,
+                           on_error=self.show_error("Failed to load the patient name list"))
+        self.refresh_patient_list()
+        self.refresh_appointments()
+        self.refresh_audit_logs()
+        self.worker.submit(None, schedule.backfill, appointments_col,
+                           on_error=self.show_error("Failed to fill in appointment times"))
+        self.root.after(int(sync.POLL_SECONDS * 1000), self.poll_changes)
+        # old audit entries move to the monthly archives, only on the station set up to do it
+        if audit.AUTO_ARCHIVE:
+            self.worker.submit(None, lambda: audit.archive(audit_logs_col, db.get_database()),
+                               on_done=self.audit_archived, on_error=self.show_error("Failed to archive old audit logs"))
+
+    def audit_archived(self, result):
+        moved, skipped = result
+        if skipped:
+            months = ", ".join(f"{month} ({found} of {count})" for month, (count, found) in skipped.items())
+            messagebox.showwarning("Audit Archive", f"Not all entries of {months} reached the archive, "
+                                                     f"they were left in the audit log")
+
+    def poll_changes(self):
+        # the next poll is set up once this one is back, so they never pile up
+        def merged(changes):
+            try:
+                self.merge_changes(changes)
+            finally:
+                self.root.after(int(sync.POLL_SECONDS * 1000), self.poll_changes)
+
+        def failed(e):
+            # the server may be out of reach for a moment, no popup every few seconds
+            self.root.after(int(sync.POLL_SECONDS * 1000), self.poll_changes)
 
-        self.update_dashboard()
+        self.worker.submit("sync", self.poller.poll, on_done=merged, on_error=failed, quiet=True)
+
+    def merge_changes(self, changes):
+        if "patients" in changes:
+            patients = changes["patients"]
+            if patients is None:
+                self.reload_patients()
+            else:
+                for doc in patients["changed"]:
+                    self.merge_patient(doc)
+                for patient_id in patients["deleted"]:
+                    self.merge_patient_deleted(patient_id)
+                if self.search_query is not search_query.NOTHING:
+                    self.search_view.reload()
+        if "appointments" in changes:
+            appointments = changes["appointments"]
+            if appointments is None:
+                self.reload_appointments()
+            else:
+                for doc in appointments["changed"]:
+                    self.appointment_view.merge(doc, new=doc.get("version", 0) == 0)
+                    self.calendar.changed(doc)
+                for appointment_id in appointments["deleted"]:
+                    self.appointment_view.remove(appointment_id)
+                    self.calendar.removed(appointment_id)
+
+    def merge_patient(self, doc):
+        old = self.patient_cache.get(doc["_id"])
+        patient = self.patient_cache.store(doc)
+        self.name_index.update(doc["_id"], doc.get("name"))
+        if doc.get("version", 0) == 0:
+            self.name_prefixes.add(doc["_id"], doc.get("name"))
+        elif old is not None:
+            self.name_prefixes.change(doc["_id"], old.get("name"), doc.get("name"))
+        else:
+            # renamed at another station and not held here, the old name stays a
+            # suggestion until the list is next loaded
+            self.name_prefixes.change(doc["_id"], None, doc.get("name"))
+        self.patient_view.merge(patient, new=doc.get("version", 0) == 0)
+
+    def merge_patient_deleted(self, patient_id):
+        old = self.patient_cache.get(patient_id)
+        self.patient_cache.remove(patient_id)
+        self.name_index.remove(ObjectId(patient_id))
+        # told even when the name isn't held here, a load running now may have read it
+        self.name_prefixes.remove(ObjectId(patient_id), old.get("name") if old is not None else None)
+        if self.patient_view.selected_id() == patient_id:
+            self.patient_view.clear_selection()
+            self.clear_form()
+        self.patient_view.remove(patient_id)
+
+    def reload_patients(self):
+        # everything that holds patients is out of date
+        self.patient_cache.clear()
+        self.worker.submit(None, self.name_index.load, patients_col)
+        self.worker.submit(None, self.name_prefixes.load, patients_col)
+        self.refresh_patient_list()
+
+    def reload_appointments(self):
+        self.refresh_appointments()
+        if self.calendar.window is not None:
+            self.calendar.reload()
+
+    def show_busy(self, busy):
+        if busy:
+            self.busy_label.config(text="Loading...")
+            self.busy_bar.pack(side=tk.LEFT, padx=10)
+            self.busy_bar.start(10)
+            self.root.config(cursor="watch")
+        else:
+            self.busy_label.config(text="")
+            self.busy_bar.stop()
+            self.busy_bar.pack_forget()
+            self.root.config(cursor="")
+
+    def show_error(self, message):
+        return lambda e: messagebox.showerror("Error", f"{message}: {str(e)}")
+
+    def on_close(self):
+        self.worker.shutdown()
+        try:
+            # whatever is still queued is written before the connection goes
+            self.audit.close()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to write audit logs: {str(e)}")
+        if perf.ENABLED and perf.LOG_PATH:
+            try:
+                perf.RECORDER.dump(perf.LOG_PATH)
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to write the performance log: {str(e)}")
+        self.root.destroy()
+        db.close()
 
     # patient management tabs
     def create_patient_tab(self):
@@ -98,15 +293,19 @@ class PatientRegistryApp:
         self.patient_tree.column("gender", width=100)
         self.patient_tree.column("insurance", width=150)
         
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.patient_tree.yview)
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical")
         scrollbar.pack(side="right", fill="y")
 
-        self.patient_tree.configure(yscrollcommand=scrollbar.set)
-
         self.patient_tree.pack(fill=tk.BOTH, expand=True)
         
         self.patient_tree.bind("<ButtonRelease-1>", self.load_selected_patient)
-        self.refresh_patient_list()
+
+        # only the rows on screen are Treeview items, pages come from the server as you scroll
+        self.patient_pager = KeysetPager(patients_col, projection=patient_cache.PROJECTION, sort_field="name",
+                                         cache=self.patient_cache)
+        self.patient_view = VirtualTree(self.patient_tree, scrollbar, self.patient_pager,
+                                        self.patient_row_values, sort_columns=PATIENT_SORT_FIELDS,
+                                        run=self.run_view, name="patients")
 
     def add_patient(self):
         try:
@@ -115,29 +314,35 @@ class PatientRegistryApp:
                 "age": int(self.age_entry.get()) if self.age_entry.get().isdigit() else 0,
                 "gender": self.gender_entry.get(),
                 "insurance": self.insurance_entry.get(),
-                "medical_history": self.medical_history_entry.get("1.0", tk.END).strip(),
-                "registration_date": datetime.now()
+                "medical_history": self.medical_history_entry.get("1.0", tk.END).strip()
             }
 
             # error handling name part
             if not patient_data["name"]:
                 raise ValueError("Name cannot be empty")
-            
-            result = patients_col.insert_one(patient_data)
-            self.log_audit(f"Added patient: {patient_data['name']} (ID: {result.inserted_id})")
-            self.refresh_patient_list()
-            self.clear_form()
-            messagebox.showinfo("Success", "Patient added successfully!")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to add patient: {str(e)}")
+            return
+
+        def save():
+            patient = self.service.add_patient(patient_data)
+            self.name_prefixes.add(patient["_id"], patient["name"])
+            return self.patient_cache.store(patient)
+
+        def saved(patient):
+            self.patient_view.insert(patient)
+            self.clear_form()
+            messagebox.showinfo("Success", "Patient added successfully!")
+
+        self.worker.submit(None, save, on_done=saved, on_error=self.show_error("Failed to add patient"))
 
     def update_patient(self):
         try:
-            selected = self.patient_tree.selection()
-            if not selected:
+            # the selected row may have scrolled out of the rendered window
+            patient_id = self.patient_view.selected_id()
+            if not patient_id:
                 raise ValueError("No patient selected")
             
-            patient_id = self.patient_tree.item(selected)["values"][0]
             updates = {
                 "name": self.name_entry.get(),
                 "age": int(self.age_entry.get()) if self.age_entry.get().isdigit() else 0,
@@ -145,61 +350,100 @@ class PatientRegistryApp:
                 "insurance": self.insurance_entry.get(),
                 "medical_history": self.medical_history_entry.get("1.0", tk.END).strip()
             }
-            
-            patients_col.update_one({"_id": ObjectId(patient_id)}, {"$set": updates})
-            self.log_audit(f"Updated patient ID: {patient_id}")
-            self.refresh_patient_list()
-            messagebox.showinfo("Success", "Patient updated!")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to update patient: {str(e)}")
+            return
+
+        def save():
+            before, after = self.service.update_patient(patient_id, updates)
+            if before:
+                self.name_prefixes.change(before["_id"], before.get("name"), updates["name"])
+                self.patient_cache.store(after)
+            else:
+                self.patient_cache.remove(patient_id)
+            return before
+
+        def saved(before):
+            if before is None:
+                # deleted meanwhile, at this station or another one
+                self.patient_view.clear_selection()
+                self.patient_view.remove(patient_id)
+                self.clear_form()
+                messagebox.showerror("Error", "Failed to update patient: Patient not found")
+                return
+            self.patient_view.update(dict(updates, _id=ObjectId(patient_id)))
+            messagebox.showinfo("Success", "Patient updated!")
+
+        self.worker.submit(None, save, on_done=saved, on_error=self.show_error("Failed to update patient"))
 
     def delete_patient(self):
-        try:
-            selected = self.patient_tree.selection()
-            if not selected:
-                raise ValueError("No patient selected")
-            
-            patient_id = self.patient_tree.item(selected)["values"][0]
-            patients_col.delete_one({"_id": ObjectId(patient_id)})
-            self.log_audit(f"Deleted patient ID: {patient_id}")
-            self.refresh_patient_list()
+        # the selected row may have scrolled out of the rendered window
+        patient_id = self.patient_view.selected_id()
+        if not patient_id:
+            messagebox.showerror("Error", "Failed to delete patient: No patient selected")
+            return
+
+        def delete():
+            before = self.service.delete_patient(patient_id)
+            self.patient_cache.remove(patient_id)
+            if before:
+                self.name_prefixes.remove(before["_id"], before.get("name"))
+            return before
+
+        def deleted(before):
+            self.patient_view.clear_selection()
+            self.patient_view.remove(patient_id)
             self.clear_form()
+            if before is None:
+                # deleted meanwhile at another station
+                messagebox.showerror("Error", "Failed to delete patient: Patient not found")
+                return
             messagebox.showinfo("Success", "Patient deleted!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to delete patient: {str(e)}")
+
+        self.worker.submit(None, delete, on_done=deleted, on_error=self.show_error("Failed to delete patient"))
 
     def refresh_patient_list(self):
-        self.patient_tree.delete(*self.patient_tree.get_children())
-        for patient in patients_col.find():
-            self.patient_tree.insert("", tk.END, values=(
-                str(patient["_id"]),
-                patient.get("name", "N/A"),
-                patient.get("age", "N/A"),
-                patient.get("gender", "N/A"),
-                patient.get("insurance", "N/A")
-            ))
+        self.patient_view.reload()
+
+    def run_view(self, view, fn, on_done):
+        self.worker.submit(view, fn, on_done=on_done, on_error=self.show_error(f"Failed to load {view}"))
+
+    def patient_row_values(self, patient):
+        return (
+            str(patient["_id"]),
+            patient.get("name", "N/A"),
+            patient.get("age", "N/A"),
+            patient.get("gender", "N/A"),
+            patient.get("insurance", "N/A")
+        )
 
     def load_selected_patient(self, event):
-        try:
-            selected = self.patient_tree.selection()
-            if not selected:
-                return
-            
-            patient_id = self.patient_tree.item(selected)["values"][0]
-            patient = patients_col.find_one({"_id": ObjectId(patient_id)})
-            
+        selected = self.patient_tree.selection()
+        if not selected:
+            return
+        
+        patient_id = self.patient_tree.item(selected)["values"][0]
+
+        def load():
+            patient = self.patient_cache.fetch(patient_id)
             if not patient:
                 raise ValueError("Patient not found in database")
-            
+            return patient
+
+        def show(patient):
             self.clear_form()
             self.name_entry.insert(0, patient.get("name", ""))
             self.age_entry.insert(0, str(patient.get("age", "")))
             self.gender_entry.set(patient.get("gender", "Other"))
             self.insurance_entry.set(patient.get("insurance", "None"))
             self.medical_history_entry.insert("1.0", patient.get("medical_history", ""))
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load patient: {str(e)}")
+
+        # the rows on screen came through the cache, so the click normally needs no query
+        patient = self.patient_cache.get(patient_id)
+        if patient is not None:
+            show(patient)
+            return
+        self.worker.submit("patient_form", load, on_done=show, on_error=self.show_error("Failed to load patient"))
 
     def clear_form(self):
         self.name_entry.delete(0, tk.END)
@@ -220,8 +464,6 @@ class PatientRegistryApp:
         self.search_name_entry = tk.Entry(search_frame, font=('Arial', 12), width=30)
         self.search_name_entry.grid(row=0, column=1, padx=10, pady=10)
 
-        tk.Button(search_frame, text="Search", command=self.search_by_name, font=('Arial', 12), width=10).grid(row=0, column=2, padx=10, pady=10)
-
         tk.Label(search_frame, text="Age Range:", font=('Arial', 12)).grid(row=1, column=0, padx=10, pady=10)
         self.min_age_entry = tk.Entry(search_frame, font=('Arial', 12), width=10)
         self.min_age_entry.grid(row=1, column=1, padx=10, pady=10)
@@ -229,8 +471,6 @@ class PatientRegistryApp:
         self.max_age_entry = tk.Entry(search_frame, font=('Arial', 12), width=10)
         self.max_age_entry.grid(row=1, column=3, padx=10, pady=10)
 
-        tk.Button(search_frame, text="Filter Age", command=self.filter_by_age, font=('Arial', 12), width=10).grid(row=1, column=4, padx=10, pady=10)
-
         tk.Label(search_frame, text="From (YYYY-MM-DD):", font=('Arial', 12)).grid(row=2, column=0, padx=10, pady=10)
 
         self.from_date_entry = tk.Entry(search_frame, font=('Arial', 12), width=15)
@@ -240,14 +480,20 @@ class PatientRegistryApp:
         self.to_date_entry = tk.Entry(search_frame, font=('Arial', 12), width=15)
 
         self.to_date_entry.grid(row=2, column=3, padx=10, pady=10)
-        tk.Button(search_frame, text="Filter Date", command=self.filter_by_date, font=('Arial', 12), width=10).grid(row=2, column=4, padx=10, pady=10)
 
         tk.Label(search_frame, text="Insurance:", font=('Arial', 12)).grid(row=3, column=0, padx=10, pady=10)
         self.search_insurance_entry = ttk.Combobox(search_frame, values=["All", "Private", "Medicare", "Medicaid", "None"], font=('Arial', 12), width=10)
         self.search_insurance_entry.grid(row=3, column=1, padx=10, pady=10)
         self.search_insurance_entry.set("All")
 
-        tk.Button(search_frame, text="Filter Insurance", command=self.filter_by_insurance, font=('Arial', 12), width=15).grid(row=3, column=2, columnspan=2, padx=10, pady=10)
+        # every filled in field is part of one search, narrow searches within the current results
+        search_buttons = ttk.Frame(search_frame)
+        search_buttons.grid(row=4, column=0, columnspan=4, pady=10, sticky='w')
+        tk.Button(search_buttons, text="Search", command=self.run_search, font=('Arial', 12), width=10).grid(row=0, column=0, padx=10)
+        tk.Button(search_buttons, text="Narrow Results", command=lambda: self.run_search(narrow=True), font=('Arial', 12), width=15).grid(row=0, column=1, padx=10)
+        tk.Button(search_buttons, text="Clear", command=self.clear_search, font=('Arial', 12), width=10).grid(row=0, column=2, padx=10)
+        self.search_count_label = tk.Label(search_buttons, text="", font=('Arial', 12))
+        self.search_count_label.grid(row=0, column=3, padx=10)
 
         self.search_tree = ttk.Treeview(tab, columns=("id", "name", "age", "gender", "insurance", "reg_date"), show="headings", height=15)
         self.search_tree.heading("id", text="ID")
@@ -263,66 +509,95 @@ class PatientRegistryApp:
         self.search_tree.column("insurance", width=120)
         self.search_tree.column("reg_date", width=150)
         
-        scrollbar = ttk.Scrollbar(tab, orient="vertical", command=self.search_tree.yview)
+        scrollbar = ttk.Scrollbar(tab, orient="vertical")
 
         scrollbar.pack(side="right", fill="y")
-        self.search_tree.configure(yscrollcommand=scrollbar.set)
         self.search_tree.pack(fill=tk.BOTH, expand=True, padx=15, pady=15)
 
-    def search_by_name(self):
-
+        # results are paged like the patient list, the count stops at SEARCH_COUNT_LIMIT
+        # and keeps going as you scroll towards the end. a name search pages through the
+        # name index's matches best first (every one of them, counted exactly) until a
+        # column is clicked
+        self.search_query = search_query.NOTHING
+        self.search_ids = None
+        self.search_pager = KeysetPager(patients_col, query=self.search_query, projection=patient_cache.PROJECTION,
+                                        sort_field="name", count_limit=SEARCH_COUNT_LIMIT, cache=self.patient_cache)
+        self.search_view = VirtualTree(self.search_tree, scrollbar, self.search_pager,
+                                       self.search_row_values, sort_columns=PATIENT_SORT_FIELDS,
+                                       run=self.run_view, name="search", on_total=self.show_search_count)
+
+    def search_criteria(self):
+        # reads the form on the Tk thread, raises ValueError for anything malformed
+        def age(entry):
+            text = entry.get().strip()
+            if text and not text.isdigit():
+                raise ValueError("Age must be a whole number")
+            return int(text) if text else None
+
+        def date(entry):
+            text = entry.get().strip()
+            try:
+                return datetime.strptime(text, "%Y-%m-%d") if text else None
+            except ValueError:
+                raise ValueError("Invalid date format. Use YYYY-MM-DD")
+
+        return {
+            "name": self.search_name_entry.get().strip(),
+            "min_age": age(self.min_age_entry),
+            "max_age": age(self.max_age_entry),
+            "from_date": date(self.from_date_entry),
+            "to_date": date(self.to_date_entry),
+            "insurance": self.search_insurance_entry.get(),
+        }
+
+    def run_search(self, narrow=False):
         try:
-            query = {"name": {"$regex": self.search_name_entry.get(), "$options": "i"}}
-            self.display_search_results(patients_col.find(query))
-        except Exception as e:
+            criteria = self.search_criteria()
+        except ValueError as e:
             messagebox.showerror("Error", f"Search failed: {str(e)}")
-
-    def filter_by_age(self):
-
-
-        try:
-            min_age = int(self.min_age_entry.get()) if self.min_age_entry.get().isdigit() else 0
-            max_age = int(self.max_age_entry.get()) if self.max_age_entry.get().isdigit() else 100
-            query = {"age": {"$gte": min_age, "$lte": max_age}}
-            self.display_search_results(patients_col.find(query))
-        except Exception as e:
-            messagebox.showerror("Error", f"Age filter failed: {str(e)}")
-
-    def filter_by_date(self):
-        try:
-            from_date = datetime.strptime(self.from_date_entry.get(), "%Y-%m-%d") if self.from_date_entry.get() else datetime.min
-            to_date = datetime.strptime(self.to_date_entry.get(), "%Y-%m-%d") if self.to_date_entry.get() else datetime.max
-            query = {"registration_date": {"$gte": from_date, "$lte": to_date}}
-            self.display_search_results(patients_col.find(query))
-        except ValueError:
-            messagebox.showerror("Error", "Invalid date format. Use YYYY-MM-DD")
-        except Exception as e:
-            messagebox.showerror("Error", f"Date filter failed: {str(e)}")
-
-    def filter_by_insurance(self):
-
-        try:
-            insurance = self.search_insurance_entry.get()
-            if insurance == "All":
-                self.display_search_results(patients_col.find())
-            else:
-                query = {"insurance": insurance}
-                self.display_search_results(patients_col.find(query))
-        except Exception as e:
-            messagebox.showerror("Error", f"Insurance filter failed: {str(e)}")
-
-    def display_search_results(self, cursor):
-        self.search_tree.delete(*self.search_tree.get_children())
-        for patient in cursor:
-
-            self.search_tree.insert("", tk.END, values=(
-                str(patient["_id"]),
-                patient.get("name", "N/A"),
-                patient.get("age", "N/A"),
-                patient.get("gender", "N/A"),
-                patient.get("insurance", "N/A"),
-                patient.get("registration_date", "N/A").strftime("%Y-%m-%d") if hasattr(patient.get("registration_date"), "strftime") else "N/A"
-            ))
+            return
+        within = None
+        if narrow and self.search_query is not search_query.NOTHING:
+            within = (self.search_query, self.search_ids)
+
+        def build():
+            # the name is matched here, off the Tk thread, against the in-memory index
+            name = criteria.pop("name")
+            return search_query.resolve(name, self.name_index, patients_col, within, **criteria)
+
+        def show(result):
+            self.search_query, self.search_ids = result
+            self.search_view.set_query(self.search_query, self.search_ids)
+
+        # a newer search replaces one that is still running
+        self.worker.submit("search", build, on_done=show, on_error=self.show_error("Search failed"))
+
+    def clear_search(self):
+        self.search_name_entry.delete(0, tk.END)
+        self.min_age_entry.delete(0, tk.END)
+        self.max_age_entry.delete(0, tk.END)
+        self.from_date_entry.delete(0, tk.END)
+        self.to_date_entry.delete(0, tk.END)
+        self.search_insurance_entry.set("All")
+        self.search_query = search_query.NOTHING
+        self.search_ids = None
+        self.search_view.set_query(self.search_query)
+
+    def show_search_count(self, total, capped):
+        if self.search_query is search_query.NOTHING:
+            self.search_count_label.config(text="")
+        else:
+            self.search_count_label.config(text=f"{total:,}{'+' if capped else ''} patients found")
+
+    def search_row_values(self, patient):
+        return (
+            str(patient["_id"]),
+            patient.get("name", "N/A"),
+            patient.get("age", "N/A"),
+            patient.get("gender", "N/A"),
+            patient.get("insurance", "N/A"),
+            patient.get("registration_date", "N/A").strftime("%Y-%m-%d") if hasattr(patient.get("registration_date"), "strftime") else "N/A"
+        )
 
     # Dashboard
     def create_dashboard_tab(self):
@@ -349,200 +624,109 @@ class PatientRegistryApp:
         self.total_revenue_label = tk.Label(stats_frame, text="$0", font=("Arial", 16, "bold"))
         self.total_revenue_label.grid(row=0, column=7, padx=10, pady=5, sticky='w')
 
-        graph_notebook = ttk.Notebook(tab)
-        graph_notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-
-        # creating the tabs
-        gender_tab = ttk.Frame(graph_notebook)
-        self.gender_fig, self.gender_ax = plt.subplots(figsize=(6, 4))
-        self.gender_canvas = FigureCanvasTkAgg(self.gender_fig, master=gender_tab)
-        self.gender_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        graph_notebook.add(gender_tab, text="Gender Distribution")
-        age_tab = ttk.Frame(graph_notebook)
-        self.age_fig, self.age_ax = plt.subplots(figsize=(6, 4))
-        self.age_canvas = FigureCanvasTkAgg(self.age_fig, master=age_tab)
-        self.age_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        graph_notebook.add(age_tab, text="Age Distribution")
-        insurance_tab = ttk.Frame(graph_notebook)
-        self.insurance_fig, self.insurance_ax = plt.subplots(figsize=(6, 4))
-        self.insurance_canvas = FigureCanvasTkAgg(self.insurance_fig, master=insurance_tab)
-        self.insurance_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        graph_notebook.add(insurance_tab, text="Insurance Distribution")
-
-        appointments_tab = ttk.Frame(graph_notebook)
-        self.appointments_fig, self.appointments_ax = plt.subplots(figsize=(6, 4))
-        self.appointments_canvas = FigureCanvasTkAgg(self.appointments_fig, master=appointments_tab)
-        self.appointments_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        graph_notebook.add(appointments_tab, text="Appointments Trend")
-
-        registration_tab = ttk.Frame(graph_notebook)
-        self.registration_fig, self.registration_ax = plt.subplots(figsize=(6, 4))
-        self.registration_canvas = FigureCanvasTkAgg(self.registration_fig, master=registration_tab)
-        self.registration_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        graph_notebook.add(registration_tab, text="Registration Trend")
-
-        revenue_tab = ttk.Frame(graph_notebook)
-        self.revenue_fig, self.revenue_ax = plt.subplots(figsize=(6, 4))
-        self.revenue_canvas = FigureCanvasTkAgg(self.revenue_fig, master=revenue_tab)
-        self.revenue_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        graph_notebook.add(revenue_tab, text="Revenue by Type")
+        self.graph_notebook = ttk.Notebook(tab)
+        self.graph_notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        # creating the tabs, a chart's figure and canvas are only built when its tab is first shown
+        self.chart_tabs = []
+        for chart_class in charts.CHARTS:
+            chart_tab = ttk.Frame(self.graph_notebook)
+            self.graph_notebook.add(chart_tab, text=chart_class.title)
+            self.chart_tabs.append((chart_tab, chart_class))
+        self.graph_notebook.bind("<<NotebookTabChanged>>", lambda e: self.show_visible_chart())
+
+        # chart name -> (chart, canvas) once built, and the dashboard version it last drew
+        self.charts = {}
+        self.chart_versions = {}
+        self.dashboard_version = 0
+        self.dashboard_data = None
+        self.dashboard_tab = tab
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
 
         # To refresh the data, the ffunction afterwards will be responsible for making the updates to the dashboard
-        tk.Button(tab, text="Refresh Dashboard", command=self.update_dashboard, font=('Arial', 12), height=1, width=20).pack(pady=10)
+        button_frame = ttk.Frame(tab)
+        button_frame.pack(pady=10)
+        tk.Button(button_frame, text="Refresh Dashboard", command=self.update_dashboard, font=('Arial', 12), height=1, width=20).grid(row=0, column=0, padx=5)
+        # recounts the running totals from the raw collections if they ever drift
+        tk.Button(button_frame, text="Rebuild Counters", command=self.rebuild_counters, font=('Arial', 12), height=1, width=20).grid(row=0, column=1, padx=5)
+
+    def on_tab_changed(self, event):
+        # the dashboard loads the first time it's opened rather than at startup
+        if self.notebook.select() == str(self.dashboard_tab) and self.dashboard_version == 0:
+            self.update_dashboard()
+        if self.notebook.select() == str(self.performance_tab) and self.performance_job is None:
+            self.refresh_performance()
 
     def update_dashboard(self):
-        try:
-            total_patients = patients_col.count_documents({})
-            self.total_patients_label.config(text=str(total_patients))
-            
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            tomorrow = today.replace(day=today.day + 1)
-            today_appointments = appointments_col.count_documents({
-                "date": {"$gte": today, "$lt": tomorrow}
-            })
-            self.today_appointments_label.config(text=str(today_appointments))
-            
-            pipeline = [
-                {"$group": {"_id": None, "avgAge": {"$avg": "$age"}}}
-            ]
-            avg_age_result = list(patients_col.aggregate(pipeline))
-            avg_age = avg_age_result[0]["avgAge"] if avg_age_result else 0
-            self.avg_age_label.config(text=f"{avg_age:.1f} years")
-
-            pipeline = [
-                {"$match": {"status": "Completed"}},
-                {"$group": {"_id": None, "total": {"$sum": "$bill_amount"}}}
-            ]
-            revenue_result = list(appointments_col.aggregate(pipeline))
-            total_revenue = revenue_result[0]["total"] if revenue_result else 0
-            self.total_revenue_label.config(text=f"${total_revenue:,.2f}")
-            male = patients_col.count_documents({"gender": "Male"})
-            female = patients_col.count_documents({"gender": "Female"})
-            other = patients_col.count_documents({"gender": "Other"})
-            
-            self.gender_ax.clear()
-            if male + female + other > 0:
-                self.gender_ax.pie([male, female, other], 
-                                 labels=["Male", "Female", "Other"], 
-                                 autopct="%1.1f%%",
-                                 colors=['lightblue', 'lightpink', 'lightgray'])
-                self.gender_ax.set_title("Gender Distribution", fontsize=12)
-            else:
-                self.gender_ax.text(0.5, 0.5, "No data available", ha="center", fontsize=12)
-            self.gender_canvas.draw()
-
-            ages = [p.get('age', 0) for p in patients_col.find({}, {'age': 1})]
-            self.age_ax.clear()
-
-            if ages:
-                bins = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
-                self.age_ax.hist(ages, bins=bins, edgecolor='black', color='skyblue')
-                self.age_ax.set_title("Age Distribution", fontsize=12)
-                self.age_ax.set_xlabel("Age")
-                self.age_ax.set_ylabel("Number of Patients")
-                self.age_ax.grid(axis='y', alpha=0.5)
-            else:
-                self.age_ax.text(0.5, 0.5, "No data available", ha="center", fontsize=12)
-            self.age_canvas.draw()
-
-            insurance_counts = patients_col.aggregate([
-                {"$group": {"_id": "$insurance", "count": {"$sum": 1}}}
-            ])
-            insurance_data = {item["_id"]: item["count"] for item in insurance_counts}
-            
-            self.insurance_ax.clear()
-            if insurance_data:
-                labels = list(insurance_data.keys())
-                values = list(insurance_data.values())
-                colors = ['gold', 'lightgreen', 'lightcoral', 'lightskyblue']
-                self.insurance_ax.pie(values, labels=labels, autopct="%1.1f%%", colors=colors[:len(values)])
-                self.insurance_ax.set_title("Insurance Distribution", fontsize=12)
-            else:
-                self.insurance_ax.text(0.5, 0.5, "No data available", ha="center", fontsize=12)
-            self.insurance_canvas.draw()
-            pipeline = [
-                {"$group": {
-                    "_id": {"year": {"$year": "$date"}, "month": {"$month": "$date"}},
-                    "count": {"$sum": 1}
-                }},
-                {"$sort": {"_id.year": 1, "_id.month": 1}}
-            ]
-            appointments_data = list(appointments_col.aggregate(pipeline))
-            
-            self.appointments_ax.clear()
-            if appointments_data:
-                months = [f"{item['_id']['month']}/{item['_id']['year']}" for item in appointments_data]
-                counts = [item['count'] for item in appointments_data]
-                
-                self.appointments_ax.bar(months, counts, color='mediumseagreen')
-                self.appointments_ax.set_title("Appointments by Month", fontsize=12)
-                self.appointments_ax.set_xlabel("Month/Year")
-                self.appointments_ax.set_ylabel("Number of Appointments")
-                self.appointments_ax.tick_params(axis='x', rotation=45)
-                self.appointments_ax.grid(axis='y', alpha=0.5)
-            else:
-                self.appointments_ax.text(0.5, 0.5, "No data available", ha="center", fontsize=12)
-            self.appointments_canvas.draw()
-            pipeline = [
-                {"$group": {
-                    "_id": {"year": {"$year": "$registration_date"}, "month": {"$month": "$registration_date"}},
-                    "count": {"$sum": 1}
-                }},
-                {"$sort": {"_id.year": 1, "_id.month": 1}}
-            ]
-            registration_data = list(patients_col.aggregate(pipeline))
-            
-            self.registration_ax.clear()
-            if registration_data:
-                months = [f"{item['_id']['month']}/{item['_id']['year']}" for item in registration_data]
-                counts = [item['count'] for item in registration_data]
-                
-                self.registration_ax.plot(months, counts, marker='o', color='royalblue')
-                self.registration_ax.set_title("Patient Registration Trend", fontsize=12)
-                self.registration_ax.set_xlabel("Month/Year")
-                self.registration_ax.set_ylabel("Number of Registrations")
-                self.registration_ax.tick_params(axis='x', rotation=45)
-                self.registration_ax.grid(alpha=0.5)
-            else:
-                self.registration_ax.text(0.5, 0.5, "No data available", ha="center", fontsize=12)
-            self.registration_canvas.draw()
-
-            pipeline = [
-                {"$match": {"status": "Completed"}},
-                {"$group": {
-                    "_id": "$consultation_type",
-                    "total": {"$sum": "$bill_amount"},
-                    "count": {"$sum": 1}
-                }},
-                {"$sort": {"total": -1}}
-            ]
-
-            revenue_data = list(appointments_col.aggregate(pipeline))
-            
-            self.revenue_ax.clear()
-            if revenue_data:
-                types = [item["_id"] for item in revenue_data]
-                amounts = [item["total"] for item in revenue_data]
-                
-                bars = self.revenue_ax.bar(types, amounts, color='teal')
-                self.revenue_ax.set_title("Revenue by Consultation Type", fontsize=12)
-                self.revenue_ax.set_xlabel("Consultation Type")
-                self.revenue_ax.set_ylabel("Total Revenue ($)")
-                self.revenue_ax.tick_params(axis='x', rotation=45)
-                self.revenue_ax.grid(axis='y', alpha=0.5)
-                
-                # Add value labels on top of bars
-                for bar in bars:
-                    height = bar.get_height()
-                    self.revenue_ax.text(bar.get_x() + bar.get_width()/2., height,
-                                       f'${height:,.2f}',
-                                       ha='center', va='bottom')
-            else:
-                self.revenue_ax.text(0.5, 0.5, "No revenue data available", ha="center", fontsize=12)
-            self.revenue_canvas.draw()
-
-        except Exception as e:
-            messagebox.showerror("Error", f"Dashboard update failed: {str(e)}")
+        # every chart goes stale, only the headline figures and the visible chart are loaded now
+        self.dashboard_version += 1
+        self.dashboard_data = None
+        version = self.dashboard_version
+        chart_class = self.visible_chart()[1]
+        self.worker.submit("dashboard", self.load_dashboard_data, chart_class.facets,
+                           on_done=lambda data: self.dashboard_loaded(version, data),
+                           on_error=self.show_error("Dashboard update failed"))
+
+    # runs on the worker
+    def load_dashboard_data(self, facets=()):
+        return analytics.load_dashboard(patients_col, appointments_col, stats_col, facets)
+
+    def rebuild_counters(self):
+        self.worker.submit(None, counters.rebuild, patients_col, appointments_col, stats_col,
+                           on_done=lambda stats: self.update_dashboard(),
+                           on_error=self.show_error("Counter rebuild failed"))
+
+    def dashboard_loaded(self, version, data):
+        if version != self.dashboard_version:
+            return
+        self.dashboard_data = data
+        self.total_patients_label.config(text=str(data["total_patients"]))
+        self.today_appointments_label.config(text=str(data["today"]))
+        self.avg_age_label.config(text=f"{data['avg_age']:.1f} years")
+        self.total_revenue_label.config(text=f"${data['total_revenue']:,.2f}")
+        self.show_visible_chart()
+
+    def visible_chart(self):
+        return self.chart_tabs[self.graph_notebook.index("current")]
+
+    def show_visible_chart(self):
+        if self.dashboard_data is None:
+            # a refresh is still loading and will draw the visible chart when it lands
+            return
+        chart_tab, chart_class = self.visible_chart()
+        if self.chart_versions.get(chart_class.name) == self.dashboard_version:
+            return
+
+        version = self.dashboard_version
+        missing = [name for name in chart_class.facets if name not in self.dashboard_data]
+        if not missing:
+            self.draw_chart(chart_tab, chart_class)
+            return
+
+        def loaded(data):
+            if version == self.dashboard_version and self.dashboard_data is not None:
+                self.dashboard_data.update(data)
+                self.show_visible_chart()
+
+        self.worker.submit("dashboard", analytics.load_facets, patients_col, appointments_col, missing,
+                           on_done=loaded, on_error=self.show_error("Dashboard update failed"))
+
+    def draw_chart(self, chart_tab, chart_class):
+        if chart_class.name not in self.charts:
+            # matplotlib is only loaded when the first chart is shown
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            chart = chart_class()
+            canvas = FigureCanvasTkAgg(chart.figure, master=chart_tab)
+            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+            # the paint itself happens when draw_idle's turn comes, that's the call timed
+            canvas.draw = perf.wrap(canvas.draw, "draw", f"{chart_class.name} chart")
+            self.charts[chart_class.name] = (chart, canvas)
+        chart, canvas = self.charts[chart_class.name]
+        with perf.timed("render", f"{chart_class.name} chart"):
+            chart.draw(self.dashboard_data)
+        # coalesced with any other pending redraw into one paint when Tk is idle
+        canvas.draw_idle()
+        self.chart_versions[chart_class.name] = self.dashboard_version
 
     def create_appointments_tab(self):
         tab = ttk.Frame(self.notebook)
@@ -584,8 +768,11 @@ class PatientRegistryApp:
         tk.Button(button_frame, text="Schedule", command=self.schedule_appointment, font=('Arial', 12), height=1, width=15).grid(row=0, column=0, padx=5)
         tk.Button(button_frame, text="Mark Completed", command=self.mark_appointment_completed, font=('Arial', 12), height=1, width=15).grid(row=0, column=1, padx=5)
         tk.Button(button_frame, text="Cancel", command=self.cancel_appointment, font=('Arial', 12), height=1, width=15).grid(row=0, column=2, padx=5)
-        list_frame = ttk.Frame(tab)
-        list_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=10, pady=10)
+        # the flat list and a day/week calendar of the same appointments
+        self.appointment_views = ttk.Notebook(tab)
+        self.appointment_views.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=10, pady=10)
+        list_frame = ttk.Frame(self.appointment_views)
+        self.appointment_views.add(list_frame, text="List")
 
         self.appointments_tree = ttk.Treeview(list_frame, columns=(
             "id", "patient_name", "date", "time", "type", "status", "bill"
@@ -607,12 +794,17 @@ class PatientRegistryApp:
         self.appointments_tree.column("status", width=100)
         self.appointments_tree.column("bill", width=80)
         
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.appointments_tree.yview)
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical")
         scrollbar.pack(side="right", fill="y")
-        self.appointments_tree.configure(yscrollcommand=scrollbar.set)
         self.appointments_tree.pack(fill=tk.BOTH, expand=True)
         self.appointments_tree.bind("<ButtonRelease-1>", self.load_selected_appointment)
 
+        # by start time, keyset paged on (start, _id) like the patient list
+        self.appointment_pager = KeysetPager(appointments_col, projection=APPOINTMENT_LIST_PROJECTION,
+                                             sort_field="start")
+        self.appointment_view = VirtualTree(self.appointments_tree, scrollbar, self.appointment_pager,
+                                            self.appointment_row_values, run=self.run_view, name="appointments")
+
         filter_frame = ttk.Frame(list_frame)
         filter_frame.pack(fill=tk.X, pady=5)
 
@@ -625,17 +817,48 @@ class PatientRegistryApp:
         
         tk.Button(filter_frame, text="Apply Filter", command=self.refresh_appointments, 
                  font=('Arial', 10), width=10).pack(side=tk.LEFT, padx=5)
-        
-        self.refresh_appointments()
+
+        self.calendar = CalendarView(self.appointment_views, self.load_calendar_window, self.run_view,
+                                     on_select=self.load_appointment)
+        self.appointment_views.add(self.calendar.frame, text="Calendar")
+        self.appointment_views.bind("<<NotebookTabChanged>>", self.on_appointment_view_changed)
+
+    def on_appointment_view_changed(self, event):
+        # the calendar loads its first week when it's opened
+        if self.appointment_views.select() == str(self.calendar.frame) and self.calendar.window is None:
+            self.calendar.reload()
+
+    def load_calendar_window(self, start, end):
+        return list(appointments_col.find(schedule.overlap_query(start, end), CALENDAR_PROJECTION))
 
     def update_patient_suggestions(self, event):
+        # wait for a pause in typing instead of looking up every keystroke
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        if self.suggestion_job is not None:
+            self.root.after_cancel(self.suggestion_job)
+        self.suggestion_job = self.root.after(SUGGESTION_DELAY_MS, self.show_patient_suggestions)
+
+    def show_patient_suggestions(self):
+        self.suggestion_job = None
         query = self.appointment_patient_name.get()
-        if len(query) >= 2:
-            patients = patients_col.find(
-                {"name": {"$regex": f"^{query}", "$options": "i"}},
-                {"name": 1}
-            ).limit(10)
-            self.appointment_patient_name['values'] = [p['name'] for p in patients]
+        if len(query) >= 2 and self.name_prefixes.ready:
+            # from the in-memory name list, no round trip
+            self.appointment_patient_name['values'] = self.name_prefixes.complete(query)
+        elif len(query) >= 2:
+            def load():
+                # until the name list has loaded, a prefix range on the case-insensitive
+                # name index
+                patients = patients_col.find(
+                    {"name": {"$gte": query, "$lt": query + "\uffff"}},
+                    {"name": 1}
+                ).collation(indexes.NAME_COLLATION).limit(10)
+                return [p['name'] for p in patients]
+
+            def show(names):
+                self.appointment_patient_name['values'] = names
+
+            self.worker.submit("suggestions", load, on_done=show)
 
     def schedule_appointment(self):
         try:
@@ -643,10 +866,6 @@ class PatientRegistryApp:
             if not patient_name:
                 raise ValueError("Patient name is required")
             
-            patient = patients_col.find_one({"name": patient_name})
-            if not patient:
-                raise ValueError("Patient not found")
-            
             appointment_date = datetime.strptime(self.appointment_date.get(), "%Y-%m-%d")
             appointment_time = self.appointment_time.get()
             
@@ -654,75 +873,107 @@ class PatientRegistryApp:
                 datetime.strptime(appointment_time, "%H:%M")
             except ValueError:
                 raise ValueError("Invalid time format. Use HH:MM")
-            
-            appointment_data = {
-                "patient_id": str(patient["_id"]),
-                "patient_name": patient_name,
-                "date": appointment_date,
-                "time": appointment_time,
-                "consultation_type": self.consultation_type.get(),
-                "reason": self.appointment_reason.get("1.0", tk.END).strip(),
-                "bill_amount": float(self.bill_amount.get()) if self.bill_amount.get() else 0,
-                "status": "Scheduled",
-                "created_at": datetime.now()
-            }
-            
-            appointments_col.insert_one(appointment_data)
-            self.log_audit(f"Scheduled appointment for {patient_name}")
-            self.refresh_appointments()
-            self.clear_appointment_form()
-            messagebox.showinfo("Success", "Appointment scheduled!")
+
+            consultation_type = self.consultation_type.get()
+            reason = self.appointment_reason.get("1.0", tk.END).strip()
+            bill_amount = float(self.bill_amount.get()) if self.bill_amount.get() else 0
         except ValueError as e:
             messagebox.showerror("Error", f"Invalid input: {str(e)}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to schedule appointment: {str(e)}")
+            return
+
+        start, end = schedule.slot(appointment_date, appointment_time, consultation_type)
+        # when the calendar has this day loaded the overlap is known right away
+        force = False
+        if self.calendar.covers(start, end):
+            clash = self.calendar.conflicts(start, end)
+            if clash:
+                if not messagebox.askyesno("Conflict", f"This overlaps with:\n{schedule.describe_conflicts(clash)}\n\nSchedule anyway?"):
+                    return
+                force = True
+
+        appointment_data = {
+            "patient_name": patient_name,
+            "date": appointment_date,
+            "time": appointment_time,
+            "consultation_type": consultation_type,
+            "reason": reason,
+            "bill_amount": bill_amount
+        }
+
+        def save(force):
+            # otherwise the server is asked, a range scan of the (start, end) index
+            return self.service.schedule_appointment(appointment_data, force, self.patient_cache.find_by_name)
+
+        def saved(result):
+            appointment, clash = result
+            if clash:
+                if messagebox.askyesno("Conflict", f"This overlaps with:\n{schedule.describe_conflicts(clash)}\n\nSchedule anyway?"):
+                    self.worker.submit(None, save, True, on_done=saved, on_error=failed)
+                return
+            self.appointment_view.insert(appointment)
+            self.calendar.changed(appointment)
+            self.clear_appointment_form()
+            messagebox.showinfo("Success", "Appointment scheduled!")
+
+        def failed(e):
+            if isinstance(e, ValueError):
+                messagebox.showerror("Error", f"Invalid input: {str(e)}")
+            else:
+                messagebox.showerror("Error", f"Failed to schedule appointment: {str(e)}")
+
+        self.worker.submit(None, save, force, on_done=saved, on_error=failed)
 
     def mark_appointment_completed(self):
-        try:
-            selected = self.appointments_tree.selection()
-            if not selected:
-                raise ValueError("No appointment selected")
-            
-            appointment_id = self.appointments_tree.item(selected)["values"][0]
-            appointments_col.update_one(
-                {"_id": ObjectId(appointment_id)},
-                {"$set": {"status": "Completed", "completed_at": datetime.now()}}
-            )
-            self.log_audit(f"Marked appointment as completed: {appointment_id}")
-            self.refresh_appointments()
-            messagebox.showinfo("Success", "Appointment marked as completed!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to update appointment: {str(e)}")
+        self.set_appointment_status("Completed", "Appointment marked as completed!", "Failed to update appointment")
+
+    def set_appointment_status(self, status, success_message, error_message):
+        appointment_id = self.selected_appointment
+        if not appointment_id:
+            messagebox.showerror("Error", f"{error_message}: No appointment selected")
+            return
+
+        def save():
+            before, after = self.service.set_appointment_status(appointment_id, status)
+            return after
+
+        def saved(after):
+            if after is None:
+                # deleted meanwhile at another station
+                self.appointment_view.clear_selection()
+                self.appointment_view.remove(appointment_id)
+                self.calendar.removed(appointment_id)
+                self.selected_appointment = None
+                self.clear_appointment_form()
+                messagebox.showerror("Error", f"{error_message}: Appointment not found")
+                return
+            self.appointment_view.update(after)
+            self.calendar.changed(after)
+            messagebox.showinfo("Success", success_message)
+
+        self.worker.submit(None, save, on_done=saved, on_error=self.show_error(error_message))
 
     def cancel_appointment(self):
-        try:
-            selected = self.appointments_tree.selection()
-            if not selected:
-                raise ValueError("No appointment selected")
-            
-            appointment_id = self.appointments_tree.item(selected)["values"][0]
-            appointments_col.update_one(
-                {"_id": ObjectId(appointment_id)},
-                {"$set": {"status": "Cancelled", "cancelled_at": datetime.now()}}
-            )
-            self.log_audit(f"Cancelled appointment: {appointment_id}")
-            self.refresh_appointments()
-            messagebox.showinfo("Success", "Appointment cancelled!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to cancel appointment: {str(e)}")
+        self.set_appointment_status("Cancelled", "Appointment cancelled!", "Failed to cancel appointment")
 
     def load_selected_appointment(self, event):
-        try:
-            selected = self.appointments_tree.selection()
-            if not selected:
-                return
-            
-            appointment_id = self.appointments_tree.item(selected)["values"][0]
+        selected = self.appointments_tree.selection()
+        if not selected:
+            return
+        
+        self.load_appointment(self.appointments_tree.item(selected)["values"][0])
+
+    def load_appointment(self, appointment_id):
+        appointment_id = self.selected_appointment = str(appointment_id)
+        if self.appointments_tree.exists(appointment_id):
+            self.appointments_tree.selection_set(appointment_id)
+
+        def load():
             appointment = appointments_col.find_one({"_id": ObjectId(appointment_id)})
-            
             if not appointment:
                 raise ValueError("Appointment not found in database")
-            
+            return appointment
+
+        def show(appointment):
             self.clear_appointment_form()
             self.appointment_patient_name.set(appointment.get("patient_name", ""))
             self.appointment_date.insert(0, appointment.get("date", "").strftime("%Y-%m-%d") if hasattr(appointment.get("date"), "strftime") else "")
@@ -730,9 +981,9 @@ class PatientRegistryApp:
             self.consultation_type.set(appointment.get("consultation_type", "General Checkup"))
             self.appointment_reason.insert("1.0", appointment.get("reason", ""))
             self.bill_amount.insert(0, str(appointment.get("bill_amount", 0)))
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load appointment: {str(e)}")
+
+        self.worker.submit("appointment_form", load, on_done=show,
+                           on_error=self.show_error("Failed to load appointment"))
 
     def clear_appointment_form(self):
         self.appointment_patient_name.set('')
@@ -743,21 +994,19 @@ class PatientRegistryApp:
         self.bill_amount.delete(0, tk.END)
 
     def refresh_appointments(self):
-        self.appointments_tree.delete(*self.appointments_tree.get_children())
-        
         status_filter = self.appointment_status_filter.get()
-        query = {} if status_filter == "All" else {"status": status_filter}
-        
-        for appt in appointments_col.find(query).sort("date", 1):
-            self.appointments_tree.insert("", tk.END, values=(
-                str(appt["_id"]),
-                appt.get("patient_name", "N/A"),
-                appt.get("date", "N/A").strftime("%Y-%m-%d") if hasattr(appt.get("date"), "strftime") else "N/A",
-                appt.get("time", "N/A"),
-                appt.get("consultation_type", "N/A"),
-                appt.get("status", "N/A"),
-                f"{appt.get('bill_amount', 0):.2f}"
-            ))
+        self.appointment_view.set_query({} if status_filter == "All" else {"status": status_filter})
+
+    def appointment_row_values(self, appt):
+        return (
+            str(appt["_id"]),
+            appt.get("patient_name", "N/A"),
+            appt.get("date", "N/A").strftime("%Y-%m-%d") if hasattr(appt.get("date"), "strftime") else "N/A",
+            appt.get("time", "N/A"),
+            appt.get("consultation_type", "N/A"),
+            appt.get("status", "N/A"),
+            f"{appt.get('bill_amount', 0):.2f}"
+        )
 
     def create_export_tab(self):
         tab = ttk.Frame(self.notebook)
@@ -782,47 +1031,121 @@ class PatientRegistryApp:
         tk.Button(export_frame, text="Export to JSON", command=lambda: self.export_to_json('appointments'), 
                  font=('Arial', 12), height=2, width=20).grid(row=3, column=1, padx=20, pady=10)
 
-    def export_to_csv(self, collection='patients'):
-        try:
-            file_path = filedialog.asksaveasfilename(
-                defaultextension=".csv",
-                filetypes=[("CSV Files", "*.csv")],
-                title=f"Export {collection} data to CSV"
-            )
-            if not file_path:
-                return
-            
+        options_frame = ttk.Frame(export_frame)
+        options_frame.grid(row=4, column=0, columnspan=2, pady=10)
+        tk.Label(options_frame, text="JSON format:", font=('Arial', 12)).grid(row=0, column=0, padx=5)
+        # NDJSON is one compact document per line, JSON the pretty printed array
+        self.export_json_format = ttk.Combobox(options_frame, values=list(exporters.FORMATS), font=('Arial', 12), width=10, state="readonly")
+        self.export_json_format.grid(row=0, column=1, padx=5)
+        self.export_json_format.set("NDJSON")
+        tk.Label(options_frame, text="Compression:", font=('Arial', 12)).grid(row=0, column=2, padx=5)
+        self.export_compress = ttk.Combobox(options_frame, values=exporters.COMPRESSIONS, font=('Arial', 12), width=10, state="readonly")
+        self.export_compress.grid(row=0, column=3, padx=5)
+        self.export_compress.set("None")
+
+        # exports stream in batches, this shows how far along they are
+        self.export_progress = ttk.Progressbar(export_frame, mode="determinate", length=400)
+        self.export_progress.grid(row=5, column=0, columnspan=2, pady=10)
+        self.export_status = tk.Label(export_frame, text="", font=('Arial', 12))
+        self.export_status.grid(row=6, column=0, columnspan=2)
+
+        # bulk loading from CSV or NDJSON, bad rows go to a .rejects.csv next to the file
+        tk.Label(export_frame, text="Import Data", font=('Arial', 14)).grid(row=7, column=0, columnspan=2, pady=20)
+
+        tk.Button(export_frame, text="Import Patients", command=lambda: self.import_data('patients'),
+                 font=('Arial', 12), height=2, width=20).grid(row=8, column=0, padx=20, pady=10)
+
+        tk.Button(export_frame, text="Import Appointments", command=lambda: self.import_data('appointments'),
+                 font=('Arial', 12), height=2, width=20).grid(row=8, column=1, padx=20, pady=10)
+
+    def show_export_progress(self, rows, total, rate):
+        self.export_progress.config(maximum=max(total or 0, rows, 1), value=rows)
+        self.export_status.config(text=f"{rows:,} rows exported ({rate:,.0f} rows/sec)")
+
+    def import_data(self, collection):
+        file_path = filedialog.askopenfilename(
+            filetypes=[("CSV or NDJSON Files", "*.csv *.ndjson *.jsonl *.gz *.zst"), ("All Files", "*.*")],
+            title=f"Import {collection} data"
+        )
+        if not file_path:
+            return
+
+        def show_progress(imported, rejected):
+            self.export_progress.config(mode="indeterminate")
+            self.export_progress.step(5)
+            self.export_status.config(text=f"{imported:,} {collection} imported, {rejected:,} rejected")
+
+        def load():
+            return importer.import_file(collection, file_path, patients_col, appointments_col, stats_col,
+                                        audit=lambda message: self.log_audit(message, collection),
+                                        on_progress=lambda *args: self.worker.post(show_progress, *args))
+
+        def loaded(result):
+            imported, rejected, rejects_file = result
+            self.export_progress.config(mode="determinate", value=0)
+            self.export_status.config(text=f"{imported:,} {collection} imported, {rejected:,} rejected")
+            # everything that shows these collections is out of date now
             if collection == 'patients':
-                data = list(patients_col.find({}, {"_id": 0}))
+                self.reload_patients()
             else:
-                data = list(appointments_col.find({}, {"_id": 0}))
-            
-            df = pd.DataFrame(data)
-            df.to_csv(file_path, index=False)
-            messagebox.showinfo("Success", f"{collection.capitalize()} data exported to CSV!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export CSV: {str(e)}")
+                self.reload_appointments()
+            if self.dashboard_version:
+                self.update_dashboard()
+            message = f"{imported} {collection} imported, {rejected} rejected"
+            if rejects_file:
+                message += f"\nRejected rows were written to {rejects_file}"
+            messagebox.showinfo("Import finished", message)
+
+        self.export_status.config(text=f"Importing {collection}...")
+        self.worker.submit(None, load, on_done=loaded, on_error=self.show_error("Import failed"))
+
+    def export_finished(self, collection, label):
+        def finished(progress):
+            self.export_status.config(text=f"{progress.rows:,} rows exported in {progress.elapsed():.1f}s "
+                                           f"({progress.rate():,.0f} rows/sec)")
+            messagebox.showinfo("Success", f"{collection.capitalize()} data exported to {label}!")
+        return finished
+
+    def export_to_csv(self, collection='patients'):
+        compress = self.export_compress.get()
+        extension = ".csv" + exporters.EXTENSIONS[compress]
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=extension,
+            filetypes=[("CSV Files", f"*{extension}")],
+            title=f"Export {collection} data to CSV"
+        )
+        if not file_path:
+            return
+
+        def export():
+            source = patients_col if collection == 'patients' else appointments_col
+            return exporters.export_csv(source, collection, file_path, compress=compress,
+                                        on_progress=lambda *args: self.worker.post(self.show_export_progress, *args))
+
+        self.export_status.config(text=f"Exporting {collection}...")
+        self.worker.submit(None, export, on_done=self.export_finished(collection, "CSV"),
+                           on_error=self.show_error("Failed to export CSV"))
 
     def export_to_json(self, collection='patients'):
-        try:
-            file_path = filedialog.asksaveasfilename(
-                defaultextension=".json",
-                filetypes=[("JSON Files", "*.json")],
-                title=f"Export {collection} data to JSON"
-            )
-            if not file_path:
-                return
-            
-            if collection == 'patients':
-                data = list(patients_col.find({}, {"_id": 0}))
-            else:
-                data = list(appointments_col.find({}, {"_id": 0}))
-            
-            with open(file_path, "w") as f:
-                json.dump(data, f, indent=4, default=str)
-            messagebox.showinfo("Success", f"{collection.capitalize()} data exported to JSON!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export JSON: {str(e)}")
+        json_format, compress = self.export_json_format.get(), self.export_compress.get()
+        export_file, extension = exporters.FORMATS[json_format]
+        extension += exporters.EXTENSIONS[compress]
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=extension,
+            filetypes=[(f"{json_format} Files", f"*{extension}")],
+            title=f"Export {collection} data to {json_format}"
+        )
+        if not file_path:
+            return
+
+        def export():
+            source = patients_col if collection == 'patients' else appointments_col
+            return export_file(source, file_path, compress=compress,
+                               on_progress=lambda *args: self.worker.post(self.show_export_progress, *args))
+
+        self.export_status.config(text=f"Exporting {collection}...")
+        self.worker.submit(None, export, on_done=self.export_finished(collection, json_format),
+                           on_error=self.show_error(f"Failed to export {json_format}"))
 
     # History or audit of all changes ever made
 
@@ -830,33 +1153,149 @@ class PatientRegistryApp:
         tab = ttk.Frame(self.notebook)
         self.notebook.add(tab, text="Audit Logs")
 
-        self.audit_tree = ttk.Treeview(tab, columns=("timestamp", "action"), show="headings", height=25)
+        filter_frame = ttk.Frame(tab)
+        filter_frame.pack(fill=tk.X, padx=15, pady=(15, 0))
+        tk.Label(filter_frame, text="Entity:", font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+        self.audit_entity_filter = ttk.Combobox(filter_frame, values=["All", "patients", "appointments"],
+                                                font=('Arial', 12), width=12, state="readonly")
+        self.audit_entity_filter.pack(side=tk.LEFT, padx=5)
+        self.audit_entity_filter.set("All")
+        tk.Label(filter_frame, text="From (YYYY-MM-DD):", font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+        self.audit_from_entry = tk.Entry(filter_frame, font=('Arial', 12), width=12)
+        self.audit_from_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(filter_frame, text="To (YYYY-MM-DD):", font=('Arial', 12)).pack(side=tk.LEFT, padx=5)
+        self.audit_to_entry = tk.Entry(filter_frame, font=('Arial', 12), width=12)
+        self.audit_to_entry.pack(side=tk.LEFT, padx=5)
+        tk.Button(filter_frame, text="Apply Filter", command=self.refresh_audit_logs,
+                  font=('Arial', 12), width=12).pack(side=tk.LEFT, padx=5)
+        self.audit_count_label = tk.Label(filter_frame, text="", font=('Arial', 12))
+        self.audit_count_label.pack(side=tk.LEFT, padx=10)
+
+        self.audit_tree = ttk.Treeview(tab, columns=("timestamp", "actor", "action", "changes"), show="headings", height=25)
         self.audit_tree.heading("timestamp", text="Timestamp")
+        self.audit_tree.heading("actor", text="User")
         self.audit_tree.heading("action", text="Action")
+        self.audit_tree.heading("changes", text="Changes")
         self.audit_tree.column("timestamp", width=200)
-        self.audit_tree.column("action", width=1000)
+        self.audit_tree.column("actor", width=100)
+        self.audit_tree.column("action", width=450)
+        self.audit_tree.column("changes", width=550)
         
-        scrollbar = ttk.Scrollbar(tab, orient="vertical", command=self.audit_tree.yview)
+        scrollbar = ttk.Scrollbar(tab, orient="vertical")
         scrollbar.pack(side="right", fill="y")
-        self.audit_tree.configure(yscrollcommand=scrollbar.set)
         self.audit_tree.pack(fill=tk.BOTH, expand=True, padx=15, pady=15)
 
-        self.refresh_audit_logs()
+        # newest first, keyset paged on (timestamp, _id) so going back in history stays cheap
+        self.audit_pager = KeysetPager(audit_logs_col, sort_field="timestamp", ascending=False,
+                                       count_limit=AUDIT_COUNT_LIMIT)
+        self.audit_view = VirtualTree(self.audit_tree, scrollbar, self.audit_pager, self.audit_row_values,
+                                      run=self.run_view, name="audit_logs", on_total=self.show_audit_count)
 
-    def log_audit(self, action):
-        audit_logs_col.insert_one({
-            "timestamp": datetime.now(),
-            "action": action
-        })
-        self.refresh_audit_logs()
+    # safe to call from the worker, the event is queued and the tab gets it through on_event
+    def log_audit(self, action, entity=None, entity_id=None, changes=None):
+        return self.audit.record(action, entity, entity_id, changes)
 
     def refresh_audit_logs(self):
-        self.audit_tree.delete(*self.audit_tree.get_children())
-        for log in audit_logs_col.find().sort("timestamp", -1).limit(100):
-            self.audit_tree.insert("", tk.END, values=(
-                log.get("timestamp", "N/A").strftime("%Y-%m-%d %H:%M:%S"),
-                log.get("action", "N/A")
-            ))
+        query = {}
+        entity = self.audit_entity_filter.get()
+        if entity != "All":
+            query["entity"] = entity
+        try:
+            logged = {}
+            if self.audit_from_entry.get().strip():
+                logged["$gte"] = datetime.strptime(self.audit_from_entry.get().strip(), "%Y-%m-%d")
+            if self.audit_to_entry.get().strip():
+                # the whole of the To day
+                logged["$lt"] = datetime.strptime(self.audit_to_entry.get().strip(), "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            messagebox.showerror("Error", "Invalid date format. Use YYYY-MM-DD")
+            return
+        if logged:
+            query["timestamp"] = logged
+        self.audit_view.set_query(query)
+
+    def show_audit_count(self, total, capped):
+        self.audit_count_label.config(text=f"{total:,}{'+' if capped else ''} entries")
+
+    def audit_row_values(self, log):
+        return (
+            log.get("timestamp", "N/A").strftime("%Y-%m-%d %H:%M:%S"),
+            log.get("actor") or "",
+            log.get("action", "N/A"),
+            audit.describe(log.get("changes") or {})
+        )
+
+    def append_audit_row(self, event):
+        # placed by its key like any other row, a filtered view reloads instead
+        self.audit_view.insert(event)
+
+    # query and render timings, see perf.py
+    def create_performance_tab(self):
+        tab = ttk.Frame(self.notebook)
+        self.notebook.add(tab, text="Performance")
+        self.performance_tab = tab
+        self.performance_job = None
+
+        button_frame = ttk.Frame(tab)
+        button_frame.pack(fill=tk.X, padx=15, pady=(15, 0))
+        tk.Button(button_frame, text="Refresh", command=self.refresh_performance,
+                  font=('Arial', 12), width=12).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="Reset", command=self.reset_performance,
+                  font=('Arial', 12), width=12).pack(side=tk.LEFT, padx=5)
+        self.performance_pause = tk.Button(button_frame, text="Pause", command=self.pause_performance,
+                                           font=('Arial', 12), width=12)
+        self.performance_pause.pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="Save Log", command=self.save_performance_log,
+                  font=('Arial', 12), width=12).pack(side=tk.LEFT, padx=5)
+        if perf.ENABLED:
+            status = f"p50/p95/p99 over the last {perf.WINDOW} of each operation, in ms"
+        else:
+            status = "Recording is off, start the app with PATIENT_REGISTRY_PERF=1 to time queries and drawing"
+        tk.Label(button_frame, text=status, font=('Arial', 12)).pack(side=tk.LEFT, padx=10)
+
+        columns = ("operation", "kind", "count", "p50", "p95", "p99", "max", "docs")
+        self.performance_tree = ttk.Treeview(tab, columns=columns, show="headings", height=25)
+        for column, heading, width in (("operation", "Operation", 350), ("kind", "Kind", 100),
+                                       ("count", "Count", 100), ("p50", "p50", 100), ("p95", "p95", 100),
+                                       ("p99", "p99", 100), ("max", "Max", 100), ("docs", "Docs (avg)", 120)):
+            self.performance_tree.heading(column, text=heading)
+            self.performance_tree.column(column, width=width, anchor="w" if column == "operation" else "e")
+        self.performance_tree.pack(fill=tk.BOTH, expand=True, padx=15, pady=15)
+
+    def refresh_performance(self):
+        # keeps itself going while the tab is open
+        if self.performance_job is not None:
+            self.root.after_cancel(self.performance_job)
+            self.performance_job = None
+        if self.notebook.select() != str(self.performance_tab):
+            return
+        self.performance_tree.delete(*self.performance_tree.get_children())
+        for row in perf.RECORDER.summary():
+            self.performance_tree.insert("", tk.END, values=(
+                row["operation"], row["kind"], f"{row['count']:,}", f"{row['p50']:.1f}", f"{row['p95']:.1f}",
+                f"{row['p99']:.1f}", f"{row['max']:.1f}", f"{row['docs']:.1f}"))
+        self.performance_job = self.root.after(PERFORMANCE_REFRESH_MS, self.refresh_performance)
+
+    def reset_performance(self):
+        perf.RECORDER.reset()
+        self.refresh_performance()
+
+    def pause_performance(self):
+        perf.RECORDER.paused = not perf.RECORDER.paused
+        self.performance_pause.config(text="Resume" if perf.RECORDER.paused else "Pause")
+
+    def save_performance_log(self):
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".jsonl",
+            filetypes=[("JSON Lines Files", "*.jsonl")],
+            title="Save performance log"
+        )
+        if not file_path:
+            return
+        self.worker.submit(None, perf.RECORDER.dump, file_path, "w",
+                           on_done=lambda count: messagebox.showinfo("Success", f"{count:,} timings saved to {file_path}"),
+                           on_error=self.show_error("Failed to save the performance log"))
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = PatientRegistryApp(root)
@@ -0,0 +1,260 @@
+import getpass
+import gzip
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+# structured audit trail with write-behind batching.
+# record() only appends the event to an in-memory queue, a background thread writes
+# the queue out with one insert_many when it reaches FLUSH_SIZE events or FLUSH_SECONDS
+# after the oldest unwritten one, and close() writes whatever is left.
+# an event looks like
+#   {"timestamp", "actor", "action", "entity", "entity_id",
+#    "changes": {field: {"before": old, "after": new}}}
+# "action" is the same readable line the audit tab always showed.
+#
+# retention: entries older than RETENTION_DAYS are moved out of audit_logs a calendar
+# month at a time, into zstd compressed audit_logs_archive_YYYY_MM collections or, when
+# PATIENT_REGISTRY_AUDIT_ARCHIVE_DIR is set, into audit_logs-YYYY-MM.ndjson.gz files there.
+# a month's entries are only deleted once every one of them is found in the archive
+#   python audit.py archive
+# or at startup on the station with PATIENT_REGISTRY_AUDIT_AUTO_ARCHIVE=1 (one station is enough)
+
+# kept on every document for syncing the stations (see sync.py), not worth an audit line
+BOOKKEEPING = {"_id", "updated_at", "version"}
+
+FLUSH_SIZE = 200
+FLUSH_SECONDS = 2.0
+# the server's code for an _id that's already there
+DUPLICATE_KEY = 11000
+RETENTION_DAYS = int(os.environ.get("PATIENT_REGISTRY_AUDIT_RETENTION_DAYS", "180"))
+ARCHIVE_DIR = os.environ.get("PATIENT_REGISTRY_AUDIT_ARCHIVE_DIR")
+AUTO_ARCHIVE = os.environ.get("PATIENT_REGISTRY_AUDIT_AUTO_ARCHIVE", "0").lower() not in ("", "0", "false", "no")
+# ids per $in when copying and deleting a month
+ARCHIVE_CHUNK = 10000
+
+
+def diff(before, after, fields=None):
+    # field -> {"before", "after"} for every field whose value differs, a missing
+    # side is None (so an insert has only afters and a delete only befores)
+    before, after = before or {}, after or {}
+    names = fields or sorted((set(before) | set(after)) - BOOKKEEPING)
+    return {name: {"before": before.get(name), "after": after.get(name)}
+            for name in names if before.get(name) != after.get(name)}
+
+
+def describe(changes, limit=4):
+    # "age: 30 -> 31, insurance: None -> Private" for the tree
+    parts = [f"{name}: {change['before']} -> {change['after']}" for name, change in list(changes.items())[:limit]]
+    if len(changes) > limit:
+        parts.append(f"+{len(changes) - limit} more")
+    return ", ".join(parts)
+
+
+class AuditLogger:
+    def __init__(self, collection, actor=None, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.collection = collection
+        self.actor = actor or getpass.getuser()
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        # on_event(event) is called for each recorded event, from the recording thread
+        self.on_event = None
+        # on_error(exception) when a flush fails, the events are kept for the next try
+        self.on_error = None
+        self._queue = []
+        self._cond = threading.Condition()
+        self._flushing = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="audit", daemon=True)
+        self._thread.start()
+
+    def record(self, action, entity=None, entity_id=None, changes=None):
+        # the _id is set here so the tab can show the row before it's written, and a
+        # retried batch can't insert the same event twice
+        event = {
+            "_id": ObjectId(),
+            "timestamp": datetime.now(),
+            "actor": self.actor,
+            "action": action,
+            "entity": entity,
+            "entity_id": str(entity_id) if entity_id is not None else None,
+            "changes": changes or {},
+        }
+        with self._cond:
+            self._queue.append(event)
+            if len(self._queue) >= self.flush_size:
+                self._cond.notify()
+        if self.on_event is not None:
+            self.on_event(event)
+        return event
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def flush(self):
+        # the lock keeps the background flush and a close() from writing the same events twice
+        with self._flushing:
+            with self._cond:
+                events, self._queue = self._queue, []
+            if not events:
+                return 0
+            from pymongo.errors import BulkWriteError
+
+            try:
+                self.collection.insert_many(events, ordered=False)
+            except BulkWriteError as e:
+                # the rest were written. a duplicate key is an event an earlier try already
+                # wrote, anything else failed and goes back on the queue for the next flush
+                failed = sorted(error["index"] for error in e.details.get("writeErrors", [])
+                                if error.get("code") != DUPLICATE_KEY)
+                with self._cond:
+                    self._queue[:0] = [events[i] for i in failed]
+                raise
+            except Exception:
+                # couldn't reach the server, back on the front of the queue in their original order
+                with self._cond:
+                    self._queue[:0] = events
+                raise
+            return len(events)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._queue) < self.flush_size:
+                    # wake up when the batch is full, or once the oldest event has waited long enough
+                    self._cond.wait(self.flush_seconds)
+                if self._closed:
+                    return
+                ready = len(self._queue) >= self.flush_size or (
+                    self._queue and (datetime.now() - self._queue[0]["timestamp"]).total_seconds() >= self.flush_seconds)
+            if ready:
+                try:
+                    self.flush()
+                except Exception as e:
+                    if self.on_error is not None:
+                        self.on_error(e)
+                    with self._cond:
+                        self._cond.wait(self.flush_seconds)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        return self.flush()
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start):
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def chunks(ids, size=ARCHIVE_CHUNK):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _archive_to_collection(collection, database, ids, month):
+    # returns the ids that are in the archive collection afterwards
+    from pymongo.errors import CollectionInvalid
+
+    name = f"{collection.name}_archive_{month.strftime('%Y_%m')}"
+    if name not in database.list_collection_names():
+        try:
+            database.create_collection(name, storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}})
+        except CollectionInvalid:
+            pass
+    target = database[name]
+    archived = set()
+    for chunk in chunks(ids):
+        # $merge on _id, so running it again after a failed delete doesn't duplicate anything
+        collection.aggregate([{"$match": {"_id": {"$in": chunk}}},
+                              {"$merge": {"into": name, "whenMatched": "keepExisting", "whenNotMatched": "insert"}}])
+        archived.update(doc["_id"] for doc in target.find({"_id": {"$in": chunk}}, {"_id": 1}))
+    return archived
+
+
+def _archive_to_file(collection, ids, month, directory):
+    # returns the ids that are in the month's file afterwards. the file is written out
+    # again as a whole next to it and swapped in, so a run that stops half way leaves
+    # the old file as it was, and entries it already holds (a run that stopped before
+    # its delete) aren't written twice
+    import exporters
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{collection.name}-{month.strftime('%Y-%m')}.ndjson.gz")
+    encoder = json.JSONEncoder(default=exporters.json_default, ensure_ascii=False, separators=(",", ":"))
+    # json_default writes an ObjectId as its hex digits
+    written = set()
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as old:
+                for line in old:
+                    f.write(line)
+                    written.add(json.loads(line).get("_id"))
+        for chunk in chunks(ids):
+            for doc in collection.find({"_id": {"$in": chunk}}, batch_size=exporters.BATCH_SIZE):
+                if str(doc["_id"]) not in written:
+                    f.write(encoder.encode(doc) + "\n")
+                    written.add(str(doc["_id"]))
+    os.replace(path + ".tmp", path)
+    return {entry_id for entry_id in ids if str(entry_id) in written}
+
+
+def archive(collection, database, older_than_days=None, directory=None, now=None):
+    # returns ({"YYYY-MM": entries moved}, {"YYYY-MM": (entries, found in the archive)}).
+    # a month's ids are read first and copied, then deleted by id, only when the archive
+    # holds as many of them as the month had before the copy. a month that doesn't add
+    # up is left in audit_logs and reported in the second dict, running again retries it
+    older_than_days = RETENTION_DAYS if older_than_days is None else older_than_days
+    directory = ARCHIVE_DIR if directory is None else directory
+    cutoff = (now or datetime.now()) - timedelta(days=older_than_days)
+    moved = {}
+    skipped = {}
+    after = None
+    while True:
+        older = {"$lt": cutoff} if after is None else {"$gte": after, "$lt": cutoff}
+        oldest = collection.find_one({"timestamp": older}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        if oldest is None:
+            return moved, skipped
+        month = month_start(oldest["timestamp"])
+        after = next_month(month)
+        match = {"timestamp": {"$gte": month, "$lt": min(after, cutoff)}}
+        expected = collection.count_documents(match)
+        ids = [entry["_id"] for entry in collection.find(match, {"_id": 1})]
+        if directory:
+            archived = _archive_to_file(collection, ids, month, directory)
+        else:
+            archived = _archive_to_collection(collection, database, ids, month)
+        found = [entry_id for entry_id in ids if entry_id in archived]
+        if len(found) != expected:
+            skipped[month.strftime("%Y-%m")] = (expected, len(found))
+            continue
+        for chunk in chunks(found):
+            collection.delete_many({"_id": {"$in": chunk}})
+        moved[month.strftime("%Y-%m")] = expected
+
+
+if __name__ == "__main__":
+    import db
+
+    if sys.argv[1:] != ["archive"]:
+        print("usage: python audit.py archive")
+        sys.exit(2)
+    database = db.get_database()
+    moved, skipped = archive(database["audit_logs"], database)
+    for month, count in moved.items():
+        print(f"{month}: {count} entries archived")
+    for month, (count, found) in skipped.items():
+        print(f"{month}: only {found} of {count} entries found in the archive, left in audit_logs")
+    if skipped:
+        sys.exit(1)
+    print(f"done, entries older than {RETENTION_DAYS} days are archived")
@@ -0,0 +1,89 @@
+import threading
+from bisect import bisect_left, insort
+
+from name_search import normalize
+
+# patient name autocomplete from a sorted array held in memory.
+# entries are (normalized name, name) tuples in sorted order, every name starting
+# with a prefix sits in one contiguous run found with two bisects, so a lookup is
+# O(log n + limit) and never goes to the database. loaded once after startup,
+# the patient write paths keep it current. writes are told by patient _id, so the
+# ones that land while a load reads can be squared with what the read saw
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self._entries = []
+        # name -> number of patients with it, a name is listed once however many share it
+        self._counts = {}
+        # patient _id -> name after its last write, while a load runs
+        self._pending = None
+
+    def load(self, collection):
+        with self._lock:
+            self._pending = {}
+        # the name the read saw for each patient, kept until the swap
+        names = {}
+        counts = {}
+        for patient in collection.find({}, {"name": 1}, batch_size=10000):
+            name = names[patient["_id"]] = patient.get("name")
+            if name:
+                counts[name] = counts.get(name, 0) + 1
+        entries = sorted((normalize(name), name) for name in counts)
+        with self._lock:
+            self._entries, self._counts = entries, counts
+            # a write that landed during the read may or may not be in it, either way the
+            # patient is counted under the name it was written with, once
+            for patient_id, name in self._pending.items():
+                read = names.get(patient_id) or None
+                if read != name:
+                    self._change(read, name)
+            self._pending = None
+            self.ready = True
+        return len(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _change(self, old, new):
+        if old:
+            count = self._counts.get(old, 0)
+            if count <= 1:
+                self._counts.pop(old, None)
+                entry = (normalize(old), old)
+                i = bisect_left(self._entries, entry)
+                if i < len(self._entries) and self._entries[i] == entry:
+                    del self._entries[i]
+            else:
+                self._counts[old] = count - 1
+        if new:
+            if new in self._counts:
+                self._counts[new] += 1
+            else:
+                self._counts[new] = 1
+                insort(self._entries, (normalize(new), new))
+
+    def change(self, patient_id, old, new):
+        # one call for every write: add is (id, None, name), delete is (id, name, None)
+        with self._lock:
+            if self._pending is not None:
+                self._pending[patient_id] = new or None
+            if old != new:
+                self._change(old, new)
+
+    def add(self, patient_id, name):
+        self.change(patient_id, None, name)
+
+    def remove(self, patient_id, name):
+        self.change(patient_id, name, None)
+
+    def complete(self, prefix, limit=10):
+        key = normalize(prefix)
+        if not key:
+            return []
+        with self._lock:
+            start = bisect_left(self._entries, (key,))
+            end = bisect_left(self._entries, (key + "\uffff",), start)
+            return [name for _, name in self._entries[start:min(end, start + limit)]]
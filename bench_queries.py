@@ -0,0 +1,343 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import monitoring
+
+import analytics
+import exporters
+import name_search
+import patient_cache
+import schedule
+import search_query
+from app import APPOINTMENT_LIST_PROJECTION, AUDIT_COUNT_LIMIT, CALENDAR_PROJECTION, SEARCH_COUNT_LIMIT
+from virtual_tree import KeysetPager
+
+# hot path benchmark: the database work behind the patient list, every search filter,
+# the dashboard, the appointment list, the calendar, the audit tab and the exports,
+# the same calls the app makes on its worker thread, without a window.
+#   python bench_queries.py --runs 5 --save baseline.json
+#   python bench_queries.py --baseline baseline.json --tolerance 1.25
+#   python bench_queries.py --mongomock --patients 10000
+# against PATIENT_REGISTRY_MONGO_URI / PATIENT_REGISTRY_DB (fill it with seed.py first),
+# the PATIENT_REGISTRY_SQLITE_PATH file with PATIENT_REGISTRY_BACKEND=sqlite,
+# or an in-memory mongomock database seeded here. each benchmark records its median
+# wall time, peak RSS above where it started and the database round trips of one run
+# (commands seen by a pymongo CommandListener, getMores included, or with mongomock
+# and sqlite the collection calls). with --baseline it exits with status 1 when a
+# benchmark got slower than --tolerance times the baseline or needs more round trips
+
+LIST_ROWS = 50
+SAMPLE_SECONDS = 0.005
+# connection upkeep, not the app's own queries
+IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "endSessions", "saslStart", "saslContinue"}
+
+
+class RoundTrips(monitoring.CommandListener):
+    # a pymongo command listener, counts what the app's calls send to the server
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            with self._lock:
+                self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class CountingCollection:
+    # mongomock has no wire to listen on, each collection method called counts as one
+    CALLS = {"find", "find_one", "aggregate", "count_documents", "estimated_document_count", "distinct",
+             "insert_one", "insert_many", "update_one", "update_many", "replace_one", "find_one_and_update",
+             "find_one_and_delete", "delete_one", "delete_many", "bulk_write"}
+
+    def __init__(self, collection, trips):
+        self._collection = collection
+        self._trips = trips
+
+    def with_options(self, *args, **kwargs):
+        # exporters.batches reads from a copy with another read preference, it counts too
+        return CountingCollection(self._collection.with_options(*args, **kwargs), self._trips)
+
+    def __getattr__(self, attr):
+        value = getattr(self._collection, attr)
+        if attr in self.CALLS:
+            def counted(*args, **kwargs):
+                self._trips.count += 1
+                return value(*args, **kwargs)
+            return counted
+        return value
+
+
+def rss_now():
+    # bytes, None where it can't be read
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakRss:
+    # samples the resident set while a benchmark runs
+    def __init__(self):
+        self.start = rss_now()
+        self.peak = self.start
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        now = rss_now()
+        if now is not None:
+            self.peak = max(self.peak, now)
+
+    def _run(self):
+        while not self._done.wait(SAMPLE_SECONDS):
+            self.peak = max(self.peak, rss_now() or 0)
+
+    def growth_mb(self):
+        return None if self.start is None else round((self.peak - self.start) / 2 ** 20, 1)
+
+
+class Context:
+    def __init__(self, database, trips, wrap=None):
+        wrap = wrap or (lambda collection: collection)
+        self.patients = wrap(database["patients"])
+        self.appointments = wrap(database["appointments"])
+        self.audit_logs = wrap(database["audit_logs"])
+        self.stats = wrap(database["stats"])
+        self.trips = trips
+        self.directory = tempfile.mkdtemp(prefix="registry-bench-")
+        self.name_index = name_search.NameIndex()
+        self.name_index.load(self.patients)
+        sample = self.patients.find_one({}, {"name": 1}, sort=[("_id", -1)]) or {"name": "Smith"}
+        self.sample_name = sample["name"].split()[-1]
+        # where a scrollbar dragged halfway down lands
+        self.middle = self.patients.estimated_document_count() // 2
+        self.now = datetime.now()
+
+
+# the benchmarks, each one is what a view does from cold: new pager and cache
+
+def patient_pager(ctx, query=None, sort_field="name", count_limit=None):
+    return KeysetPager(ctx.patients, query=query, projection=patient_cache.PROJECTION, sort_field=sort_field,
+                       count_limit=count_limit, cache=patient_cache.PatientCache(ctx.patients))
+
+
+def first_screen(pager, start=0):
+    pager.total()
+    return pager.rows(start, LIST_ROWS)
+
+
+def search(ctx, name=None, **criteria):
+    # run_search: the name against the index, then the paged query
+    query, ids = search_query.resolve(name, ctx.name_index, ctx.patients, **criteria)
+    pager = patient_pager(ctx, count_limit=SEARCH_COUNT_LIMIT)
+    pager.set_query(query, ids)
+    return first_screen(pager)
+
+
+def export(ctx, kind, collection_name):
+    collection = ctx.patients if collection_name == "patients" else ctx.appointments
+    path = os.path.join(ctx.directory, f"{collection_name}.{kind}")
+    if kind == "csv":
+        exporters.export_csv(collection, collection_name, path)
+    else:
+        exporters.export_ndjson(collection, path)
+    os.remove(path)
+
+
+def calendar_week(ctx):
+    monday = ctx.now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=ctx.now.weekday())
+    return list(ctx.appointments.find(schedule.overlap_query(monday, monday + timedelta(days=7)),
+                                      CALENDAR_PROJECTION))
+
+
+def appointment_page(ctx, status=None):
+    pager = KeysetPager(ctx.appointments, query={"status": status} if status else None,
+                        projection=APPOINTMENT_LIST_PROJECTION, sort_field="start")
+    return first_screen(pager)
+
+
+def audit_page(ctx, entity=None):
+    pager = KeysetPager(ctx.audit_logs, query={"entity": entity} if entity else None, sort_field="timestamp",
+                        ascending=False, count_limit=AUDIT_COUNT_LIMIT)
+    return first_screen(pager)
+
+
+BENCHMARKS = {
+    "patient_list": lambda ctx: first_screen(patient_pager(ctx)),
+    "patient_list_jump": lambda ctx: first_screen(patient_pager(ctx), ctx.middle),
+    "patient_list_by_age": lambda ctx: first_screen(patient_pager(ctx, sort_field="age")),
+    "search_name": lambda ctx: search(ctx, ctx.sample_name),
+    "search_age": lambda ctx: search(ctx, min_age=30, max_age=40),
+    "search_dates": lambda ctx: search(ctx, from_date=ctx.now - timedelta(days=90), to_date=ctx.now),
+    "search_insurance": lambda ctx: search(ctx, insurance="Medicaid"),
+    "search_combined": lambda ctx: search(ctx, ctx.sample_name, min_age=60, insurance="Medicare"),
+    "dashboard": lambda ctx: analytics.load_dashboard(ctx.patients, ctx.appointments, ctx.stats),
+    "dashboard_all_charts": lambda ctx: analytics.load_dashboard(
+        ctx.patients, ctx.appointments, ctx.stats, analytics.PATIENT_FACETS + analytics.APPOINTMENT_FACETS),
+    "appointments_all": appointment_page,
+    "appointments_scheduled": lambda ctx: appointment_page(ctx, "Scheduled"),
+    "calendar_week": calendar_week,
+    "audit_log": audit_page,
+    "audit_log_patients": lambda ctx: audit_page(ctx, "patients"),
+    "export_csv_patients": lambda ctx: export(ctx, "csv", "patients"),
+    "export_ndjson_patients": lambda ctx: export(ctx, "ndjson", "patients"),
+    "export_csv_appointments": lambda ctx: export(ctx, "csv", "appointments"),
+    "export_ndjson_appointments": lambda ctx: export(ctx, "ndjson", "appointments"),
+}
+
+
+def run(ctx, name, runs):
+    fn = BENCHMARKS[name]
+    times = []
+    trips = None
+    with PeakRss() as rss:
+        for _ in range(runs):
+            before = ctx.trips.count
+            started = time.perf_counter()
+            fn(ctx)
+            times.append((time.perf_counter() - started) * 1000)
+            trips = ctx.trips.count - before
+    return {
+        "wall_ms": round(statistics.median(times), 2),
+        "wall_ms_min": round(min(times), 2),
+        "peak_rss_mb": rss.growth_mb(),
+        "round_trips": trips,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # the lines to report, an empty list when nothing regressed
+    failures = []
+    for name, result in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            continue
+        if base["wall_ms"] > 0 and result["wall_ms"] > base["wall_ms"] * tolerance:
+            failures.append(f"{name}: {result['wall_ms']:.1f} ms, baseline {base['wall_ms']:.1f} ms "
+                            f"({result['wall_ms'] / base['wall_ms']:.2f}x)")
+        if base.get("round_trips") is not None and result["round_trips"] is not None \
+                and result["round_trips"] > base["round_trips"]:
+            failures.append(f"{name}: {result['round_trips']} round trips, baseline {base['round_trips']}")
+    return failures
+
+
+def open_database(args):
+    # (database, round trip counter, collection wrapper, description)
+    trips = RoundTrips()
+    if args.mongomock:
+        import mongomock
+
+        import indexes
+        import seed
+
+        database = mongomock.MongoClient()["bench"]
+        indexes.ensure_indexes(database)
+        print(f"seeding {args.patients:,} patients in memory...")
+        seed.generate(database, args.patients, seed=args.seed)
+        return database, trips, lambda collection: CountingCollection(collection, trips), "mongomock"
+
+    import db
+
+    if db.BACKEND == "sqlite":
+        import sqlite3
+
+        database = db.get_database()
+        return database, trips, lambda collection: CountingCollection(collection, trips), \
+            f"sqlite {sqlite3.sqlite_version} ({db.SQLITE_PATH})"
+
+    from pymongo import MongoClient
+
+    client = MongoClient(db.MONGO_URI, maxPoolSize=db.POOL_SIZE, serverSelectionTimeoutMS=db.TIMEOUT_MS,
+                         event_listeners=[trips])
+    version = client.server_info()["version"]
+    return client[db.DATABASE], trips, None, f"mongod {version}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the registry's database hot paths")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--save", help="write the results to this JSON file, e.g. as a new baseline")
+    parser.add_argument("--baseline", help="compare against a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--mongomock", action="store_true", help="an in-memory database instead of a mongod")
+    parser.add_argument("--patients", type=int, default=10000, help="patients to seed with --mongomock")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    database, trips, wrap, backend = open_database(args)
+    ctx = Context(database, trips, wrap)
+    counts = {name: database[name].estimated_document_count() for name in ("patients", "appointments", "audit_logs")}
+    if not counts["patients"]:
+        print("no patients to benchmark, fill the database with seed.py first")
+        return 1
+    print(f"{backend}: " + ", ".join(f"{count:,} {name}" for name, count in counts.items()))
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        results[name] = result = run(ctx, name, args.runs)
+        rss = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.1f} MB"
+        print(f"{name:28} {result['wall_ms']:10.1f} ms  {result['round_trips']:5} round trips  +{rss}")
+    os.rmdir(ctx.directory)
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "backend": backend,
+            "counts": counts,
+            "runs": args.runs,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "benchmarks": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved to {args.save}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("counts") != counts:
+            print(f"note: the baseline was taken with {baseline['meta'].get('counts')}")
+        failures = compare(results, baseline, args.tolerance)
+        for line in failures:
+            print(f"FAIL: {line}")
+        if failures:
+            return 1
+        print(f"no regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# startup benchmark: time from interpreter start to the main window being on
+# screen, each run in a fresh interpreter so nothing is already imported.
+#   python bench_startup.py --runs 10 --max-ms 800
+# exits with status 1 when the median is over --max-ms, so it can guard against
+# regressions. needs a display, use --import-only on a headless machine
+
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "pymongo"]
+
+PROBE = r"""
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+result = {"import_ms": (imported - start) * 1000}
+if not IMPORT_ONLY:
+    root = app.tk.Tk()
+    registry = app.PatientRegistryApp(root)
+    built = time.perf_counter()
+    root.update()
+    while not root.winfo_viewable():
+        root.update()
+    shown = time.perf_counter()
+    result["build_ms"] = (built - imported) * 1000
+    result["window_ms"] = (shown - start) * 1000
+result["loaded"] = [name for name in HEAVY if name in sys.modules]
+if not IMPORT_ONLY:
+    registry.on_close()
+print(json.dumps(result))
+"""
+
+
+def run_once(import_only):
+    code = f"IMPORT_ONLY = {import_only!r}\nHEAVY = {HEAVY_MODULES!r}\n" + PROBE
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the registry takes to show its window")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median is slower than this")
+    parser.add_argument("--import-only", action="store_true", help="only time 'import app', no window")
+    args = parser.parse_args()
+
+    results = [run_once(args.import_only) for _ in range(args.runs)]
+    metric = "import_ms" if args.import_only else "window_ms"
+    median = statistics.median(result[metric] for result in results)
+
+    print(f"import app: {statistics.median(r['import_ms'] for r in results):.1f} ms (median of {args.runs})")
+    if not args.import_only:
+        print(f"build widgets: {statistics.median(r['build_ms'] for r in results):.1f} ms")
+        print(f"window on screen: {median:.1f} ms")
+    print(f"heavy modules loaded at startup: {', '.join(results[-1]['loaded']) or 'none'}")
+
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"FAIL: {metric} {median:.1f} ms is over the {args.max_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import tkinter as tk
+from tkinter import ttk
+from datetime import datetime, timedelta
+
+from schedule import IntervalIndex, lanes
+
+# a day or a week of appointments drawn on a canvas. only the shown window is
+# fetched, fetch(start, end) runs through run(view, fn, on_done) like the pager
+# fetches do, and the loaded window is kept in an IntervalIndex so conflicts
+# are checked against it without asking the server
+
+HOUR_HEIGHT = 40
+GUTTER = 60
+HEADER = 28
+FIRST_HOUR = 7
+COLORS = {"Scheduled": "#cfe2ff", "Completed": "#d1e7dd", "Cancelled": "#e9ecef"}
+CONFLICT = "#f8d7da"
+
+
+class CalendarView:
+    def __init__(self, parent, fetch, run, on_select=None, name="calendar"):
+        self.fetch = fetch
+        self.run = run
+        self.on_select = on_select
+        self.name = name
+        self.mode = "Week"
+        self.day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.window = None
+        self.index = IntervalIndex()
+
+        self.frame = ttk.Frame(parent)
+        toolbar = ttk.Frame(self.frame)
+        toolbar.pack(fill=tk.X, pady=5)
+        tk.Button(toolbar, text="<", command=lambda: self.move(-1), font=('Arial', 10), width=3).pack(side=tk.LEFT, padx=2)
+        tk.Button(toolbar, text="Today", command=self.today, font=('Arial', 10), width=8).pack(side=tk.LEFT, padx=2)
+        tk.Button(toolbar, text=">", command=lambda: self.move(1), font=('Arial', 10), width=3).pack(side=tk.LEFT, padx=2)
+        self.mode_box = ttk.Combobox(toolbar, values=["Day", "Week"], font=('Arial', 10), width=8, state="readonly")
+        self.mode_box.set(self.mode)
+        self.mode_box.bind("<<ComboboxSelected>>", lambda e: self.set_mode(self.mode_box.get()))
+        self.mode_box.pack(side=tk.LEFT, padx=10)
+        self.range_label = tk.Label(toolbar, text="", font=('Arial', 10))
+        self.range_label.pack(side=tk.LEFT, padx=10)
+
+        body = ttk.Frame(self.frame)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.canvas = tk.Canvas(body, background="white", highlightthickness=0)
+        scrollbar = ttk.Scrollbar(body, orient="vertical", command=self.canvas.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.bind("<Configure>", lambda e: self.draw())
+        self.canvas.tag_bind("appointment", "<ButtonRelease-1>", self._on_click)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def window_range(self):
+        if self.mode == "Day":
+            return self.day, self.day + timedelta(days=1)
+        monday = self.day - timedelta(days=self.day.weekday())
+        return monday, monday + timedelta(days=7)
+
+    def set_mode(self, mode):
+        self.mode = mode
+        self.reload()
+
+    def move(self, steps):
+        self.day += timedelta(days=steps * (1 if self.mode == "Day" else 7))
+        self.reload()
+
+    def today(self):
+        self.day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.reload()
+
+    def show_day(self, day):
+        self.day = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        if not self.covers(self.day, self.day + timedelta(days=1)):
+            self.reload()
+
+    def reload(self):
+        start, end = self.window_range()
+        self.window = (start, end)
+        last = end - timedelta(days=1)
+        self.range_label.config(text=start.strftime("%a %d %b %Y") if self.mode == "Day"
+                                else f"{start.strftime('%d %b')} - {last.strftime('%d %b %Y')}")
+        self.run(self.name, lambda: self.fetch(start, end), self._loaded)
+
+    def _loaded(self, appointments):
+        self.index = IntervalIndex(appointments)
+        self.draw()
+        # the working day is in view rather than midnight
+        self.canvas.yview_moveto(FIRST_HOUR / 24)
+
+    def covers(self, start, end):
+        return self.window is not None and self.window[0] <= start and end <= self.window[1]
+
+    def conflicts(self, start, end, exclude=None):
+        # only meaningful when covers(start, end)
+        return self.index.conflicts(start, end, exclude)
+
+    def changed(self, appt):
+        # a scheduled or updated appointment, placed without reloading the window
+        if self.window is None:
+            return
+        start, end = appt.get("start"), appt.get("end")
+        if start is not None and end is not None and start < self.window[1] and end > self.window[0]:
+            self.index.add(appt)
+        else:
+            self.index.remove(appt["_id"])
+        self.draw()
+
+    def removed(self, appointment_id):
+        if self.index.get(appointment_id) is not None:
+            self.index.remove(appointment_id)
+            self.draw()
+
+    def draw(self):
+        canvas = self.canvas
+        canvas.delete("all")
+        if self.window is None:
+            return
+        start, end = self.window
+        days = (end - start).days
+        width = max(canvas.winfo_width(), GUTTER + 100)
+        column = (width - GUTTER) / days
+        height = HEADER + 24 * HOUR_HEIGHT
+        canvas.configure(scrollregion=(0, 0, width, height))
+
+        for hour in range(24):
+            y = HEADER + hour * HOUR_HEIGHT
+            canvas.create_line(GUTTER, y, width, y, fill="#dee2e6")
+            canvas.create_text(GUTTER - 6, y + 2, text=f"{hour:02d}:00", anchor="ne", font=('Arial', 9))
+        for i in range(days):
+            day = start + timedelta(days=i)
+            x = GUTTER + i * column
+            canvas.create_line(x, 0, x, height, fill="#adb5bd")
+            canvas.create_text(x + column / 2, HEADER / 2, text=day.strftime("%a %d"), font=('Arial', 10, 'bold'))
+
+            day_end = day + timedelta(days=1)
+            shown = self.index.overlapping(day, day_end)
+            placed = lanes(shown)
+            for appt in shown:
+                key = str(appt["_id"])
+                lane, count = placed[key]
+                top = HEADER + (max(appt["start"], day) - day).total_seconds() / 3600 * HOUR_HEIGHT
+                bottom = HEADER + (min(appt["end"], day_end) - day).total_seconds() / 3600 * HOUR_HEIGHT
+                left = x + 2 + lane * (column - 4) / count
+                right = x + 2 + (lane + 1) * (column - 4) / count
+                clash = appt.get("status") != "Cancelled" and self.index.conflicts(appt["start"], appt["end"], key)
+                fill = CONFLICT if clash else COLORS.get(appt.get("status"), "#fff3cd")
+                tags = ("appointment", f"id:{key}")
+                canvas.create_rectangle(left, top, right - 2, bottom - 1, fill=fill,
+                                        outline="#dc3545" if clash else "#6c757d", tags=tags)
+                canvas.create_text(left + 4, top + 2, anchor="nw", width=max(right - left - 8, 10),
+                                   text=f"{appt['start'].strftime('%H:%M')} {appt.get('patient_name', '')}",
+                                   font=('Arial', 9), tags=tags)
+
+    def _on_click(self, event):
+        item = self.canvas.find_withtag("current")
+        if not item or self.on_select is None:
+            return
+        for tag in self.canvas.gettags(item[0]):
+            if tag.startswith("id:"):
+                self.on_select(tag[3:])
+                return
@@ -0,0 +1,234 @@
+import math
+
+import analytics
+
+# the six dashboard charts, each on its own Figure (no pyplot state) so it can be
+# created and drawn only when its tab is first shown.
+# a chart is built once per set of categories, later refreshes move the existing
+# artists (bar heights, line data, wedge angles, labels) instead of replotting
+
+
+class Chart:
+    name = ""
+    title = ""
+    # $facet outputs from analytics this chart needs beyond the counters summary
+    facets = ()
+    empty_text = "No data available"
+
+    def __init__(self):
+        # imported here so the chart list can be read without loading matplotlib
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=(6, 4))
+        self.ax = self.figure.add_subplot()
+        self.layout = None
+        self.built = False
+
+    def draw(self, data):
+        layout = self.categories(data) if self.has_data(data) else None
+        if self.built and layout is not None and layout == self.layout:
+            self.update(data)
+            self.ax.relim()
+            self.ax.autoscale_view()
+            return
+
+        self.ax.clear()
+        if layout is not None:
+            self.plot(data)
+        else:
+            self.ax.text(0.5, 0.5, self.empty_text, ha="center", fontsize=12)
+        self.layout = layout
+        self.built = True
+
+    def has_data(self, data):
+        return True
+
+    def categories(self, data):
+        # what the artists are built around, a change here means a full rebuild
+        return ()
+
+    def plot(self, data):
+        raise NotImplementedError
+
+    def update(self, data):
+        raise NotImplementedError
+
+
+def update_pie(wedges, texts, autotexts, values):
+    # same geometry as Axes.pie defaults: start at 0 degrees, counterclockwise,
+    # labels at 1.1 and percentages at 0.6 of the radius
+    total = float(sum(values))
+    theta1 = 0
+    for wedge, text, autotext, value in zip(wedges, texts, autotexts, values):
+        frac = value / total
+        theta2 = theta1 + 360 * frac
+        wedge.set_theta1(theta1)
+        wedge.set_theta2(theta2)
+        mid = math.radians((theta1 + theta2) / 2)
+        x, y = math.cos(mid), math.sin(mid)
+        text.set_position((1.1 * x, 1.1 * y))
+        text.set_horizontalalignment('left' if x > 0 else 'right')
+        autotext.set_position((0.6 * x, 0.6 * y))
+        autotext.set_text(f"{100 * frac:.1f}%")
+        theta1 = theta2
+
+
+class GenderChart(Chart):
+    name = "gender"
+    title = "Gender Distribution"
+
+    def has_data(self, data):
+        return sum(data["gender"]) > 0
+
+    def plot(self, data):
+        self.wedges, self.texts, self.autotexts = self.ax.pie(
+            data["gender"],
+            labels=analytics.GENDERS,
+            autopct="%1.1f%%",
+            colors=['lightblue', 'lightpink', 'lightgray'])
+        self.ax.set_title("Gender Distribution", fontsize=12)
+
+    def update(self, data):
+        update_pie(self.wedges, self.texts, self.autotexts, data["gender"])
+
+
+class AgeChart(Chart):
+    name = "age"
+    title = "Age Distribution"
+    facets = ("ages",)
+
+    def has_data(self, data):
+        return any(data["ages"])
+
+    def plot(self, data):
+        # the bins are counted server side, each count is weighted onto its bin
+        bins = analytics.AGE_BINS
+        _, _, self.bars = self.ax.hist(bins[:-1], bins=bins, weights=data["ages"], edgecolor='black', color='skyblue')
+        self.ax.set_title("Age Distribution", fontsize=12)
+        self.ax.set_xlabel("Age")
+        self.ax.set_ylabel("Number of Patients")
+        self.ax.grid(axis='y', alpha=0.5)
+
+    def update(self, data):
+        for bar, count in zip(self.bars, data["ages"]):
+            bar.set_height(count)
+
+
+class InsuranceChart(Chart):
+    name = "insurance"
+    title = "Insurance Distribution"
+
+    def has_data(self, data):
+        return bool(data["insurance"])
+
+    def categories(self, data):
+        return frozenset(data["insurance"])
+
+    def plot(self, data):
+        self.labels = list(data["insurance"].keys())
+        values = list(data["insurance"].values())
+        colors = ['gold', 'lightgreen', 'lightcoral', 'lightskyblue']
+        self.wedges, self.texts, self.autotexts = self.ax.pie(
+            values, labels=self.labels, autopct="%1.1f%%", colors=colors[:len(values)])
+        self.ax.set_title("Insurance Distribution", fontsize=12)
+
+    def update(self, data):
+        # wedges keep the order they were built in
+        values = [data["insurance"][label] for label in self.labels]
+        update_pie(self.wedges, self.texts, self.autotexts, values)
+
+
+def month_labels(items):
+    return [f"{item['_id']['month']}/{item['_id']['year']}" for item in items]
+
+
+class AppointmentsChart(Chart):
+    name = "appointments"
+    title = "Appointments Trend"
+    facets = ("monthly",)
+
+    def has_data(self, data):
+        return bool(data["monthly"])
+
+    def categories(self, data):
+        return tuple(month_labels(data["monthly"]))
+
+    def plot(self, data):
+        counts = [item['count'] for item in data["monthly"]]
+        self.bars = self.ax.bar(month_labels(data["monthly"]), counts, color='mediumseagreen')
+        self.ax.set_title("Appointments by Month", fontsize=12)
+        self.ax.set_xlabel("Month/Year")
+        self.ax.set_ylabel("Number of Appointments")
+        self.ax.tick_params(axis='x', rotation=45)
+        self.ax.grid(axis='y', alpha=0.5)
+
+    def update(self, data):
+        for bar, item in zip(self.bars, data["monthly"]):
+            bar.set_height(item['count'])
+
+
+class RegistrationChart(Chart):
+    name = "registration"
+    title = "Registration Trend"
+    facets = ("registrations",)
+
+    def has_data(self, data):
+        return bool(data["registrations"])
+
+    def categories(self, data):
+        return tuple(month_labels(data["registrations"]))
+
+    def plot(self, data):
+        counts = [item['count'] for item in data["registrations"]]
+        self.line, = self.ax.plot(month_labels(data["registrations"]), counts, marker='o', color='royalblue')
+        self.ax.set_title("Patient Registration Trend", fontsize=12)
+        self.ax.set_xlabel("Month/Year")
+        self.ax.set_ylabel("Number of Registrations")
+        self.ax.tick_params(axis='x', rotation=45)
+        self.ax.grid(alpha=0.5)
+
+    def update(self, data):
+        self.line.set_ydata([item['count'] for item in data["registrations"]])
+
+
+class RevenueChart(Chart):
+    name = "revenue"
+    title = "Revenue by Type"
+    empty_text = "No revenue data available"
+
+    def has_data(self, data):
+        return bool(data["revenue"])
+
+    def categories(self, data):
+        return frozenset(item["_id"] for item in data["revenue"])
+
+    def plot(self, data):
+        self.types = [item["_id"] for item in data["revenue"]]
+        amounts = [item["total"] for item in data["revenue"]]
+
+        self.bars = self.ax.bar(self.types, amounts, color='teal')
+        self.ax.set_title("Revenue by Consultation Type", fontsize=12)
+        self.ax.set_xlabel("Consultation Type")
+        self.ax.set_ylabel("Total Revenue ($)")
+        self.ax.tick_params(axis='x', rotation=45)
+        self.ax.grid(axis='y', alpha=0.5)
+
+        # Add value labels on top of bars
+        self.values = []
+        for bar in self.bars:
+            height = bar.get_height()
+            self.values.append(self.ax.text(bar.get_x() + bar.get_width()/2., height,
+                                            f'${height:,.2f}',
+                                            ha='center', va='bottom'))
+
+    def update(self, data):
+        # bars stay in the order they were built in rather than jumping around
+        totals = {item["_id"]: item["total"] for item in data["revenue"]}
+        for bar, label, consultation_type in zip(self.bars, self.values, self.types):
+            height = totals[consultation_type]
+            bar.set_height(height)
+            label.set_y(height)
+            label.set_text(f'${height:,.2f}')
+
+
+CHARTS = [GenderChart, AgeChart, InsuranceChart, AppointmentsChart, RegistrationChart, RevenueChart]
@@ -0,0 +1,139 @@
+from datetime import datetime
+
+# running dashboard totals kept in one document of the stats collection, the write
+# paths $inc it so reading the headline numbers never touches patients/appointments
+
+STATS_ID = "dashboard"
+
+
+def field_key(value):
+    # category values become field names, which can't hold dots or start with $
+    text = str(value) if value not in (None, "") else "Unknown"
+    return text.replace(".", "_").replace("$", "_")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def patient_delta(patient, sign=1):
+    inc = {
+        "patients": sign,
+        f"gender.{field_key(patient.get('gender'))}": sign,
+        f"insurance.{field_key(patient.get('insurance'))}": sign,
+    }
+    # $avg skips non-numeric ages, so the running average does too
+    if _is_number(patient.get("age")):
+        inc["age_sum"] = sign * patient["age"]
+        inc["age_count"] = sign
+    return inc
+
+
+def revenue_delta(appointment, sign=1):
+    amount = appointment.get("bill_amount") or 0
+    key = field_key(appointment.get("consultation_type"))
+    return {
+        "revenue": sign * amount,
+        "completed": sign,
+        f"revenue_by_type.{key}.total": sign * amount,
+        f"revenue_by_type.{key}.count": sign,
+    }
+
+
+def combine(*deltas):
+    inc = {}
+    for delta in deltas:
+        for field, amount in delta.items():
+            inc[field] = inc.get(field, 0) + amount
+    return {field: amount for field, amount in inc.items() if amount}
+
+
+def apply(stats_col, inc):
+    # no upsert, if the document is missing the next read rebuilds it from scratch
+    if inc:
+        stats_col.update_one({"_id": STATS_ID}, {"$inc": inc})
+
+
+def patient_added(stats_col, patient):
+    apply(stats_col, patient_delta(patient))
+
+
+def patient_removed(stats_col, patient):
+    if patient:
+        apply(stats_col, patient_delta(patient, -1))
+
+
+def patient_changed(stats_col, before, after):
+    if before:
+        apply(stats_col, combine(patient_delta(before, -1), patient_delta(after)))
+
+
+def appointment_status_changed(stats_col, before, status):
+    # only a move into or out of Completed changes the revenue figures
+    if not before:
+        return
+    was_completed = before.get("status") == "Completed"
+    if was_completed and status != "Completed":
+        apply(stats_col, revenue_delta(before, -1))
+    elif not was_completed and status == "Completed":
+        apply(stats_col, revenue_delta(before))
+
+
+def rebuild(patients_col, appointments_col, stats_col):
+    # the reconcile step, recounts everything from the raw collections
+    stats = {
+        "_id": STATS_ID,
+        "patients": 0, "age_sum": 0, "age_count": 0, "gender": {}, "insurance": {},
+        "revenue": 0, "completed": 0, "revenue_by_type": {},
+        "rebuilt_at": datetime.now(),
+    }
+
+    patients = next(patients_col.aggregate([{"$facet": {
+        "summary": [{"$group": {
+            "_id": None,
+            "patients": {"$sum": 1},
+            "age_sum": {"$sum": "$age"},
+            "age_count": {"$sum": {"$cond": [{"$isNumber": "$age"}, 1, 0]}}
+        }}],
+        "gender": [{"$group": {"_id": "$gender", "count": {"$sum": 1}}}],
+        "insurance": [{"$group": {"_id": "$insurance", "count": {"$sum": 1}}}],
+    }}]))
+    if patients["summary"]:
+        summary = patients["summary"][0]
+        stats.update(patients=summary["patients"], age_sum=summary["age_sum"], age_count=summary["age_count"])
+    for item in patients["gender"]:
+        key = field_key(item["_id"])
+        stats["gender"][key] = stats["gender"].get(key, 0) + item["count"]
+    for item in patients["insurance"]:
+        key = field_key(item["_id"])
+        stats["insurance"][key] = stats["insurance"].get(key, 0) + item["count"]
+
+    revenue = appointments_col.aggregate([
+        {"$match": {"status": "Completed"}},
+        {"$group": {"_id": "$consultation_type", "total": {"$sum": "$bill_amount"}, "count": {"$sum": 1}}}
+    ])
+    for item in revenue:
+        entry = stats["revenue_by_type"].setdefault(field_key(item["_id"]), {"total": 0, "count": 0})
+        entry["total"] += item["total"]
+        entry["count"] += item["count"]
+        stats["revenue"] += item["total"]
+        stats["completed"] += item["count"]
+
+    stats_col.replace_one({"_id": STATS_ID}, stats, upsert=True)
+    return stats
+
+
+def read(patients_col, appointments_col, stats_col):
+    stats = stats_col.find_one({"_id": STATS_ID})
+    if stats is None:
+        stats = rebuild(patients_col, appointments_col, stats_col)
+    return stats
+
+
+if __name__ == "__main__":
+    import db
+
+    database = db.get_database()
+    stats = rebuild(database["patients"], database["appointments"], database["stats"])
+    print(f"Rebuilt dashboard counters: {stats['patients']} patients, "
+          f"{stats['completed']} completed appointments, ${stats['revenue']:,.2f} revenue")
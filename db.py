@@ -0,0 +1,79 @@
+import os
+import threading
+
+# the MongoDB connection, opened on first use instead of at import so the window
+# can come up before pymongo is even loaded. settings come from the environment:
+#   PATIENT_REGISTRY_MONGO_URI      default mongodb://localhost:27017/
+#   PATIENT_REGISTRY_DB             default hospital
+#   PATIENT_REGISTRY_POOL_SIZE      max connections in the pool, default 10
+#   PATIENT_REGISTRY_TIMEOUT_MS     server selection timeout, default 5000
+#   PATIENT_REGISTRY_BACKEND        mongo (default) or sqlite, one file instead of a server (see sqlite_store.py)
+#   PATIENT_REGISTRY_SQLITE_PATH    the sqlite file, default <PATIENT_REGISTRY_DB>.sqlite3
+# with PATIENT_REGISTRY_PERF=1 the client times every command (see perf.py)
+
+MONGO_URI = os.environ.get("PATIENT_REGISTRY_MONGO_URI", "mongodb://localhost:27017/")
+DATABASE = os.environ.get("PATIENT_REGISTRY_DB", "hospital")
+POOL_SIZE = int(os.environ.get("PATIENT_REGISTRY_POOL_SIZE", "10"))
+TIMEOUT_MS = int(os.environ.get("PATIENT_REGISTRY_TIMEOUT_MS", "5000"))
+BACKEND = os.environ.get("PATIENT_REGISTRY_BACKEND", "mongo").lower()
+SQLITE_PATH = os.environ.get("PATIENT_REGISTRY_SQLITE_PATH", f"{DATABASE}.sqlite3")
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None and BACKEND == "sqlite":
+                import sqlite_store
+
+                _client = sqlite_store.Client(SQLITE_PATH)
+            elif _client is None:
+                from pymongo import MongoClient
+
+                import perf
+
+                _client = MongoClient(MONGO_URI, maxPoolSize=POOL_SIZE, serverSelectionTimeoutMS=TIMEOUT_MS,
+                                      event_listeners=perf.listeners())
+    return _client
+
+
+def get_database():
+    return get_client()[DATABASE]
+
+
+def close():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+class LazyCollection:
+    # stands in for a pymongo Collection at module level, the client is only
+    # created when the first method is called (normally on a worker thread)
+    def __init__(self, name):
+        self.name = name
+        self._client = None
+        self._collection = None
+
+    def resolve(self):
+        # re-resolved if the client was closed and opened again
+        client = get_client()
+        if client is not self._client:
+            self._collection = client[DATABASE][self.name]
+            self._client = client
+        return self._collection
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+def collection(name):
+    return LazyCollection(name)
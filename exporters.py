@@ -0,0 +1,143 @@
+import csv
+import gzip
+import io
+import json
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+# streaming exports, the cursor is walked in batches and each batch is written out
+# before the next one is read, so memory use is the same for 10k or 10M documents.
+# reads go to a secondary when the deployment has one, so a full export during
+# clinic hours doesn't compete with the app for the primary
+
+BATCH_SIZE = 5000
+COMPRESSIONS = ["None", "gzip", "zstd"]
+EXTENSIONS = {"None": "", "gzip": ".gz", "zstd": ".zst"}
+
+# the columns of each export in order, a document missing a field gets an empty cell
+# and fields not listed here are left out, so every file has the same header
+SCHEMAS = {
+    "patients": ["name", "age", "gender", "insurance", "medical_history", "registration_date"],
+    "appointments": ["patient_id", "patient_name", "date", "time", "consultation_type", "reason",
+                     "bill_amount", "status", "created_at", "completed_at", "cancelled_at", "start", "end"],
+}
+# sync.py's bookkeeping on every document, not part of the record, so no format exports it
+SYNC_FIELDS = {"updated_at": 0, "version": 0}
+
+
+def open_output(path, compress="None"):
+    # text mode whatever the compression, the csv module wants newline=""
+    if compress == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6)
+    if compress == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression needs the zstandard package (pip install zstandard)")
+        raw = zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"), closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        # the same text pandas wrote for these columns before
+        return str(value)
+    return value
+
+
+class Progress:
+    # rows written so far and the rate, reported once per batch
+    def __init__(self, callback, total=None):
+        self.callback = callback
+        self.total = total
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def add(self, rows):
+        self.rows += rows
+        if self.callback is not None:
+            self.callback(self.rows, self.total, self.rate())
+
+
+def batches(collection, projection=None, batch_size=BATCH_SIZE):
+    from pymongo import ReadPreference
+
+    source = collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+    cursor = source.find({}, projection, batch_size=batch_size)
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_csv(collection, name, path, compress="None", on_progress=None, batch_size=BATCH_SIZE):
+    # on_progress(rows, total, rows_per_second) is called from this thread after every batch
+    fields = SCHEMAS[name]
+    progress = Progress(on_progress, collection.estimated_document_count())
+    with open_output(path, compress) as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        # only the exported fields come over the wire
+        for batch in batches(collection, dict.fromkeys(fields, 1) | {"_id": 0}, batch_size):
+            writer.writerows([csv_value(doc.get(field)) for field in fields] for doc in batch)
+            progress.add(len(batch))
+    return progress
+
+
+def json_default(value):
+    # stable text for the BSON types json can't write: ObjectId as its 24 hex digits,
+    # datetimes as ISO 8601 to the millisecond (what MongoDB stores)
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="milliseconds")
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def export_ndjson(collection, path, compress="None", on_progress=None, batch_size=BATCH_SIZE):
+    # one compact JSON object per line, _id included so a line can be matched back
+    progress = Progress(on_progress, collection.estimated_document_count())
+    encoder = json.JSONEncoder(default=json_default, ensure_ascii=False, separators=(",", ":"))
+    with open_output(path, compress) as f:
+        for batch in batches(collection, SYNC_FIELDS, batch_size):
+            f.write("".join(encoder.encode(doc) + "\n" for doc in batch))
+            progress.add(len(batch))
+    return progress
+
+
+def export_json(collection, path, compress="None", on_progress=None, batch_size=BATCH_SIZE):
+    # the original pretty printed array without _id, written a batch at a time
+    progress = Progress(on_progress, collection.estimated_document_count())
+    encoder = json.JSONEncoder(default=json_default, ensure_ascii=False, indent=4)
+    first = True
+    with open_output(path, compress) as f:
+        f.write("[")
+        for batch in batches(collection, SYNC_FIELDS | {"_id": 0}, batch_size):
+            for doc in batch:
+                text = encoder.encode(doc).replace("\n", "\n    ")
+                f.write(("\n    " if first else ",\n    ") + text)
+                first = False
+            progress.add(len(batch))
+        f.write("\n]\n" if not first else "]\n")
+    return progress
+
+
+FORMATS = {"JSON": (export_json, ".json"), "NDJSON": (export_ndjson, ".ndjson")}
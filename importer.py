@@ -0,0 +1,274 @@
+import csv
+import os
+import sys
+from datetime import datetime
+
+import counters
+import indexes
+import schedule
+import sync
+
+# bulk loading of patients and appointments from CSV or NDJSON (optionally .gz/.zst).
+# each batch is validated and coerced column-wise with pandas, the good rows go in
+# with one unordered insert_many and the bad ones are written to a reject file next
+# to the input with the reason in an "error" column.
+#   python importer.py patients clinic_patients.csv
+#   python importer.py appointments clinic_appointments.ndjson.gz
+
+BATCH_SIZE = 10000
+
+GENDERS = {"male": "Male", "m": "Male", "female": "Female", "f": "Female", "other": "Other", "o": "Other"}
+INSURANCES = {"private": "Private", "medicare": "Medicare", "medicaid": "Medicaid", "none": "None", "": "None"}
+STATUSES = {"scheduled": "Scheduled", "completed": "Completed", "cancelled": "Cancelled", "canceled": "Cancelled"}
+
+def reject_path(path):
+    base = os.path.basename(path).split(".")[0]
+    return os.path.join(os.path.dirname(path), f"{base}.rejects.csv")
+
+
+def read_batches(path, batch_size=BATCH_SIZE):
+    # every value comes in as text, the coercion below decides what it means
+    import pandas as pd
+
+    name = path.lower()
+    for suffix in (".gz", ".zst", ".bz2", ".xz", ".zip"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        reader = pd.read_json(path, lines=True, chunksize=batch_size, dtype=False, convert_dates=False)
+        for frame in reader:
+            yield frame.astype(object).where(frame.notna(), "").astype(str)
+    else:
+        yield from pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=batch_size)
+
+
+class Batch:
+    # a frame of raw text and the reason each row was turned away ("" if it wasn't)
+    def __init__(self, frame):
+        import pandas as pd
+
+        self.raw = frame.reset_index(drop=True)
+        self.errors = pd.Series("", index=self.raw.index, dtype=object)
+
+    def text(self, field):
+        import pandas as pd
+
+        if field not in self.raw:
+            return pd.Series("", index=self.raw.index, dtype=object)
+        return self.raw[field].astype(str).str.strip()
+
+    def fail(self, mask, reason):
+        # only the first problem with a row is reported
+        self.errors = self.errors.mask(mask & (self.errors == ""), reason)
+
+    def number(self, field, default, integer=False, minimum=None, maximum=None):
+        import pandas as pd
+
+        text = self.text(field)
+        values = pd.to_numeric(text, errors="coerce")
+        self.fail((text != "") & values.isna(), f"{field} is not a number")
+        if integer:
+            self.fail(values.notna() & (values % 1 != 0), f"{field} is not a whole number")
+        if minimum is not None:
+            self.fail(values < minimum, f"{field} is below {minimum}")
+        if maximum is not None:
+            self.fail(values > maximum, f"{field} is above {maximum}")
+        values = values.fillna(default)
+        return values.astype("int64") if integer else values.astype("float64")
+
+    def date(self, field, default=None, required=False):
+        import pandas as pd
+
+        text = self.text(field)
+        values = pd.to_datetime(text.where(text != ""), errors="coerce", format="mixed")
+        self.fail((text != "") & values.isna(), f"{field} is not a date")
+        if required:
+            self.fail(text == "", f"{field} is required")
+        values = values.dt.tz_localize(None) if values.dt.tz is not None else values
+        # plain datetimes (or None), which is what the app itself stores
+        return pd.Series(values.dt.to_pydatetime(), index=text.index, dtype=object).where(values.notna(), default)
+
+    def choice(self, field, mapping, default=None):
+        text = self.text(field)
+        values = text.str.lower().map(mapping)
+        if default is not None:
+            values = values.where(text != "", default)
+        self.fail(values.isna(), f"{field} must be one of {', '.join(sorted(set(mapping.values())))}")
+        return values
+
+    def required(self, field):
+        text = self.text(field)
+        self.fail(text == "", f"{field} is required")
+        return text
+
+    def documents(self, columns):
+        # {field: Series} -> list of dicts for the rows that passed, and the failed raw rows
+        import pandas as pd
+
+        good = self.errors == ""
+        frame = pd.DataFrame({field: values[good] for field, values in columns.items()})
+        docs = [{field: value for field, value in row.items() if value is not None}
+                for row in frame.astype(object).to_dict("records")]
+        rejects = self.raw[~good].assign(error=self.errors[~good])
+        return docs, rejects
+
+
+def validate_patients(frame, now):
+    batch = Batch(frame)
+    columns = {
+        "name": batch.required("name"),
+        # a blank age is 0, the same as the form
+        "age": batch.number("age", 0, integer=True, minimum=0, maximum=150),
+        "gender": batch.choice("gender", GENDERS, default="Other"),
+        "insurance": batch.choice("insurance", INSURANCES, default="None"),
+        "medical_history": batch.text("medical_history"),
+        "registration_date": batch.date("registration_date", default=now),
+    }
+    return batch.documents(columns)
+
+
+def slots(dates, times, types, good):
+    # the start and end schedule.slot() would give, for the rows still good
+    import pandas as pd
+
+    start = pd.to_datetime(dates.where(good), errors="coerce").dt.normalize() + \
+        pd.to_timedelta(times.where(good) + ":00", errors="coerce")
+    minutes = types.map(schedule.DURATIONS).fillna(schedule.DEFAULT_MINUTES)
+    end = start + pd.to_timedelta(minutes, unit="m")
+
+    def plain(values):
+        return pd.Series(values.dt.to_pydatetime(), index=values.index, dtype=object).where(values.notna(), None)
+    return plain(start), plain(end)
+
+
+def validate_appointments(frame, now, patients_col):
+    batch = Batch(frame)
+    names = batch.required("patient_name")
+    time_text = batch.text("time")
+    batch.fail(~time_text.str.fullmatch(r"([01]\d|2[0-3]):[0-5]\d"), "time must be HH:MM")
+    columns = {
+        "patient_id": batch.text("patient_id"),
+        "patient_name": names,
+        "date": batch.date("date", required=True),
+        "time": time_text,
+        "consultation_type": batch.text("consultation_type").where(lambda t: t != "", "General Checkup"),
+        "reason": batch.text("reason"),
+        "bill_amount": batch.number("bill_amount", 0.0, minimum=0),
+        "status": batch.choice("status", STATUSES, default="Scheduled"),
+        "created_at": batch.date("created_at", default=now),
+        "completed_at": batch.date("completed_at"),
+        "cancelled_at": batch.date("cancelled_at"),
+    }
+
+    # rows without a patient_id are matched to a patient by name, one query per batch
+    columns["start"], columns["end"] = slots(columns["date"], time_text, columns["consultation_type"], batch.errors == "")
+
+    missing = (columns["patient_id"] == "") & (batch.errors == "")
+    if missing.any():
+        wanted = sorted(set(names[missing]))
+        found = {}
+        for patient in patients_col.find({"name": {"$in": wanted}}, {"name": 1}, collation=indexes.NAME_COLLATION):
+            found.setdefault(patient["name"].casefold(), str(patient["_id"]))
+        resolved = names.str.casefold().map(found)
+        batch.fail(missing & resolved.isna(), "patient not found")
+        columns["patient_id"] = columns["patient_id"].mask(missing, resolved)
+    return batch.documents(columns)
+
+
+def insert(collection, docs):
+    # unordered so one bad document doesn't stop the rest, returns (inserted docs, [(doc, error)])
+    from pymongo.errors import BulkWriteError
+
+    if not docs:
+        return [], []
+    try:
+        collection.insert_many(docs, ordered=False)
+        return docs, []
+    except BulkWriteError as e:
+        failed = {error["index"]: error.get("errmsg", "insert failed") for error in e.details.get("writeErrors", [])}
+        inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+        return inserted, [(docs[i], message) for i, message in failed.items()]
+
+
+class RejectWriter:
+    # opened on the first reject so a clean import leaves no file behind
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._writer = None
+        self._columns = None
+
+    def write(self, frame):
+        if frame.empty:
+            return
+        if self._file is None:
+            self._file = open(self.path, "w", encoding="utf-8", newline="")
+            self._columns = list(frame.columns)
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self._columns)
+        self._writer.writerows(frame.reindex(columns=self._columns).fillna("").astype(str).itertuples(index=False))
+        self.count += len(frame)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def import_file(kind, path, patients_col, appointments_col, stats_col, audit=None, on_progress=None,
+                batch_size=BATCH_SIZE):
+    # kind is "patients" or "appointments". audit(message) gets one summary per batch,
+    # on_progress(imported, rejected) is called after every batch from this thread
+    import pandas as pd
+
+    target = patients_col if kind == "patients" else appointments_col
+    rejects = RejectWriter(reject_path(path))
+    imported = 0
+    try:
+        for number, frame in enumerate(read_batches(path, batch_size), start=1):
+            now = datetime.now()
+            if kind == "patients":
+                docs, bad = validate_patients(frame, now)
+            else:
+                docs, bad = validate_appointments(frame, now, patients_col)
+            inserted, failed = insert(target, [sync.stamped(doc) for doc in docs])
+            if failed:
+                bad = pd.concat([bad, pd.DataFrame([dict(doc, error=message) for doc, message in failed])])
+            rejects.write(bad)
+
+            # the dashboard counters move by the whole batch at once
+            if kind == "patients":
+                counters.apply(stats_col, counters.combine(*(counters.patient_delta(doc) for doc in inserted)))
+            else:
+                counters.apply(stats_col, counters.combine(
+                    *(counters.revenue_delta(doc) for doc in inserted if doc.get("status") == "Completed")))
+
+            imported += len(inserted)
+            if audit is not None:
+                audit(f"Imported {len(inserted)} {kind} from {os.path.basename(path)} "
+                      f"(batch {number}, {len(bad)} rejected)")
+            if on_progress is not None:
+                on_progress(imported, rejects.count)
+    finally:
+        rejects.close()
+    return imported, rejects.count, rejects.path if rejects.count else None
+
+
+if __name__ == "__main__":
+    import audit
+    import db
+
+    if len(sys.argv) != 3 or sys.argv[1] not in ("patients", "appointments"):
+        print("usage: python importer.py patients|appointments FILE")
+        sys.exit(2)
+    database = db.get_database()
+    audit_log = audit.AuditLogger(database["audit_logs"])
+    audit_log.on_event = lambda event: print(event["action"])
+
+    try:
+        imported, rejected, rejects_file = import_file(
+            sys.argv[1], sys.argv[2], database["patients"], database["appointments"], database["stats"],
+            audit=lambda message: audit_log.record(message, sys.argv[1]))
+    finally:
+        audit_log.close()
+    print(f"{imported} imported, {rejected} rejected" + (f", see {rejects_file}" if rejects_file else ""))
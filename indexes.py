@@ -0,0 +1,164 @@
+import sys
+from datetime import datetime, timedelta
+
+import sync
+
+# every index the app relies on, next to the queries that need it.
+# ensure_indexes() is safe to run any number of times (the app does it at startup),
+# check_queries() explains each registered query and reports any that would scan
+# the whole collection, or read a whole index to filter it.
+#   python indexes.py           create the indexes
+#   python indexes.py --check   create them, then fail if any query plan scans
+
+# name lookups typed by a person ignore case, strength 2 compares letters but not case
+NAME_COLLATION = {"locale": "en", "strength": 2}
+# how explain() labels an index scan with no bounds on its leading key
+FULL_IXSCAN = "IXSCAN (whole index)"
+
+# the sortable columns of the patient list, each keyset paged on (field, _id)
+PATIENT_SORT_FIELDS = ("name", "age", "gender", "insurance")
+
+INDEXES = {
+    "patients": [
+        *({"keys": [(field, 1), ("_id", 1)]} for field in PATIENT_SORT_FIELDS),
+        {"keys": [("name", 1)], "name": "name_ci", "collation": NAME_COLLATION},
+        {"keys": [("registration_date", 1)]},
+        {"keys": [("updated_at", 1)]},
+    ],
+    "appointments": [
+        # the appointment list, keyset paged on (start, _id) with or without a status filter
+        {"keys": [("start", 1), ("_id", 1)]},
+        {"keys": [("status", 1), ("start", 1), ("_id", 1)]},
+        {"keys": [("date", 1)]},
+        # overlap and calendar window lookups, see schedule.py
+        {"keys": [("start", 1), ("end", 1)]},
+        {"keys": [("updated_at", 1)]},
+    ],
+    # deleted patients and appointments for the other stations, gone after TOMBSTONE_DAYS
+    "tombstones": [
+        {"keys": [("updated_at", 1)], "expireAfterSeconds": sync.TOMBSTONE_DAYS * 86400},
+    ],
+    "audit_logs": [
+        {"keys": [("timestamp", -1), ("_id", -1)]},
+        {"keys": [("entity", 1), ("timestamp", -1), ("_id", -1)]},
+    ],
+}
+
+
+def _sample_date():
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# (description, collection, filter, sort, collation) for each query the app sends,
+# with sample values standing in for what the user types
+QUERIES = [
+    *((f"patient list sorted by {field}", "patients", {}, [(field, 1), ("_id", 1)], None)
+      for field in PATIENT_SORT_FIELDS),
+    *((f"patient list page after a {field} key", "patients",
+       {"$or": [{field: {"$gt": "m"}}, {field: "m", "_id": {"$gt": 0}}]}, [(field, 1), ("_id", 1)], None)
+      for field in PATIENT_SORT_FIELDS),
+    ("search by name while the name index loads", "patients", {"name": {"$regex": "smi", "$options": "i"}}, None,
+     None),
+    ("name matches checked against the other criteria", "patients",
+     {"$and": [{"age": {"$gte": 20, "$lte": 40}}, {"_id": {"$in": [0, 1, 2]}}]}, None, None),
+    ("a page of ranked name matches", "patients", {"_id": {"$in": [0, 1, 2]}}, None, None),
+    ("filter by age", "patients", {"age": {"$gte": 20, "$lte": 40}}, None, None),
+    ("filter by registration date", "patients",
+     {"registration_date": {"$gte": _sample_date() - timedelta(days=30), "$lte": _sample_date()}}, None, None),
+    ("filter by insurance", "patients", {"insurance": "Medicare"}, None, None),
+    ("combined search, sorted by name", "patients",
+     {"$and": [{"age": {"$gte": 20, "$lte": 40}}, {"insurance": "Medicare"}]}, [("name", 1), ("_id", 1)], None),
+    ("patient name suggestions", "patients", {"name": {"$gte": "sm", "$lt": "sm\uffff"}}, None, NAME_COLLATION),
+    ("patient by name for scheduling", "patients", {"name": "john smith"}, None, NAME_COLLATION),
+    ("appointments, all", "appointments", {}, [("start", 1), ("_id", 1)], None),
+    ("appointments by status", "appointments", {"status": "Scheduled"}, [("start", 1), ("_id", 1)], None),
+    ("appointment list page after a start key", "appointments",
+     {"$or": [{"start": {"$gt": _sample_date()}}, {"start": _sample_date(), "_id": {"$gt": 0}}]},
+     [("start", 1), ("_id", 1)], None),
+    ("today's appointments", "appointments",
+     {"date": {"$gte": _sample_date(), "$lt": _sample_date() + timedelta(days=1)}}, None, None),
+    ("appointment conflicts", "appointments",
+     {"start": {"$gt": _sample_date() - timedelta(hours=1), "$lt": _sample_date() + timedelta(minutes=30)},
+      "end": {"$gt": _sample_date()}, "status": {"$ne": "Cancelled"}}, None, None),
+    ("calendar week", "appointments",
+     {"start": {"$gt": _sample_date() - timedelta(hours=1), "$lt": _sample_date() + timedelta(days=7)},
+      "end": {"$gt": _sample_date()}}, None, None),
+    ("appointments without start and end", "appointments", {"start": None}, None, None),
+    *((f"{collection} changed since the sync watermark", collection,
+       {"updated_at": {"$gte": _sample_date()}}, None, None)
+      for collection in ("patients", "appointments", "tombstones")),
+    *((f"newest {collection} change", collection, {}, [("updated_at", -1)], None)
+      for collection in ("patients", "appointments")),
+    ("latest audit logs", "audit_logs", {}, [("timestamp", -1), ("_id", -1)], None),
+    ("audit logs by entity and time range", "audit_logs",
+     {"entity": "patients", "timestamp": {"$gte": _sample_date() - timedelta(days=7), "$lt": _sample_date()}},
+     [("timestamp", -1), ("_id", -1)], None),
+    ("audit logs for archiving", "audit_logs", {"timestamp": {"$lt": _sample_date()}}, [("timestamp", 1)], None),
+]
+
+
+def ensure_indexes(database):
+    # create_index is a no-op when an identical index already exists
+    created = []
+    for collection, specs in INDEXES.items():
+        for spec in specs:
+            options = {key: value for key, value in spec.items() if key != "keys"}
+            created.append(database[collection].create_index(spec["keys"], **options))
+    return created
+
+
+def _stages(plan):
+    # every stage in an explain plan tree, whatever the server version nests it under
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def _full(stage):
+    # an index scan whose leading key isn't bounded reads the whole index
+    bounds = stage.get("indexBounds")
+    if stage["stage"] != "IXSCAN" or not isinstance(bounds, dict) or not bounds:
+        return False
+    return list(next(iter(bounds.values()))) == ["[MinKey, MaxKey]"]
+
+
+def explain(database, collection, query, sort=None, collation=None):
+    cursor = database[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    if collation:
+        cursor = cursor.collation(collation)
+    plan = cursor.explain()
+    return [FULL_IXSCAN if _full(stage) else stage["stage"] for stage in _stages(plan["queryPlanner"]["winningPlan"])]
+
+
+def check_queries(database):
+    # returns (description, stages) for every registered query that scans the collection, or
+    # that has a filter and still reads a whole index (walking one for a sort is what it's for)
+    failures = []
+    for description, collection, query, sort, collation in QUERIES:
+        stages = explain(database, collection, query, sort, collation)
+        if "COLLSCAN" in stages or (query and FULL_IXSCAN in stages):
+            failures.append((description, stages))
+    return failures
+
+
+if __name__ == "__main__":
+    import db
+
+    database = db.get_database()
+    for name in ensure_indexes(database):
+        print(f"index ok: {name}")
+
+    if "--check" in sys.argv[1:]:
+        failures = check_queries(database)
+        for description, stages in failures:
+            print(f"scan: {description} ({' > '.join(stages)})")
+        if failures:
+            sys.exit(1)
+        print(f"all {len(QUERIES)} queries use an index")
@@ -0,0 +1,230 @@
+import re
+import threading
+from difflib import SequenceMatcher
+import unicodedata
+from array import array
+
+# fuzzy patient name search from an in-process trigram index.
+# every word of a name is padded (" smith ") and cut into trigrams, each trigram
+# maps to the slots of the names that contain it. a search counts shared trigrams
+# per name (a numpy bincount over the posting lists), which finds substrings and
+# survives most typos. every candidate is then checked, each word of the query has to
+# be in a word of the name or a typo or two away from one, and the matches are ranked
+# by how much of the query was found and how close the lengths are.
+# the index is loaded once from the patients collection and the write paths keep it
+# in sync, a search never touches the database
+
+# a name has to share at least this much of the query's trigrams to be a candidate
+MIN_SHARE = 0.4
+# how alike (difflib ratio) a query word and a word of the name have to be to count as a typo
+TYPO_RATIO = 0.75
+LOAD_BATCH = 10000
+# with a limit, the best scoring candidates (limit * RERANK) that get checked before the final cut
+RERANK = 5
+
+
+def normalize(name):
+    # lowercase, accents dropped, anything that isn't a letter or digit becomes a space
+    text = unicodedata.normalize("NFKD", str(name or "")).casefold()
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def grams(text):
+    result = set()
+    for word in text.split():
+        padded = f" {word} "
+        # the leading bigram lets a single typed letter match word starts
+        result.add(padded[:2])
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def close(word, name_words, matcher):
+    # word is in one of name_words, or a typo away from one (or from the start of a
+    # longer one, it may still be being typed)
+    if any(word in name_word for name_word in name_words):
+        return True
+    if len(word) < 3:
+        return False
+    matcher.set_seq2(word)
+    for name_word in name_words:
+        for candidate in {name_word, name_word[:len(word) + 1]}:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= TYPO_RATIO and matcher.quick_ratio() >= TYPO_RATIO \
+                    and matcher.ratio() >= TYPO_RATIO:
+                return True
+    return False
+
+
+class NameIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        # writes that happen while load() is reading, replayed onto the new index
+        self._pending = None
+        self._clear()
+
+    def _clear(self):
+        self._postings = {}
+        self._ids = []
+        self._names = []
+        self._sizes = array("H")
+        # slot -> number of its normalized name, patients sharing a name share one
+        self._codes = array("I")
+        self._texts = []
+        self._text_codes = {}
+        self._slots = {}
+        self._dead = 0
+
+    def load(self, collection):
+        # builds a fresh index off to the side and swaps it in, searches keep
+        # working on the old one (or fall back) while this runs
+        fresh = NameIndex()
+        with self._lock:
+            self._pending = []
+        cursor = collection.find({}, {"name": 1}, batch_size=LOAD_BATCH)
+        for patient in cursor:
+            fresh._add(patient["_id"], patient.get("name"))
+        with self._lock:
+            self._postings, self._ids, self._names = fresh._postings, fresh._ids, fresh._names
+            self._sizes, self._slots, self._dead = fresh._sizes, fresh._slots, fresh._dead
+            self._codes, self._texts, self._text_codes = fresh._codes, fresh._texts, fresh._text_codes
+            for patient_id, name in self._pending:
+                self._remove(patient_id)
+                if name is not None:
+                    self._add(patient_id, name)
+            self._pending = None
+            self.ready = True
+        return len(self._slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _add(self, patient_id, name):
+        text = normalize(name)
+        code = self._text_codes.get(text)
+        if code is None:
+            code = self._text_codes[text] = len(self._texts)
+            self._texts.append(text)
+        text = self._texts[code]
+        slot = len(self._ids)
+        self._ids.append(patient_id)
+        self._names.append(text)
+        self._codes.append(code)
+        name_grams = grams(text)
+        self._sizes.append(min(len(name_grams), 0xFFFF))
+        self._slots[patient_id] = slot
+        for gram in name_grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("I")
+            postings.append(slot)
+
+    def _remove(self, patient_id):
+        # the slot stays in the postings as a tombstone until the next compaction
+        slot = self._slots.pop(patient_id, None)
+        if slot is not None:
+            self._ids[slot] = None
+            self._names[slot] = None
+            self._sizes[slot] = 0
+            self._dead += 1
+
+    def _compact(self):
+        if self._dead < 1000 or self._dead * 4 < len(self._ids):
+            return
+        live = [(i, n) for i, n in zip(self._ids, self._names) if i is not None]
+        self._clear()
+        for patient_id, text in live:
+            self._add(patient_id, text)
+
+    def _log(self, patient_id, name):
+        if self._pending is not None:
+            self._pending.append((patient_id, name))
+
+    def add(self, patient_id, name):
+        with self._lock:
+            self._log(patient_id, name)
+            self._remove(patient_id)
+            self._add(patient_id, name)
+
+    def update(self, patient_id, name):
+        with self._lock:
+            self._log(patient_id, name)
+            slot = self._slots.get(patient_id)
+            if slot is not None and self._names[slot] == normalize(name):
+                return
+            self._remove(patient_id)
+            self._add(patient_id, name)
+            self._compact()
+
+    def remove(self, patient_id):
+        with self._lock:
+            self._log(patient_id, None)
+            self._remove(patient_id)
+            self._compact()
+
+    def search(self, query, limit=None):
+        # [(patient_id, score)] best first, every match unless limit is given. score 1.0+
+        # means the query appears as typed
+        # numpy is imported here rather than at the top so it isn't loaded at startup
+        import numpy as np
+
+        text = normalize(query)
+        query_grams = grams(text)
+        if not query_grams:
+            return []
+        with self._lock:
+            total = len(self._ids)
+            lists = [self._postings[gram] for gram in query_grams if gram in self._postings]
+            if not lists or not total:
+                return []
+            # frombuffer views, nothing is copied until the concatenate
+            slots = np.concatenate([np.frombuffer(postings, dtype=np.uint32) for postings in lists])
+            counts = np.bincount(slots, minlength=total)
+            sizes = np.frombuffer(self._sizes, dtype=np.uint16).astype(np.float64)
+            needed = max(1, int(len(query_grams) * MIN_SHARE + 0.5))
+            # dead slots have size 0 and are never candidates
+            candidates = np.flatnonzero((counts >= needed) & (sizes > 0))
+            if not len(candidates):
+                return []
+
+            # share of the query found, nudged by dice so closer lengths win ties
+            shared = counts[candidates]
+            scores = shared / len(query_grams) + 0.2 * shared / (len(query_grams) + sizes[candidates])
+            if limit is not None and limit * RERANK < len(candidates):
+                top = np.argpartition(-scores, limit * RERANK - 1)[:limit * RERANK]
+                candidates, scores = candidates[top], scores[top]
+
+            # the check and the edit similarity (which separates "jonh" -> john from the
+            # other names that only share the " jo" start) depend only on the name, many
+            # patients share one so each name is looked at once
+            codes, which = np.unique(np.frombuffer(self._codes, dtype=np.uint32)[candidates], return_inverse=True)
+            words = text.split()
+            matcher = SequenceMatcher(autojunk=False)
+            whole = SequenceMatcher(autojunk=False)
+            whole.set_seq2(text)
+            bonuses = np.full(len(codes), -1.0)
+            for i, code in enumerate(codes.tolist()):
+                name = self._texts[code]
+                name_words = name.split()
+                if all(close(word, name_words, matcher) for word in words):
+                    whole.set_seq1(name)
+                    bonuses[i] = 0.2 * whole.ratio()
+                    if text in name:
+                        bonuses[i] += 1.0 if name.startswith(text) or f" {text}" in name else 0.8
+            bonuses = bonuses[which]
+            matched = bonuses >= 0
+            candidates, scores, which = candidates[matched], (scores + bonuses)[matched], which[matched]
+            # best first, a tie goes to the name first in the alphabet
+            alphabetical = np.argsort(np.argsort([self._texts[code] for code in codes.tolist()]))
+            order = np.lexsort((alphabetical[which], -scores))
+            if limit is not None:
+                order = order[:limit]
+            return [(self._ids[slot], round(score, 3))
+                    for slot, score in zip(candidates[order].tolist(), scores[order].tolist())]
+
+
+def regex_query(text):
+    # the fallback while the index is loading, the text is matched literally
+    return {"name": {"$regex": re.escape(text), "$options": "i"}}
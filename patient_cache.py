@@ -0,0 +1,205 @@
+import os
+import threading
+from collections import OrderedDict
+
+from bson import ObjectId
+
+import indexes
+
+# one in-process copy of patient documents shared by every view, keyed by _id.
+# the patient list and search pagers hand their pages through put_many() so the rows
+# on screen are the cached records themselves, a row click or scheduling by name is
+# then answered from here. least recently used records are dropped past CAPACITY,
+# the patient write paths store() and remove() so nothing stale is served
+#
+# pages are read on several worker threads, a read that started before a write to
+# the same patient must not put the old values back, so every write is stamped and
+# put_many() is told when its read started
+
+CAPACITY = int(os.environ.get("PATIENT_REGISTRY_PATIENT_CACHE_SIZE", "50000"))
+
+FIELDS = ("name", "age", "gender", "insurance", "medical_history", "registration_date")
+PROJECTION = dict.fromkeys(FIELDS, 1)
+
+# how many recent write stamps are remembered, reads older than the oldest forgotten
+# one can't be checked and only reuse records already cached
+WRITES_KEPT = 1000
+
+_MISSING = object()
+
+
+class PatientRecord:
+    # a patient without a per-instance __dict__, reads like the document it came
+    # from (get, [], keys) so the views and dict(record) work on either
+    __slots__ = ("_id",) + FIELDS
+
+    def __init__(self, doc):
+        for field in self.__slots__:
+            setattr(self, field, doc.get(field, _MISSING))
+
+    def get(self, field, default=None):
+        value = getattr(self, field, _MISSING) if field in self.__slots__ else _MISSING
+        return default if value is _MISSING else value
+
+    def __getitem__(self, field):
+        value = self.get(field, _MISSING)
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self.get(field, _MISSING) is not _MISSING
+
+    def keys(self):
+        return [field for field in self.__slots__ if getattr(self, field) is not _MISSING]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.keys()]
+
+    def update(self, doc):
+        for field, value in doc.items():
+            if field in self.__slots__:
+                setattr(self, field, value)
+
+    def values_tuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+
+def _name_key(name):
+    return name.casefold() if isinstance(name, str) else None
+
+
+class PatientCache:
+    def __init__(self, collection, capacity=CAPACITY):
+        self.collection = collection
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # str(_id) -> record, least recently used first
+        self._records = OrderedDict()
+        # casefolded name -> set of str(_id) of the cached patients with it
+        self._by_name = {}
+        self._clock = 0
+        self._written = OrderedDict()
+        self._forgotten = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def stamp(self):
+        # taken before a read, passed back to put_many() with what it read
+        with self._lock:
+            return self._clock
+
+    def _wrote(self, key):
+        self._clock += 1
+        self._written[key] = self._clock
+        self._written.move_to_end(key)
+        while len(self._written) > WRITES_KEPT:
+            _, self._forgotten = self._written.popitem(last=False)
+
+    def _stale(self, key, since):
+        return since < self._forgotten or self._written.get(key, 0) > since
+
+    def _put(self, key, record):
+        self._drop(key)
+        self._records[key] = record
+        name = _name_key(record.get("name"))
+        if name is not None:
+            self._by_name.setdefault(name, set()).add(key)
+        while len(self._records) > self.capacity:
+            self._drop(next(iter(self._records)))
+
+    def _drop(self, key):
+        record = self._records.pop(key, None)
+        if record is None:
+            return
+        name = _name_key(record.get("name"))
+        ids = self._by_name.get(name)
+        if ids is not None:
+            ids.discard(key)
+            if not ids:
+                del self._by_name[name]
+
+    def put_many(self, docs, since):
+        # documents read from the server -> the shared records for them, in the same order
+        records = []
+        with self._lock:
+            for doc in docs:
+                key = str(doc["_id"])
+                cached = self._records.get(key)
+                if self._stale(key, since):
+                    # a write landed while this was being read, keep what the write left
+                    records.append(cached if cached is not None else PatientRecord(doc))
+                    continue
+                record = PatientRecord(doc)
+                if cached is not None and cached.values_tuple() == record.values_tuple():
+                    self._records.move_to_end(key)
+                    record = cached
+                else:
+                    self._put(key, record)
+                records.append(record)
+        return records
+
+    def get(self, patient_id):
+        # cache only, None when the patient isn't held
+        key = str(patient_id)
+        with self._lock:
+            record = self._records.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self._records.move_to_end(key)
+            self.hits += 1
+            return record
+
+    def fetch(self, patient_id):
+        # from the cache or else the server, None if there is no such patient
+        record = self.get(patient_id)
+        if record is not None:
+            return record
+        since = self.stamp()
+        doc = self.collection.find_one({"_id": ObjectId(str(patient_id))}, PROJECTION)
+        return self.put_many([doc], since)[0] if doc else None
+
+    def ids_for_name(self, name):
+        with self._lock:
+            return sorted(self._by_name.get(_name_key(name), ()))
+
+    def find_by_name(self, name):
+        # a patient with this name (case-insensitive), the server is only
+        # asked when none of them are cached
+        ids = self.ids_for_name(name)
+        for key in ids:
+            record = self.get(key)
+            if record is not None:
+                return record
+        since = self.stamp()
+        doc = self.collection.find_one({"name": name}, PROJECTION, collation=indexes.NAME_COLLATION)
+        return self.put_many([doc], since)[0] if doc else None
+
+    def store(self, doc):
+        # after a write, doc is the whole patient as it now is
+        key = str(doc["_id"])
+        record = PatientRecord(doc)
+        with self._lock:
+            self._wrote(key)
+            # a new record rather than changing the old one, a view still holding the
+            # old one compares it with the change to see where its row moves
+            self._put(key, record)
+        return record
+
+    def remove(self, patient_id):
+        key = str(patient_id)
+        with self._lock:
+            self._wrote(key)
+            self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._forgotten = self._clock
+            self._written.clear()
+            self._records.clear()
+            self._by_name.clear()
@@ -0,0 +1,182 @@
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# query and render timings, for when someone says the app is slow. off unless
+# PATIENT_REGISTRY_PERF=1, then every MongoDB command is timed by a pymongo
+# CommandListener on the client (with the collection and how many documents came
+# back), and so is every list fill and chart draw. the Performance tab shows
+# p50/p95/p99 of the last WINDOW samples of each operation.
+# off, the client gets no listener at all and timed() hands back one shared no-op,
+# the hooks cost a function call.
+#   PATIENT_REGISTRY_PERF_LOG=path   the samples are appended there as JSON lines on close
+
+ENABLED = os.environ.get("PATIENT_REGISTRY_PERF", "0").lower() not in ("", "0", "false", "no")
+LOG_PATH = os.environ.get("PATIENT_REGISTRY_PERF_LOG")
+# rolling window per operation for the percentiles
+WINDOW = 1000
+# raw samples kept for the JSON-lines log
+SAMPLES_KEPT = 20000
+
+
+def percentile(ordered, p):
+    # nearest rank of an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+class Recorder:
+    def __init__(self, window=WINDOW, kept=SAMPLES_KEPT):
+        self.window = window
+        self.paused = False
+        self._lock = threading.Lock()
+        # (kind, operation) -> recent durations in ms
+        self._durations = {}
+        # (kind, operation) -> [samples ever, documents ever]
+        self._totals = {}
+        self._samples = deque(maxlen=kept)
+
+    def add(self, kind, operation, ms, docs=None):
+        # from any thread
+        if self.paused:
+            return
+        key = (kind, operation)
+        with self._lock:
+            durations = self._durations.get(key)
+            if durations is None:
+                durations = self._durations[key] = deque(maxlen=self.window)
+                self._totals[key] = [0, 0]
+            durations.append(ms)
+            totals = self._totals[key]
+            totals[0] += 1
+            totals[1] += docs or 0
+            self._samples.append((time.time(), kind, operation, ms, docs))
+
+    def summary(self):
+        # one row per operation, the slowest p95 first
+        with self._lock:
+            snapshot = [(key, sorted(durations), tuple(self._totals[key])) for key, durations in self._durations.items()]
+        rows = []
+        for (kind, operation), ordered, (count, docs) in snapshot:
+            rows.append({
+                "kind": kind,
+                "operation": operation,
+                "count": count,
+                "p50": percentile(ordered, 50),
+                "p95": percentile(ordered, 95),
+                "p99": percentile(ordered, 99),
+                "max": ordered[-1],
+                "docs": docs / count if count else 0,
+            })
+        rows.sort(key=lambda row: row["p95"], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
+            self._samples.clear()
+
+    def dump(self, path, mode="a"):
+        # one line per sample still kept, then one summary line per operation
+        with self._lock:
+            samples = list(self._samples)
+        with open(path, mode, encoding="utf-8") as f:
+            for stamp, kind, operation, ms, docs in samples:
+                line = {"time": datetime.fromtimestamp(stamp).isoformat(timespec="milliseconds"),
+                        "kind": kind, "operation": operation, "ms": round(ms, 3)}
+                if docs is not None:
+                    line["docs"] = docs
+                f.write(json.dumps(line) + "\n")
+            for row in self.summary():
+                f.write(json.dumps(dict(row, summary=True)) + "\n")
+        return len(samples)
+
+
+RECORDER = Recorder()
+
+
+def returned(reply):
+    # documents a command sent back (or wrote), None when the reply doesn't say
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if "value" in reply:
+        return 0 if reply["value"] is None else 1
+    if isinstance(reply.get("n"), int):
+        return reply["n"]
+    return None
+
+
+def listeners(recorder=RECORDER):
+    # for MongoClient(event_listeners=...), empty when recording is off. pymongo is
+    # only imported here, when the client is being made
+    if not ENABLED:
+        return []
+    from pymongo import monitoring
+
+    class CommandTimer(monitoring.CommandListener):
+        def __init__(self):
+            # (connection, request id) -> collection, between started and its reply
+            self._pending = {}
+
+        def started(self, event):
+            target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+            self._pending[(event.connection_id, event.request_id)] = target if isinstance(target, str) else None
+
+        def _operation(self, event):
+            collection = self._pending.pop((event.connection_id, event.request_id), None)
+            return f"{event.command_name} {collection}" if collection else event.command_name
+
+        def succeeded(self, event):
+            recorder.add("query", self._operation(event), event.duration_micros / 1000, returned(event.reply))
+
+        def failed(self, event):
+            recorder.add("query", self._operation(event) + " (failed)", event.duration_micros / 1000)
+
+    return [CommandTimer()]
+
+
+class _Timer:
+    __slots__ = ("kind", "operation", "docs", "started")
+
+    def __init__(self, kind, operation, docs):
+        self.kind = kind
+        self.operation = operation
+        self.docs = docs
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        RECORDER.add(self.kind, self.operation, (time.perf_counter() - self.started) * 1000, self.docs)
+
+
+_OFF = contextlib.nullcontext()
+
+
+def timed(kind, operation, docs=None):
+    # with perf.timed("render", "patients list", len(rows)): ...
+    if not ENABLED:
+        return _OFF
+    return _Timer(kind, operation, docs)
+
+
+def wrap(fn, kind, operation):
+    # fn itself when recording is off
+    if not ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def timed_fn(*args, **kwargs):
+        with _Timer(kind, operation, None):
+            return fn(*args, **kwargs)
+    return timed_fn
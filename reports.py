@@ -0,0 +1,272 @@
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+import analytics
+import charts
+
+# printable reports from the dashboard charts (charts.py), one per month, insurer or
+# consultation type of a year, without opening the window.
+#   python reports.py [--year 2026] [--by month insurance consultation_type] [--out reports]
+#                     [--format png pdf] [--workers N] [--dpi 100]
+# every report is a summary page and the six charts, written as one PNG per page and
+# one multi-page PDF, in <out>/<year>/. what each report covers:
+#   month               patients registered that month, appointments on a day of it
+#   insurance           that insurer's patients registered in the year, and every appointment
+#                       in the year of a patient with that insurer
+#   consultation_type   appointments of that type in the year, and the patients who had them
+# the figures are read here, a couple of aggregations per report, and each report is
+# handed to a pool of processes (one per core) as soon as it's read. they draw on
+# matplotlib's Agg canvas, so no display is needed and the pages scale with cores
+
+KINDS = ("month", "insurance", "consultation_type")
+FORMATS = ("png", "pdf")
+DPI = 100
+REPORT_DIR = "reports"
+# patient ids per $in when a report joins appointments and patients
+ID_CHUNK = 10000
+UNSET = "(not set)"
+
+
+def year_range(year):
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+def slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", str(text).lower()).strip("-") or "none"
+
+
+def patient_pipeline(match):
+    facets = analytics.patient_facet_pipeline(("gender", "insurance", "ages", "registrations"))[0]["$facet"]
+    # sums rather than analytics' average, so the figures of several chunks add up
+    facets["summary"] = [{"$group": {
+        "_id": None,
+        "total": {"$sum": 1},
+        "age_sum": {"$sum": "$age"},
+        "age_count": {"$sum": {"$cond": [{"$isNumber": "$age"}, 1, 0]}}
+    }}]
+    return [{"$match": match}, {"$facet": facets}]
+
+
+def appointment_pipeline(match, start, end):
+    facets = analytics.appointment_facet_pipeline(start, end, ("revenue", "monthly"))[0]["$facet"]
+    facets["status"] = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    return [{"$match": match}, {"$facet": facets}]
+
+
+def group_key(value):
+    return tuple(sorted(value.items())) if isinstance(value, dict) else value
+
+
+def merge(results):
+    # the $facet outputs of several chunks as one, counts and totals of the same group added up
+    merged = {}
+    for result in results:
+        for facet, items in result.items():
+            groups = merged.setdefault(facet, {})
+            for item in items:
+                key = group_key(item["_id"])
+                if key not in groups:
+                    groups[key] = dict(item)
+                    continue
+                for field, value in item.items():
+                    if field != "_id":
+                        groups[key][field] = groups[key].get(field, 0) + value
+    return {facet: list(groups.values()) for facet, groups in merged.items()}
+
+
+def aggregate(collection, pipeline_for, match, field=None, ids=None):
+    # one aggregation, or one per ID_CHUNK of ids (matched on field) when there are ids
+    if ids is None:
+        return merge([next(collection.aggregate(pipeline_for(match)))])
+    results = []
+    for i in range(0, len(ids), ID_CHUNK):
+        chunk = dict(match, **{field: {"$in": ids[i:i + ID_CHUNK]}})
+        results.append(next(collection.aggregate(pipeline_for(chunk))))
+    return merge(results)
+
+
+def by_month(items):
+    return sorted(items, key=lambda item: (item["_id"]["year"], item["_id"]["month"]))
+
+
+def figures(patients, appointments):
+    # what charts.CHARTS draw, shaped like analytics.load_dashboard, plus the summary page's numbers
+    summary = (patients.get("summary") or [{}])[0]
+    gender = {item["_id"]: item["count"] for item in patients.get("gender", [])}
+    revenue = sorted(appointments.get("revenue", []), key=lambda item: item["total"], reverse=True)
+    status = {item["_id"]: item["count"] for item in appointments.get("status", [])}
+    return {
+        "total_patients": summary.get("total", 0),
+        "avg_age": summary["age_sum"] / summary["age_count"] if summary.get("age_count") else 0,
+        "total_revenue": sum(item["total"] for item in revenue),
+        "appointments": sum(status.values()),
+        "status": status,
+        "gender": [gender.get(g, 0) for g in analytics.GENDERS],
+        "insurance": {item["_id"] if item["_id"] is not None else UNSET: item["count"]
+                      for item in patients.get("insurance", []) if item["count"] > 0},
+        "ages": analytics.age_bucket_counts(patients.get("ages", [])),
+        "registrations": by_month(patients.get("registrations", [])),
+        "monthly": by_month(appointments.get("monthly", [])),
+        "revenue": revenue,
+    }
+
+
+def values(collection, field, match=None):
+    # the distinct values of field, in order, None last
+    pipeline = ([{"$match": match}] if match else []) + [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}]
+    found = [item["_id"] for item in collection.aggregate(pipeline) if item["count"]]
+    return sorted(found, key=lambda value: (value is None, str(value)))
+
+
+def object_ids(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(ObjectId(str(value)))
+        except InvalidId:
+            continue
+    return sorted(ids)
+
+
+def reports(patients_col, appointments_col, year, kinds=KINDS):
+    # yields (title, file name, figures) for every report of the year, reading as it goes
+    start, end = year_range(year)
+    in_year = {"$gte": start, "$lt": end}
+
+    def appointments_for(match, ids=None):
+        return aggregate(appointments_col, lambda m: appointment_pipeline(m, start, end), match, "patient_id", ids)
+
+    def patients_for(match, ids=None):
+        return aggregate(patients_col, patient_pipeline, match, "_id", ids)
+
+    if "month" in kinds:
+        for month in range(1, 13):
+            first, after = datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+            window = {"$gte": first, "$lt": after}
+            yield (first.strftime("%B %Y"), first.strftime("%Y-%m"),
+                   figures(patients_for({"registration_date": window}), appointments_for({"date": window})))
+
+    if "insurance" in kinds:
+        for insurer in values(patients_col, "insurance"):
+            ids = [str(patient["_id"]) for patient in patients_col.find({"insurance": insurer}, {"_id": 1})]
+            yield (f"{insurer if insurer is not None else UNSET} patients, {year}", f"insurance-{slug(insurer)}",
+                   figures(patients_for({"insurance": insurer, "registration_date": in_year}),
+                           appointments_for({"date": in_year}, ids)))
+
+    if "consultation_type" in kinds:
+        for consultation_type in values(appointments_col, "consultation_type", {"date": in_year}):
+            match = {"consultation_type": consultation_type, "date": in_year}
+            ids = object_ids(appt.get("patient_id") for appt in appointments_col.find(match, {"patient_id": 1}))
+            yield (f"{consultation_type if consultation_type is not None else UNSET} appointments, {year}",
+                   f"consultation-{slug(consultation_type)}",
+                   figures(patients_for({}, ids), appointments_for(match)))
+
+
+# runs in the pool's processes
+
+def summary_figure(title, data):
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(6, 4))
+    lines = [
+        ("Patients", f"{data['total_patients']:,}"),
+        ("Average age", f"{data['avg_age']:.1f} years"),
+        ("Appointments", f"{data['appointments']:,}"),
+        *((f"  {status}", f"{count:,}") for status, count in sorted(data["status"].items(), key=lambda s: str(s[0]))),
+        ("Revenue (completed)", f"${data['total_revenue']:,.2f}"),
+    ]
+    figure.text(0.08, 0.9, title, fontsize=14, weight="bold")
+    for row, (label, value) in enumerate(lines):
+        y = 0.78 - row * 0.08
+        figure.text(0.08, y, label, fontsize=11)
+        figure.text(0.92, y, value, fontsize=11, ha="right")
+    figure.text(0.08, 0.04, f"Generated {datetime.now():%Y-%m-%d %H:%M}", fontsize=8, color="gray")
+    return figure
+
+
+def render_report(title, name, data, directory, formats=FORMATS, dpi=DPI):
+    # the summary page and every chart of one report, returns the files written
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    pages = [("summary", summary_figure(title, data))]
+    for chart_class in charts.CHARTS:
+        chart = chart_class()
+        chart.draw(data)
+        chart.figure.suptitle(title, fontsize=9, color="gray", x=0.01, ha="left")
+        chart.figure.tight_layout()
+        pages.append((chart_class.name, chart.figure))
+
+    written = []
+    pdf = PdfPages(os.path.join(directory, f"{name}.pdf")) if "pdf" in formats else None
+    try:
+        for page, figure in pages:
+            FigureCanvasAgg(figure)
+            if "png" in formats:
+                path = os.path.join(directory, f"{name}-{page}.png")
+                figure.savefig(path, dpi=dpi)
+                written.append(path)
+            if pdf is not None:
+                pdf.savefig(figure)
+    finally:
+        if pdf is not None:
+            pdf.close()
+            written.append(os.path.join(directory, f"{name}.pdf"))
+    return written
+
+
+def generate(patients_col, appointments_col, year, directory=REPORT_DIR, kinds=KINDS, formats=FORMATS,
+             workers=None, dpi=DPI, on_report=None):
+    # returns the files written. on_report(title, files) as each report is finished
+    directory = os.path.join(directory, str(year))
+    os.makedirs(directory, exist_ok=True)
+    # spawned rather than forked, the parent has a database client and its threads
+    context = multiprocessing.get_context("spawn")
+    written = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool:
+        pending = {pool.submit(render_report, title, name, data, directory, formats, dpi): title
+                   for title, name, data in reports(patients_col, appointments_col, year, kinds)}
+        for future in as_completed(pending):
+            files = future.result()
+            written.extend(files)
+            if on_report is not None:
+                on_report(pending[future], files)
+    return sorted(written)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the dashboard charts as monthly, insurer and "
+                                                 "consultation type reports")
+    parser.add_argument("--year", type=int, default=datetime.now().year)
+    parser.add_argument("--by", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--out", default=REPORT_DIR)
+    parser.add_argument("--format", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--workers", type=int, default=None, help="processes drawing reports, default one per core")
+    parser.add_argument("--dpi", type=int, default=DPI)
+    args = parser.parse_args(argv)
+
+    import db
+
+    database = db.get_database()
+    started = time.perf_counter()
+    try:
+        files = generate(database["patients"], database["appointments"], args.year, args.out, args.by, args.format,
+                         args.workers, args.dpi, on_report=lambda title, files: print(f"{title}: {len(files)} files"))
+    finally:
+        db.close()
+    print(f"{len(files)} files in {os.path.join(args.out, str(args.year))} "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
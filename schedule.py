@@ -0,0 +1,138 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+import sync
+
+# appointment times. every appointment has a start and an end datetime next to the
+# date and free text time it always had (the list and exports still show those), its
+# length comes from the consultation type. nothing is longer than LONGEST, so every
+# appointment overlapping [start, end) starts in (start - LONGEST, end) and one range
+# scan of the (start, end) index finds them, the same bound makes IntervalIndex a bisect
+
+DURATIONS = {"General Checkup": 30, "Follow-up": 20, "Specialist": 45, "Emergency": 60, "Vaccination": 15}
+DEFAULT_MINUTES = 30
+LONGEST = timedelta(minutes=max(max(DURATIONS.values()), DEFAULT_MINUTES))
+
+
+def duration(consultation_type):
+    return timedelta(minutes=DURATIONS.get(consultation_type, DEFAULT_MINUTES))
+
+
+def slot(date, time_text, consultation_type):
+    # (start, end) from the form values, time_text is "HH:MM"
+    hours, minutes = (int(part) for part in time_text.split(":"))
+    start = datetime(date.year, date.month, date.day, hours, minutes)
+    return start, start + duration(consultation_type)
+
+
+def overlap_query(start, end):
+    # every appointment overlapping [start, end)
+    return {"start": {"$gt": start - LONGEST, "$lt": end}, "end": {"$gt": start}}
+
+
+def conflict_query(start, end):
+    # a cancelled appointment no longer holds its slot
+    return dict(overlap_query(start, end), status={"$ne": "Cancelled"})
+
+
+def describe_conflicts(appointments, limit=3):
+    lines = [f"{appt.get('patient_name', 'N/A')} {appt['start'].strftime('%Y-%m-%d %H:%M')}-"
+             f"{appt['end'].strftime('%H:%M')} ({appt.get('consultation_type', 'N/A')})"
+             for appt in appointments[:limit]]
+    if len(appointments) > limit:
+        lines.append(f"and {len(appointments) - limit} more")
+    return "\n".join(lines)
+
+
+def backfill(collection, batch_size=1000):
+    # appointments saved before start/end existed get them from date, time and type.
+    # {"start": None} is answered from the (start, end) index, so once everything has
+    # been filled in this costs nothing at startup. stamped like every other write, so
+    # the other stations' pollers pick the times up
+    from pymongo import UpdateOne
+
+    updated = 0
+    batch = []
+    for appt in collection.find({"start": None}, {"date": 1, "time": 1, "consultation_type": 1}):
+        try:
+            start, end = slot(appt["date"], appt["time"], appt.get("consultation_type"))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            # no usable date or time, left out of the calendar
+            continue
+        batch.append(UpdateOne({"_id": appt["_id"]}, sync.stamped_update({"$set": {"start": start, "end": end}})))
+        if len(batch) >= batch_size:
+            collection.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+
+class IntervalIndex:
+    # the appointments of one loaded window ordered by start. an overlap lookup
+    # bisects to the starts within LONGEST before the interval and checks their ends,
+    # O(log n + k) however many appointments the window holds
+    def __init__(self, appointments=()):
+        # (start, str(_id)) in order
+        self._starts = []
+        self._items = {}
+        for appt in appointments:
+            self.add(appt)
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, appointment_id):
+        return self._items.get(str(appointment_id))
+
+    def add(self, appt):
+        # also replaces an appointment already held, e.g. after a status change
+        key = str(appt["_id"])
+        self.remove(key)
+        if not isinstance(appt.get("start"), datetime) or not isinstance(appt.get("end"), datetime):
+            return
+        insort(self._starts, (appt["start"], key))
+        self._items[key] = appt
+
+    def remove(self, appointment_id):
+        key = str(appointment_id)
+        appt = self._items.pop(key, None)
+        if appt is not None:
+            del self._starts[bisect_left(self._starts, (appt["start"], key))]
+
+    def overlapping(self, start, end, exclude=None):
+        lo = bisect_right(self._starts, start - LONGEST, key=itemgetter(0))
+        hi = bisect_left(self._starts, end, lo, key=itemgetter(0))
+        return [self._items[key] for _, key in self._starts[lo:hi]
+                if key != exclude and self._items[key]["end"] > start]
+
+    def conflicts(self, start, end, exclude=None):
+        return [appt for appt in self.overlapping(start, end, exclude) if appt.get("status") != "Cancelled"]
+
+
+def lanes(appointments):
+    # side by side columns for overlapping appointments: str(_id) -> (lane, lanes in its group)
+    placed = {}
+    group, lane_ends, group_end = [], [], None
+    for appt in sorted(appointments, key=lambda a: (a["start"], a["end"])):
+        if group_end is not None and appt["start"] >= group_end:
+            for key in group:
+                placed[key] = (placed[key], len(lane_ends))
+            group, lane_ends, group_end = [], [], None
+        for lane, lane_end in enumerate(lane_ends):
+            if lane_end <= appt["start"]:
+                break
+        else:
+            lane = len(lane_ends)
+            lane_ends.append(None)
+        lane_ends[lane] = appt["end"]
+        key = str(appt["_id"])
+        placed[key] = lane
+        group.append(key)
+        group_end = appt["end"] if group_end is None else max(group_end, appt["end"])
+    for key in group:
+        placed[key] = (placed[key], len(lane_ends))
+    return placed
@@ -0,0 +1,96 @@
+import name_search
+
+# builds the one query the Search Patients tab sends, every criterion that was
+# filled in is ANDed together so the server can pick a single index for it.
+# a name is resolved by the in-memory name_search.NameIndex: every patient whose name
+# matches (typos included), best first, and only those ids that the rest of the
+# criteria also match are kept, checked on the server ID_CHUNK at a time
+
+# ids per $in when the name's matches are checked against the other criteria
+ID_CHUNK = 10000
+
+# matches nothing, what the results list shows before the first search
+NOTHING = {"_id": {"$in": []}}
+
+
+def name_clause(text):
+    # the fallback while the index is loading, the name as typed anywhere in it, ignoring case
+    return name_search.regex_query(text)
+
+
+def name_matches(text, name_index):
+    # every matching _id best first, None until the index has loaded
+    if name_index is None or not name_index.ready:
+        return None
+    return [patient_id for patient_id, score in name_index.search(text)]
+
+
+def matching(ids, query, patients_col, chunk=ID_CHUNK):
+    # the ids that query matches too, in the same order
+    if not query:
+        return ids
+    found = set()
+    for i in range(0, len(ids), chunk):
+        found.update(patient["_id"] for patient in
+                     patients_col.find({"$and": [query, {"_id": {"$in": ids[i:i + chunk]}}]}, {"_id": 1}))
+    return [patient_id for patient_id in ids if patient_id in found]
+
+
+def resolve(name, name_index, patients_col, within=None, **criteria):
+    # (query, ids) for a search. ids are the name's matches in rank order that the
+    # query matches too, or None when there's no name or the index hasn't loaded and the
+    # query matches the name itself. within is an earlier (query, ids) to search inside
+    ids = name_matches(name, name_index) if name else None
+    query = build(name_clause(name) if name and ids is None else None, **criteria)
+    if within is not None:
+        query = narrow(within[0], query)
+        if within[1] is not None:
+            if ids is None:
+                ids = within[1]
+            else:
+                earlier = set(within[1])
+                ids = [patient_id for patient_id in ids if patient_id in earlier]
+    if ids is not None:
+        ids = matching(ids, query, patients_col)
+    return query, ids
+
+
+def combine(clauses):
+    flat = []
+    for clause in clauses:
+        if not clause:
+            continue
+        if list(clause) == ["$and"]:
+            flat.extend(clause["$and"])
+        else:
+            flat.append(clause)
+    if not flat:
+        return {}
+    return flat[0] if len(flat) == 1 else {"$and": flat}
+
+
+def build(name=None, min_age=None, max_age=None, from_date=None, to_date=None, insurance=None):
+    # name is a name_clause() or None, the rest are plain values or None
+    clauses = [name]
+    age = {}
+    if min_age is not None:
+        age["$gte"] = min_age
+    if max_age is not None:
+        age["$lte"] = max_age
+    if age:
+        clauses.append({"age": age})
+    registered = {}
+    if from_date is not None:
+        registered["$gte"] = from_date
+    if to_date is not None:
+        registered["$lte"] = to_date
+    if registered:
+        clauses.append({"registration_date": registered})
+    if insurance and insurance != "All":
+        clauses.append({"insurance": insurance})
+    return combine(clauses)
+
+
+def narrow(current, query):
+    # the new criteria applied within the current results instead of the whole collection
+    return combine([current, query])
@@ -0,0 +1,284 @@
+import argparse
+import struct
+import sys
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import counters
+import indexes
+import schedule
+import sync
+
+# synthetic patients, appointments and audit events for trying the app at scale.
+# the same --seed and sizes always give the same documents (and the same _ids, only
+# the updated_at sync stamps differ), so benchmark runs against a reseeded database
+# compare like with like.
+#   python seed.py --patients 1000000 [--appointments N] [--audit N] [--seed 1] [--drop]
+# appointments default to 3 per patient and audit events to 1 per patient. names,
+# ages, insurance, visit counts and statuses are skewed the way a clinic's are, a
+# few common surnames, more elderly on Medicare, long standing patients visiting more.
+# it refuses to write into a database that already has patients unless --drop is
+# given, which empties the registry collections first
+
+BATCH_SIZE = 10000
+YEARS = 5
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Christopher", "Lisa", "Daniel", "Nancy", "Matthew", "Betty", "Anthony", "Sandra", "Mark", "Margaret",
+    "Priya", "Wei", "Fatima", "Carlos", "Aisha", "Hiroshi", "Olga", "Mohammed", "Ana", "Raj",
+    "Siobhan", "Kwame", "Ingrid", "Mateo", "Yuki", "Leila", "Dmitri", "Chloe", "Tariq", "Noor",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Patel", "Nguyen", "Kim", "Chen", "Singh", "Khan", "Kowalski", "O'Brien", "Müller", "Rossi",
+    "Okafor", "Tanaka", "Ivanova", "Haddad", "Silva", "Novak", "Larsen", "Dubois", "Mensah", "Fernández",
+]
+CONDITIONS = ["Hypertension", "Type 2 diabetes", "Asthma", "High cholesterol", "Arthritis", "Migraine",
+              "Hypothyroidism", "COPD", "Depression", "Penicillin allergy", "Atrial fibrillation", "Back pain"]
+REASONS = {
+    "General Checkup": ["Annual physical", "Routine checkup", "Blood pressure check", "Fatigue"],
+    "Follow-up": ["Lab results", "Medication review", "Post-op follow-up", "Blood sugar review"],
+    "Specialist": ["Cardiology referral", "Dermatology referral", "Orthopedic consult", "ENT consult"],
+    "Emergency": ["Chest pain", "Fracture", "High fever", "Laceration"],
+    "Vaccination": ["Flu shot", "Tetanus booster", "Travel vaccines", "COVID-19 booster"],
+}
+GENDERS = (["Female", "Male", "Other"], [0.51, 0.47, 0.02])
+CONSULTATIONS = (list(schedule.DURATIONS), [0.45, 0.25, 0.12, 0.08, 0.10])
+BASE_BILL = {"General Checkup": 80, "Follow-up": 60, "Specialist": 220, "Emergency": 450, "Vaccination": 35}
+ACTORS = ["reception", "dr.patel", "dr.nguyen", "nurse.kim", "admin"]
+# object id tags, so the generated _ids of different collections never collide
+TAGS = {"patients": 1, "appointments": 2, "audit_logs": 3}
+
+
+def zipf_weights(count, exponent=1.1):
+    import numpy as np
+
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def object_ids(collection, seconds, first):
+    # the timestamp part from the document's own date, then a sequence number, so _id
+    # order follows time like real ids do and a rerun gives the same ids
+    tag = TAGS[collection]
+    return [ObjectId(struct.pack(">IBxxxI", max(int(second), 0), tag, first + i)) for i, second in enumerate(seconds)]
+
+
+def generator(seed, collection, batch):
+    import numpy as np
+
+    # one stream per batch, a batch comes out the same whatever was generated before it
+    return np.random.default_rng([seed, TAGS[collection], batch])
+
+
+class Patients:
+    # what appointments and audit events need to know about the patients generated,
+    # a few numpy arrays rather than the documents
+    def __init__(self, count):
+        import numpy as np
+
+        self.count = count
+        self.registered = np.zeros(count, dtype="int64")
+        self.first = np.zeros(count, dtype="int16")
+        self.last = np.zeros(count, dtype="int16")
+
+    def name(self, i):
+        return f"{FIRST_NAMES[self.first[i]]} {LAST_NAMES[self.last[i]]}"
+
+    def object_id(self, i):
+        return object_ids("patients", [self.registered[i]], int(i))[0]
+
+
+def patient_batch(rng, patients, first, size, now):
+    import numpy as np
+
+    start = now - timedelta(days=365 * YEARS)
+    span = (now - start).total_seconds()
+    # more registrations every year
+    registered = start.timestamp() + span * np.sort(rng.random(size) ** 0.7)
+    first_names = rng.choice(len(FIRST_NAMES), size, p=zipf_weights(len(FIRST_NAMES), 0.8))
+    last_names = rng.choice(len(LAST_NAMES), size, p=zipf_weights(len(LAST_NAMES), 1.1))
+    group = rng.choice(3, size, p=[0.2, 0.55, 0.25])
+    ages = np.where(group == 0, rng.integers(0, 18, size),
+                    np.where(group == 1, rng.normal(42, 12, size), rng.normal(74, 7, size)))
+    ages = np.clip(ages, 0, 100).astype(int)
+    genders = rng.choice(GENDERS[0], size, p=GENDERS[1])
+    insurance = np.where(ages >= 65,
+                         rng.choice(["Medicare", "Private", "Medicaid", "None"], size, p=[0.8, 0.12, 0.06, 0.02]),
+                         rng.choice(["Private", "Medicaid", "None", "Medicare"], size, p=[0.58, 0.2, 0.18, 0.04]))
+    conditions = rng.poisson(0.8, size)
+
+    end = first + size
+    patients.registered[first:end] = registered
+    patients.first[first:end] = first_names
+    patients.last[first:end] = last_names
+    ids = object_ids("patients", registered, first)
+    docs = []
+    for i in range(size):
+        history = rng.choice(CONDITIONS, min(conditions[i], 3), replace=False) if conditions[i] else []
+        docs.append(sync.stamped({
+            "_id": ids[i],
+            "name": f"{FIRST_NAMES[first_names[i]]} {LAST_NAMES[last_names[i]]}",
+            "age": int(ages[i]),
+            "gender": str(genders[i]),
+            "insurance": str(insurance[i]),
+            "medical_history": ", ".join(history),
+            "registration_date": datetime.fromtimestamp(registered[i]).replace(microsecond=0),
+        }))
+    return docs
+
+
+def appointment_batch(rng, patients, first, size, now):
+    import numpy as np
+
+    # long standing patients (the low indexes) come back the most
+    who = np.minimum((patients.count * rng.random(size) ** 2.5).astype(int), patients.count - 1)
+    horizon = (now + timedelta(days=60)).timestamp()
+    days = patients.registered[who] + (horizon - patients.registered[who]) * rng.random(size)
+    quarter = rng.integers(8 * 4, 18 * 4, size)
+    types = rng.choice(CONSULTATIONS[0], size, p=CONSULTATIONS[1])
+    bills = rng.lognormal(0, 0.35, size)
+    past = days < now.timestamp()
+    statuses = np.where(past,
+                        rng.choice(["Completed", "Cancelled", "Scheduled"], size, p=[0.82, 0.12, 0.06]),
+                        rng.choice(["Scheduled", "Cancelled"], size, p=[0.93, 0.07]))
+    booked = rng.integers(1, 30, size)
+
+    ids = object_ids("appointments", days - booked * 86400, first)
+    docs = []
+    for i in range(size):
+        day = datetime.fromtimestamp(days[i]).replace(hour=0, minute=0, second=0, microsecond=0)
+        time_text = f"{quarter[i] // 4:02d}:{quarter[i] % 4 * 15:02d}"
+        consultation_type = str(types[i])
+        start, end = schedule.slot(day, time_text, consultation_type)
+        status = str(statuses[i])
+        doc = {
+            "_id": ids[i],
+            "patient_id": str(patients.object_id(who[i])),
+            "patient_name": patients.name(who[i]),
+            "date": day,
+            "time": time_text,
+            "start": start,
+            "end": end,
+            "consultation_type": consultation_type,
+            "reason": REASONS[consultation_type][int(rng.integers(len(REASONS[consultation_type])))],
+            "bill_amount": round(BASE_BILL[consultation_type] * float(bills[i]), 2),
+            "status": status,
+            "created_at": start - timedelta(days=int(booked[i])),
+        }
+        if status == "Completed":
+            doc["completed_at"] = end
+        elif status == "Cancelled":
+            doc["cancelled_at"] = doc["created_at"] + (start - doc["created_at"]) / 2
+        docs.append(sync.stamped(doc))
+    return docs
+
+
+def audit_batch(rng, patients, first, size, now):
+    import numpy as np
+
+    # a year of events, busier lately, most of them about appointments
+    timestamps = np.sort(now.timestamp() - 365 * 86400 * rng.random(size) ** 1.5)[::-1]
+    kinds = rng.choice(4, size, p=[0.15, 0.2, 0.45, 0.2])
+    who = rng.integers(0, patients.count, size)
+    actors = rng.choice(ACTORS, size)
+    ids = object_ids("audit_logs", timestamps, first)
+    docs = []
+    for i in range(size):
+        patient_id, name = patients.object_id(who[i]), patients.name(who[i])
+        if kinds[i] == 0:
+            entity, entity_id, action = "patients", patient_id, f"Added patient: {name} (ID: {patient_id})"
+            changes = {"name": [None, name]}
+        elif kinds[i] == 1:
+            entity, entity_id, action = "patients", patient_id, f"Updated patient ID: {patient_id}"
+            changes = {"insurance": ["None", "Private"]}
+        elif kinds[i] == 2:
+            entity_id = object_ids("appointments", [timestamps[i]], int(rng.integers(2 ** 31)))[0]
+            entity, action = "appointments", f"Scheduled appointment for {name}"
+            changes = {"status": [None, "Scheduled"]}
+        else:
+            entity_id = object_ids("appointments", [timestamps[i]], int(rng.integers(2 ** 31)))[0]
+            entity, action = "appointments", f"Marked appointment as completed: {entity_id}"
+            changes = {"status": ["Scheduled", "Completed"]}
+        docs.append({
+            "_id": ids[i],
+            "timestamp": datetime.fromtimestamp(timestamps[i]),
+            "actor": str(actors[i]),
+            "action": action,
+            "entity": entity,
+            "entity_id": str(entity_id),
+            "changes": changes,
+        })
+    return docs
+
+
+def fill(collection, make, total, seed, patients, now, on_progress=None):
+    done = 0
+    for batch, first in enumerate(range(0, total, BATCH_SIZE)):
+        size = min(BATCH_SIZE, total - first)
+        docs = make(generator(seed, collection.name, batch), patients, first, size, now)
+        collection.insert_many(docs, ordered=False)
+        done += size
+        if on_progress is not None:
+            on_progress(collection.name, done, total)
+    return done
+
+
+def generate(database, patients=10000, appointments=None, audit_events=None, seed=1, now=None, on_progress=None):
+    # fills database's patients, appointments and audit_logs, then the dashboard counters.
+    # now fixes the clock the dates are spread back from, for exactly repeatable data
+    now = (now or datetime.now()).replace(microsecond=0)
+    appointments = patients * 3 if appointments is None else appointments
+    audit_events = patients if audit_events is None else audit_events
+    generated = Patients(patients)
+    counts = {
+        "patients": fill(database["patients"], patient_batch, patients, seed, generated, now, on_progress),
+        "appointments": fill(database["appointments"], appointment_batch, appointments, seed, generated, now, on_progress),
+        "audit_logs": fill(database["audit_logs"], audit_batch, audit_events, seed, generated, now, on_progress),
+    }
+    counters.rebuild(database["patients"], database["appointments"], database["stats"])
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill the registry with synthetic data")
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--appointments", type=int, default=None, help="default 3 per patient")
+    parser.add_argument("--audit", type=int, default=None, help="audit events, default 1 per patient")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drop", action="store_true", help="empty the registry collections first")
+    args = parser.parse_args(argv)
+    if args.patients <= 0:
+        parser.error("--patients must be at least 1")
+
+    import db
+
+    database = db.get_database()
+    if args.drop:
+        for name in ("patients", "appointments", "audit_logs", "stats", "tombstones"):
+            database[name].drop()
+    elif database["patients"].estimated_document_count():
+        print(f"{db.DATABASE} already has patients, use --drop to replace them")
+        return 1
+    indexes.ensure_indexes(database)
+
+    def progress(name, done, total):
+        if done == total or done % (BATCH_SIZE * 10) == 0:
+            print(f"{name}: {done:,}/{total:,}")
+
+    started = datetime.now()
+    try:
+        counts = generate(database, args.patients, args.appointments, args.audit, args.seed, on_progress=progress)
+    finally:
+        db.close()
+    print(", ".join(f"{count:,} {name}" for name, count in counts.items()) +
+          f" in {(datetime.now() - started).total_seconds():.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+import analytics
+import audit
+import counters
+import db
+import exporters
+import indexes
+import schedule
+import search_query
+import sync
+
+# the registry's operations without any UI. app.py calls these from its worker and
+# api.py from its thread pool, so a patient added at the desktop or over HTTP goes
+# through the same counters, audit trail and sync stamps. every method blocks on the
+# database, none of them touch Tk
+
+PATIENT_FIELDS = ("name", "age", "gender", "insurance", "medical_history")
+APPOINTMENT_FIELDS = ("patient_id", "patient_name", "date", "time", "consultation_type", "reason", "bill_amount")
+# status -> (timestamp field, audit message)
+STATUS_CHANGES = {
+    "Completed": ("completed_at", "Marked appointment as completed"),
+    "Cancelled": ("cancelled_at", "Cancelled appointment"),
+}
+PAGE_LIMIT = 500
+
+
+def object_id(value):
+    try:
+        return ObjectId(str(value))
+    except InvalidId:
+        raise ValueError(f"Invalid id: {value}")
+
+
+def whole_number(value, field):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise ValueError(f"{field} must be a whole number")
+
+
+def day(value, field):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"Invalid {field}. Use YYYY-MM-DD")
+
+
+def patient_fields(data, partial=False):
+    # the stored form of what a client sent, partial for an update
+    unknown = set(data) - set(PATIENT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    fields = {}
+    if "name" in data or not partial:
+        fields["name"] = data.get("name") or ""
+        if not isinstance(fields["name"], str) or not fields["name"].strip():
+            raise ValueError("Name cannot be empty")
+    if "age" in data or not partial:
+        fields["age"] = whole_number(data["age"], "age") if data.get("age") not in (None, "") else 0
+    if "gender" in data or not partial:
+        fields["gender"] = data.get("gender") or "Other"
+    if "insurance" in data or not partial:
+        fields["insurance"] = data.get("insurance") or "None"
+    if "medical_history" in data or not partial:
+        fields["medical_history"] = (data.get("medical_history") or "").strip()
+    return fields
+
+
+def keyset_after(field, value, last_id):
+    # ascending (field, _id) order, nulls first like the server sorts them
+    if field == "_id":
+        return {"_id": {"$gt": last_id}}
+    if value is None:
+        return {"$or": [{field: {"$ne": None}}, {field: None, "_id": {"$gt": last_id}}]}
+    return {"$or": [{field: {"$gt": value}}, {field: value, "_id": {"$gt": last_id}}]}
+
+
+class RegistryService:
+    # collection(name) gives a collection, db.collection by default, any database's
+    # get_collection (e.g. mongomock's) works too
+    def __init__(self, collection=db.collection, audit_log=None):
+        self.patients = collection("patients")
+        self.appointments = collection("appointments")
+        self.audit_logs = collection("audit_logs")
+        self.stats = collection("stats")
+        self.tombstones = collection("tombstones")
+        self.audit = audit_log or audit.AuditLogger(self.audit_logs)
+        # a loaded name_search.NameIndex makes name search typo tolerant and ranked, it's
+        # kept current by the writes here
+        self.name_index = None
+        # on_write(collection, id, version) after every write, for a sync.Poller's mark
+        self.on_write = None
+
+    def close(self):
+        return self.audit.close()
+
+    def _wrote(self, collection, entity_id, version):
+        if self.on_write is not None:
+            self.on_write(collection, entity_id, version)
+
+    # patients
+
+    def get_patient(self, patient_id):
+        return self.patients.find_one({"_id": object_id(patient_id)})
+
+    def list_patients(self, sort="name", after=None, limit=50):
+        # one page sorted by (sort, _id), after is the _id of the last patient on the previous page
+        if sort not in ("_id",) + indexes.PATIENT_SORT_FIELDS:
+            raise ValueError(f"Can't sort by {sort}")
+        query = {}
+        if after:
+            last = self.patients.find_one({"_id": object_id(after)}, {sort: 1})
+            if last is None:
+                raise LookupError("Patient not found")
+            query = keyset_after(sort, last.get(sort), last["_id"])
+        order = [("_id", 1)] if sort == "_id" else [(sort, 1), ("_id", 1)]
+        return list(self.patients.find(query).sort(order).limit(min(limit, PAGE_LIMIT)))
+
+    def search_patients(self, name=None, min_age=None, max_age=None, from_date=None, to_date=None,
+                        insurance=None, after=None, limit=50):
+        query, ids = search_query.resolve(name, self.name_index, self.patients, min_age=min_age, max_age=max_age,
+                                          from_date=from_date, to_date=to_date, insurance=insurance)
+        limit = min(limit, PAGE_LIMIT)
+        if ids is not None:
+            # the name's matches best first, after is a position in them
+            start = 0
+            if after:
+                try:
+                    start = ids.index(object_id(after)) + 1
+                except ValueError:
+                    raise LookupError("Patient not found")
+            page = ids[start:start + limit]
+            found = {patient["_id"]: patient for patient in self.patients.find({"_id": {"$in": page}})}
+            return [found[patient_id] for patient_id in page if patient_id in found]
+        if after:
+            last = self.patients.find_one({"_id": object_id(after)}, {"name": 1})
+            if last is None:
+                raise LookupError("Patient not found")
+            query = search_query.combine([query, keyset_after("name", last.get("name"), last["_id"])])
+        return list(self.patients.find(query).sort([("name", 1), ("_id", 1)]).limit(limit))
+
+    def add_patient(self, data):
+        patient = patient_fields(data)
+        patient["registration_date"] = datetime.now()
+        # marked before it's written so this station's own poll can't hand it back first
+        patient["_id"] = ObjectId()
+        self._wrote("patients", patient["_id"], 0)
+        self.patients.insert_one(sync.stamped(patient))
+        counters.patient_added(self.stats, patient)
+        if self.name_index is not None:
+            self.name_index.add(patient["_id"], patient["name"])
+        self.audit.record(f"Added patient: {patient['name']} (ID: {patient['_id']})",
+                          "patients", patient["_id"], audit.diff(None, patient))
+        return patient
+
+    def update_patient(self, patient_id, data):
+        # (before, after), both None when there's no such patient
+        updates = patient_fields(data, partial=True)
+        # the old values come back with the update so the counters can move them
+        before = self.patients.find_one_and_update({"_id": object_id(patient_id)},
+                                                   sync.stamped_update({"$set": updates}))
+        if before is None:
+            return None, None
+        after = dict(before, **updates)
+        self._wrote("patients", before["_id"], before.get("version", 0) + 1)
+        counters.patient_changed(self.stats, before, after)
+        if self.name_index is not None and "name" in updates:
+            self.name_index.update(before["_id"], updates["name"])
+        self.audit.record(f"Updated patient ID: {patient_id}", "patients", patient_id,
+                          audit.diff(before, after, list(updates)))
+        return before, after
+
+    def delete_patient(self, patient_id):
+        # the deleted patient, None if there was none
+        before = self.patients.find_one_and_delete({"_id": object_id(patient_id)})
+        if before is None:
+            return None
+        self._wrote("patients", before["_id"], "deleted")
+        sync.tombstone(self.tombstones, "patients", before["_id"])
+        counters.patient_removed(self.stats, before)
+        if self.name_index is not None:
+            self.name_index.remove(before["_id"])
+        self.audit.record(f"Deleted patient ID: {patient_id}", "patients", patient_id, audit.diff(before, None))
+        return before
+
+    # appointments
+
+    def get_appointment(self, appointment_id):
+        return self.appointments.find_one({"_id": object_id(appointment_id)})
+
+    def list_appointments(self, status=None, start=None, end=None, limit=200):
+        # by start time, within [start, end) when given
+        query = schedule.overlap_query(start, end) if start is not None and end is not None else {}
+        if status and status != "All":
+            query["status"] = status
+        return list(self.appointments.find(query).sort([("start", 1), ("_id", 1)]).limit(min(limit, PAGE_LIMIT)))
+
+    def conflicts(self, start, end, limit=10):
+        return list(self.appointments.find(schedule.conflict_query(start, end)).limit(limit))
+
+    def find_patient(self, name):
+        return self.patients.find_one({"name": name}, {"name": 1}, collation=indexes.NAME_COLLATION)
+
+    def schedule_appointment(self, data, force=False, find_patient=None):
+        # (appointment, []) once it's saved, (None, conflicts) when it overlaps and force
+        # isn't set. find_patient(name) is a lookup by name, e.g. from a cache
+        unknown = set(data) - set(APPOINTMENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        patient_name = data.get("patient_name")
+        if not patient_name and not data.get("patient_id"):
+            raise ValueError("Patient name is required")
+        appointment_date = day(data.get("date"), "date")
+        appointment_time = data.get("time") or ""
+        try:
+            datetime.strptime(appointment_time, "%H:%M")
+        except ValueError:
+            raise ValueError("Invalid time format. Use HH:MM")
+        consultation_type = data.get("consultation_type") or "General Checkup"
+        try:
+            bill_amount = float(data.get("bill_amount") or 0)
+        except (TypeError, ValueError):
+            raise ValueError("bill_amount must be a number")
+
+        start, end = schedule.slot(appointment_date, appointment_time, consultation_type)
+        if not force:
+            clash = self.conflicts(start, end)
+            if clash:
+                return None, clash
+
+        if data.get("patient_id"):
+            patient = self.patients.find_one({"_id": object_id(data["patient_id"])}, {"name": 1})
+        else:
+            patient = (find_patient or self.find_patient)(patient_name)
+        if not patient:
+            raise ValueError("Patient not found")
+        patient_name = patient_name or patient.get("name")
+
+        appointment = {
+            "_id": ObjectId(),
+            "patient_id": str(patient["_id"]),
+            "patient_name": patient_name,
+            "date": appointment_date,
+            "time": appointment_time,
+            "start": start,
+            "end": end,
+            "consultation_type": consultation_type,
+            "reason": (data.get("reason") or "").strip(),
+            "bill_amount": bill_amount,
+            "status": "Scheduled",
+            "created_at": datetime.now()
+        }
+        self._wrote("appointments", appointment["_id"], 0)
+        self.appointments.insert_one(sync.stamped(appointment))
+        self.audit.record(f"Scheduled appointment for {patient_name}", "appointments",
+                          appointment["_id"], audit.diff(None, appointment))
+        return appointment, []
+
+    def set_appointment_status(self, appointment_id, status):
+        # (before, after), both None when there's no such appointment
+        if status not in STATUS_CHANGES:
+            raise ValueError(f"Status must be one of {', '.join(STATUS_CHANGES)}")
+        stamp_field, message = STATUS_CHANGES[status]
+        changes = {"status": status, stamp_field: datetime.now()}
+        before = self.appointments.find_one_and_update({"_id": object_id(appointment_id)},
+                                                       sync.stamped_update({"$set": changes}))
+        if before is None:
+            return None, None
+        self._wrote("appointments", before["_id"], before.get("version", 0) + 1)
+        counters.appointment_status_changed(self.stats, before, status)
+        self.audit.record(f"{message}: {appointment_id}", "appointments", appointment_id,
+                          audit.diff(before, changes, list(changes)))
+        return before, dict(before, **changes)
+
+    # dashboard, audit and export
+
+    def dashboard(self, facets=()):
+        return analytics.load_dashboard(self.patients, self.appointments, self.stats, facets)
+
+    def audit_entries(self, entity=None, since=None, until=None, before=None, limit=100):
+        # newest first, before is the _id of the last entry on the previous page
+        query = {}
+        if entity:
+            query["entity"] = entity
+        logged = {}
+        if since is not None:
+            logged["$gte"] = since
+        if until is not None:
+            logged["$lt"] = until
+        if logged:
+            query["timestamp"] = logged
+        if before:
+            last = self.audit_logs.find_one({"_id": object_id(before)}, {"timestamp": 1})
+            if last is None:
+                raise LookupError("Audit entry not found")
+            query = search_query.combine([query, {"$or": [
+                {"timestamp": {"$lt": last["timestamp"]}},
+                {"timestamp": last["timestamp"], "_id": {"$lt": last["_id"]}}]}])
+        return list(self.audit_logs.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(min(limit, PAGE_LIMIT)))
+
+    def export_ndjson(self, name, batch_size=exporters.BATCH_SIZE):
+        # the same lines as exporters.export_ndjson, a batch of them at a time
+        if name not in exporters.SCHEMAS:
+            raise LookupError(f"No collection {name}")
+        collection = self.patients if name == "patients" else self.appointments
+        encoder = json.JSONEncoder(default=exporters.json_default, ensure_ascii=False, separators=(",", ":"))
+        for batch in exporters.batches(collection, exporters.SYNC_FIELDS, batch_size):
+            yield "".join(encoder.encode(doc) + "\n" for doc in batch)
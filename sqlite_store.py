@@ -0,0 +1,895 @@
+import contextlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+import perf
+
+# the registry in one SQLite file instead of a MongoDB server, for a clinic with a
+# single workstation (PATIENT_REGISTRY_BACKEND=sqlite, see db.py). it is the part of
+# pymongo's Database, Collection and Cursor the app, service.py and the tools use, so
+# everything that takes a collection works with either one:
+#   Database    db[name], get_collection, list_collection_names, create_collection, drop_collection
+#   Collection  find, find_one, count_documents, estimated_document_count, distinct, insert_one,
+#               insert_many, update_one, replace_one, find_one_and_update, find_one_and_delete,
+#               delete_one, delete_many, bulk_write, aggregate, create_index, drop, with_options
+#   Cursor      sort, skip, limit, collation, batch_size, explain, iterating
+#   filters     equality, $eq $ne $gt $gte $lt $lte $in $nin $exists $regex, $and $or, dotted fields
+#   updates     $set $unset $inc $setOnInsert, dotted fields, upsert
+#   pipelines   $match then $group, $bucket or $count in SQL, $facet, then $sort $limit $count $merge,
+#               with $sum $avg $min $max $year $month $cond/$isNumber
+#   collations  strength 1 or 2 compares and sorts strings casefolded (accents still count at 2)
+# anything else raises NotImplementedError rather than quietly doing something different,
+# and nothing outside this list is there (no update_many, no find_one_and_replace, no watch).
+# tests/test_sqlite_store.py runs the same calls against mongomock and this.
+#
+# a collection is a table (_id, doc) with the document as JSON, datetimes as
+# {"$date": iso} and ObjectIds as {"$oid": hex}. create_index makes an expression
+# index on json_extract of each key, the same expressions the queries use, so the
+# indexes in indexes.py serve the same lookups here (python indexes.py --check works).
+# WAL mode, so the worker's reads never wait for a write. one connection per thread.
+# triggers keep each collection's document count in the _counts table
+
+BUSY_SECONDS = 10
+# fields holding datetimes, compared and sorted by their ISO text
+DATE_FIELDS = {"registration_date", "date", "start", "end", "created_at", "completed_at", "cancelled_at",
+               "timestamp", "updated_at", "rebuilt_at"}
+# iterating more rows than this (or no limit) reads on a connection of its own, so
+# the thread can write while it goes through them (e.g. schedule.backfill)
+EAGER_ROWS = 1000
+FETCH_ROWS = 500
+TTL_CHECK_SECONDS = 60
+COUNTS = "_counts"
+NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+FIELD = re.compile(r"^[^'\"$][^'\"]*$")
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        # milliseconds, as a BSON date keeps them
+        value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+        return {"$date": value.isoformat(timespec="microseconds")}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Can't store {type(value).__name__}")
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        value = obj.get("$date")
+        if value is not None:
+            return datetime.fromisoformat(value)
+        value = obj.get("$oid")
+        if value is not None:
+            return ObjectId(value)
+    return obj
+
+
+# made once, json.loads with a hook builds a new decoder for every document
+dumps = json.JSONEncoder(default=_encode, ensure_ascii=False, separators=(",", ":")).encode
+loads = json.JSONDecoder(object_hook=_decode).decode
+
+
+def key(value):
+    # the _id column
+    if isinstance(value, (ObjectId, str)):
+        return str(value)
+    return dumps(value)
+
+
+def sql_value(value):
+    # a query value as the json_extract of the stored field compares to it
+    if isinstance(value, datetime):
+        return _encode(value)["$date"]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (dict, list)):
+        return dumps(value)
+    return value
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _regexp(pattern, flags, value):
+    if not isinstance(value, str):
+        return 0
+    return 1 if re.search(pattern, value, flags) else 0
+
+
+def get_path(doc, path, default=None):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+def set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def unset_path(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                set_path(doc, path, value)
+            elif op == "$inc":
+                set_path(doc, path, get_path(doc, path, 0) + value)
+            elif op == "$unset":
+                unset_path(doc, path)
+            elif op != "$setOnInsert":
+                raise NotImplementedError(f"Update operator {op} isn't supported by the SQLite store")
+    return doc
+
+
+def project(doc, projection):
+    if not projection:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = dict.fromkeys(projection, 1)
+    included = [field for field, on in projection.items() if on and field != "_id"]
+    if included:
+        projected = {field: doc[field] for field in included if field in doc}
+    else:
+        projected = {field: value for field, value in doc.items() if projection.get(field, 1)}
+    if projection.get("_id", 1) and "_id" in doc:
+        projected["_id"] = doc["_id"]
+    else:
+        projected.pop("_id", None)
+    return projected
+
+
+def sort_spec(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+def _nocase(collation):
+    # en with strength 1 or 2 ignores case, for any script, which casefold() gives.
+    # an index with such a collation is on casefold() of the field, so it's the stored key
+    return bool(collation) and collation.get("strength", 3) <= 2
+
+
+class Query:
+    # a filter document as an SQL WHERE, its parameters in params
+    def __init__(self, nocase=False):
+        self.params = []
+        self.nocase = nocase
+
+    def path(self, field):
+        if not FIELD.match(field):
+            raise ValueError(f"Unsupported field name: {field}")
+        return "$" + "".join(f'."{part}"' for part in field.split("."))
+
+    def field(self, field, value=None):
+        if field == "_id":
+            return "_id"
+        path = self.path(field)
+        if field.split(".")[-1] in DATE_FIELDS or isinstance(value, datetime):
+            path += '."$date"'
+        elif isinstance(value, ObjectId):
+            path += '."$oid"'
+        return f"json_extract(doc, '{path}')"
+
+    def compared(self, field, value=None):
+        # the field as comparisons and sorts see it, casefolded under a case insensitive collation
+        expr = self.field(field, value)
+        return f"casefold({expr})" if self.nocase and field != "_id" else expr
+
+    def param(self, field, value):
+        if field == "_id":
+            self.params.append(key(value))
+        else:
+            self.params.append(_casefold(sql_value(value)) if self.nocase else sql_value(value))
+        return "?"
+
+    def where(self, query):
+        clauses = []
+        for field, condition in (query or {}).items():
+            if field == "$and":
+                clauses.append("(" + " AND ".join(self.where(part) for part in condition) + ")" if condition else "1")
+            elif field == "$or":
+                clauses.append(self.keyset(condition) or
+                               ("(" + " OR ".join(self.where(part) for part in condition) + ")" if condition else "0"))
+            elif field.startswith("$"):
+                raise NotImplementedError(f"Query operator {field} isn't supported by the SQLite store")
+            elif isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                options = condition.get("$options", "")
+                clauses.extend(self.operator(field, op, value, options)
+                               for op, value in condition.items() if op != "$options")
+            else:
+                clauses.append(self.operator(field, "$eq", condition))
+        return " AND ".join(clauses) or "1"
+
+    def keyset(self, clauses):
+        # [{f: {$gt: v}}, {f: v, _id: {$gt: id}}], the next page of a (f, _id) order, as
+        # f >= v AND (f > v OR _id > id), which seeks on the (f, _id) index instead of scanning
+        if len(clauses) != 2 or len(clauses[0]) != 1 or len(clauses[1]) != 2:
+            return None
+        (field, first), second = next(iter(clauses[0].items())), clauses[1]
+        if field == "_id" or not isinstance(first, dict) or len(first) != 1:
+            return None
+        op, value = next(iter(first.items()))
+        if op not in ("$gt", "$lt") or value is None or isinstance(value, (dict, list)) or \
+                second.get(field) != value or second.get("_id") is None or list(second["_id"]) != [op]:
+            return None
+        sign = ">" if op == "$gt" else "<"
+        expr = self.compared(field, value)
+        return (f"({expr} {sign}= {self.param(field, value)} AND "
+                f"({expr} {sign} {self.param(field, value)} OR _id {sign} {self.param('_id', second['_id'][op])}))")
+
+    def operator(self, field, op, value, options=""):
+        expr = self.field(field, value)
+        if op == "$eq":
+            if value is None:
+                return f"{expr} IS NULL"
+            return f"{self.compared(field, value)} = {self.param(field, value)}"
+        if op == "$ne":
+            if value is None:
+                return f"{expr} IS NOT NULL"
+            return f"({expr} IS NULL OR {self.compared(field, value)} != {self.param(field, value)})"
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            sign = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}[op]
+            return f"{self.compared(field, value)} {sign} {self.param(field, value)}"
+        if op in ("$in", "$nin"):
+            values = [item for item in value if item is not None]
+            expr = self.field(field, values[0] if values else None)
+            placeholders = ", ".join(self.param(field, v) for v in values)
+            compared = self.compared(field, values[0] if values else None)
+            listed = f"{compared} {'IN' if op == '$in' else 'NOT IN'} ({placeholders})"
+            if op == "$in":
+                if None in value:
+                    return f"({expr} IS NULL OR {listed})" if values else f"{expr} IS NULL"
+                return listed if values else "0"
+            if None in value:
+                return f"({expr} IS NOT NULL AND {listed})" if values else f"{expr} IS NOT NULL"
+            return f"({expr} IS NULL OR {listed})" if values else "1"
+        if op == "$exists":
+            typed = expr.replace("json_extract(", "json_type(", 1) if expr != "_id" else "_id"
+            return f"{typed} IS {'NOT ' if value else ''}NULL"
+        if op == "$regex":
+            flags = (value.flags if isinstance(value, re.Pattern) else 0) | (re.I if "i" in options else 0) | \
+                (re.M if "m" in options else 0) | (re.S if "s" in options else 0)
+            self.params.extend([value.pattern if isinstance(value, re.Pattern) else value, int(flags)])
+            return f"regexp(?, ?, {expr})"
+        raise NotImplementedError(f"Query operator {op} isn't supported by the SQLite store")
+
+    def order(self, sort):
+        terms = []
+        for field, direction in sort:
+            terms.append(f"{self.compared(field)} {'DESC' if direction == -1 else 'ASC'}")
+        return ", ".join(terms)
+
+
+class Cursor:
+    def __init__(self, collection, query=None, projection=None, sort=None, skip=0, limit=0, collation=None,
+                 batch_size=None):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort = sort_spec(sort) if sort else []
+        self._skip = skip
+        self._limit = limit
+        self._collation = collation
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def collation(self, collation):
+        self._collation = collation
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _sql(self, select="doc"):
+        query = Query(_nocase(self._collation))
+        sql = f'SELECT {select} FROM "{self._collection.name}" WHERE {query.where(self._query)}'
+        if self._sort:
+            sql += f" ORDER BY {query.order(self._sort)}"
+        if self._limit or self._skip:
+            sql += f" LIMIT {int(self._limit) if self._limit else -1} OFFSET {int(self._skip)}"
+        return sql, query.params
+
+    def __iter__(self):
+        sql, params = self._sql()
+        collection = self._collection
+        if self._limit and self._limit <= EAGER_ROWS:
+            started = time.perf_counter()
+            rows = collection.database.connection().execute(sql, params).fetchall()
+            collection._record("find", started, len(rows))
+            return iter([project(loads(row[0]), self._projection) for row in rows])
+        return self._stream(sql, params)
+
+    def _stream(self, sql, params):
+        connection = self._collection.database.connect()
+        try:
+            cursor = connection.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    return
+                for row in rows:
+                    yield project(loads(row[0]), self._projection)
+        finally:
+            connection.close()
+
+    def explain(self):
+        # MongoDB's explain shape, enough for indexes.check_queries
+        sql, params = self._sql()
+        details = [row[3] for row in self._collection.database.connection().execute("EXPLAIN QUERY PLAN " + sql, params)]
+        scans = []
+        for detail in details:
+            if not detail.startswith(("SCAN", "SEARCH")):
+                continue
+            if "INDEX" not in detail and "PRIMARY KEY" not in detail:
+                scans.append({"stage": "COLLSCAN", "details": detail})
+                continue
+            # SCAN ... USING INDEX walks all of it, SEARCH ... USING INDEX (constraints) a range
+            name = re.search(r"INDEX (\S+)", detail)
+            bounds = ["[MinKey, MaxKey]"] if detail.startswith("SCAN") else [detail.partition("(")[2].rstrip(")")]
+            scans.append({"stage": "IXSCAN", "indexName": name.group(1) if name else "_id",
+                          "indexBounds": {"key": bounds}, "details": detail})
+        plan = scans[0] if len(scans) == 1 else {"stage": "OR", "inputStages": scans}
+        if any("TEMP B-TREE" in d for d in details):
+            plan = {"stage": "SORT", "inputStage": plan}
+        return {"queryPlanner": {"winningPlan": plan}}
+
+
+class Collection:
+    def __init__(self, database, name):
+        if not NAME.match(name):
+            raise ValueError(f"Unsupported collection name: {name}")
+        self.database = database
+        self.name = name
+        self._created = False
+        self._ttl_checked = 0
+
+    def __repr__(self):
+        return f"sqlite_store.Collection({self.database.path!r}, {self.name!r})"
+
+    def _table(self):
+        if self._created:
+            return self.name
+        connection = self.database.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS "{self.name}" (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+            for event, change in (("INSERT", "+"), ("DELETE", "-")):
+                connection.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS "{self.name}__{event.lower()}" AFTER {event} ON "{self.name}" '
+                    f"BEGIN UPDATE {COUNTS} SET n = n {change} 1 WHERE name = '{self.name}'; END")
+            # counted once, for a table from before the triggers
+            connection.execute(f'INSERT OR IGNORE INTO {COUNTS} (name, n) SELECT ?, count(*) FROM "{self.name}"',
+                               (self.name,))
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        self._created = True
+        return self.name
+
+    def _record(self, command, started, docs=None):
+        if perf.ENABLED:
+            perf.RECORDER.add("query", f"{command} {self.name}", (time.perf_counter() - started) * 1000, docs)
+
+    @contextlib.contextmanager
+    def _write(self):
+        # one transaction, taken for writing straight away so a read-modify-write can't interleave
+        self._table()
+        connection = self.database.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def with_options(self, **options):
+        return self
+
+    # reads
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, collation=None, batch_size=None,
+             **options):
+        self._table()
+        return Cursor(self, filter, projection, sort, skip, limit, collation)
+
+    def find_one(self, filter=None, projection=None, sort=None, collation=None, **options):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return next(iter(self.find(filter, projection, sort, limit=1, collation=collation)), None)
+
+    def count_documents(self, filter, limit=0, skip=0, collation=None, **options):
+        self._table()
+        started = time.perf_counter()
+        query = Query(_nocase(collation))
+        inner = f'SELECT 1 FROM "{self.name}" WHERE {query.where(filter)}'
+        if limit or skip:
+            inner += f" LIMIT {int(limit) if limit else -1} OFFSET {int(skip)}"
+        count = self.database.connection().execute(f"SELECT count(*) FROM ({inner})", query.params).fetchone()[0]
+        self._record("count", started)
+        return count
+
+    def estimated_document_count(self, **options):
+        # exact, from the trigger kept count
+        self._table()
+        return self.database.connection().execute(f"SELECT n FROM {COUNTS} WHERE name = ?", (self.name,)).fetchone()[0]
+
+    def distinct(self, key, filter=None, **options):
+        # the field's values over the matching documents, an array's elements one by one
+        # like MongoDB, documents without the field left out
+        self._table()
+        started = time.perf_counter()
+        query = Query()
+        path = query.path(key)
+        rows = self.database.connection().execute(
+            f"SELECT DISTINCT json_type(doc, '{path}'), json_extract(doc, '{path}') FROM \"{self.name}\" "
+            f"WHERE {query.where(filter)}", query.params).fetchall()
+        found = {}
+        for kind, value in rows:
+            if kind is None:
+                continue
+            if kind in ("object", "array"):
+                value = loads(value)
+            elif kind in ("true", "false"):
+                value = kind == "true"
+            for item in value if kind == "array" else [value]:
+                found.setdefault(dumps(item), item)
+        self._record("distinct", started, len(found))
+        return list(found.values())
+
+    def _matching(self, connection, filter, sort=None, limit=None):
+        # (_id key, document) pairs, inside a write transaction
+        query = Query()
+        sql = f'SELECT _id, doc FROM "{self.name}" WHERE {query.where(filter)}'
+        if sort:
+            sql += f" ORDER BY {query.order(sort_spec(sort))}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [(row[0], loads(row[1])) for row in connection.execute(sql, query.params).fetchall()]
+
+    # writes
+
+    def _insert(self, connection, doc):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        try:
+            connection.execute(f'INSERT INTO "{self.name}" (_id, doc) VALUES (?, ?)', (key(doc["_id"]), dumps(doc)))
+        except sqlite3.IntegrityError:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} _id: {doc['_id']}", 11000)
+
+    def _expire(self, connection):
+        # what a MongoDB TTL index does in the background, at most once a minute
+        ttl = self.database.ttl.get(self.name)
+        if ttl is None or time.monotonic() - self._ttl_checked < TTL_CHECK_SECONDS:
+            return
+        self._ttl_checked = time.monotonic()
+        field, seconds = ttl
+        query = Query()
+        where = query.where({field: {"$lt": utcnow() - timedelta(seconds=seconds)}})
+        connection.execute(f'DELETE FROM "{self.name}" WHERE {where}', query.params)
+
+    def insert_one(self, document, **options):
+        started = time.perf_counter()
+        with self._write() as connection:
+            self._insert(connection, document)
+            self._expire(connection)
+        self._record("insert", started, 1)
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents, ordered=True, **options):
+        started = time.perf_counter()
+        documents = list(documents)
+        errors = []
+        with self._write() as connection:
+            for index, doc in enumerate(documents):
+                try:
+                    self._insert(connection, doc)
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                    if ordered:
+                        break
+            self._expire(connection)
+        self._record("insert", started, len(documents) - len(errors))
+        if errors:
+            inserted = errors[0]["index"] if ordered else len(documents) - len(errors)
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": inserted,
+                                  "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult([doc["_id"] for doc in documents], True)
+
+    def _update(self, connection, filter, update, upsert=False, replace=False, sort=None):
+        # (before, after, upserted id), before is None when nothing matched
+        found = self._matching(connection, filter, sort, 1)
+        if found:
+            row_id, before = found[0]
+            if replace:
+                after = dict(update, _id=before["_id"])
+            else:
+                after = apply_update(loads(dumps(before)), update)
+            connection.execute(f'UPDATE "{self.name}" SET doc = ? WHERE _id = ?', (dumps(after), row_id))
+            return before, after, None
+        if not upsert:
+            return None, None, None
+        doc = {field: value for field, value in (filter or {}).items()
+               if not field.startswith("$") and not isinstance(value, dict)}
+        doc = dict(update, **({"_id": doc["_id"]} if "_id" in doc else {})) if replace \
+            else apply_update(doc, update, inserting=True)
+        self._insert(connection, doc)
+        return None, doc, doc["_id"]
+
+    def update_one(self, filter, update, upsert=False, **options):
+        started = time.perf_counter()
+        with self._write() as connection:
+            before, after, upserted = self._update(connection, filter, update, upsert)
+        self._record("update", started)
+        return UpdateResult({"n": 1 if after is not None else 0, "nModified": 1 if before is not None else 0,
+                             "upserted": upserted}, True)
+
+    def replace_one(self, filter, replacement, upsert=False, **options):
+        started = time.perf_counter()
+        with self._write() as connection:
+            before, after, upserted = self._update(connection, filter, replacement, upsert, replace=True)
+        self._record("update", started)
+        return UpdateResult({"n": 1 if after is not None else 0, "nModified": 1 if before is not None else 0,
+                             "upserted": upserted}, True)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **options):
+        started = time.perf_counter()
+        with self._write() as connection:
+            before, after, upserted = self._update(connection, filter, update, upsert, sort=sort)
+        self._record("findAndModify", started)
+        result = after if return_document == ReturnDocument.AFTER else before
+        return project(result, projection) if result is not None else None
+
+    def find_one_and_delete(self, filter, projection=None, sort=None, **options):
+        started = time.perf_counter()
+        with self._write() as connection:
+            found = self._matching(connection, filter, sort, 1)
+            if found:
+                connection.execute(f'DELETE FROM "{self.name}" WHERE _id = ?', (found[0][0],))
+        self._record("findAndModify", started)
+        return project(found[0][1], projection) if found else None
+
+    def delete_one(self, filter, **options):
+        started = time.perf_counter()
+        with self._write() as connection:
+            found = self._matching(connection, filter, limit=1)
+            if found:
+                connection.execute(f'DELETE FROM "{self.name}" WHERE _id = ?', (found[0][0],))
+        self._record("delete", started)
+        return DeleteResult({"n": len(found)}, True)
+
+    def delete_many(self, filter, **options):
+        started = time.perf_counter()
+        query = Query()
+        with self._write() as connection:
+            count = connection.execute(f'DELETE FROM "{self.name}" WHERE {query.where(filter)}', query.params).rowcount
+        self._record("delete", started)
+        return DeleteResult({"n": count}, True)
+
+    def bulk_write(self, requests, ordered=True, **options):
+        # InsertOne, UpdateOne, ReplaceOne and DeleteOne, in one transaction
+        started = time.perf_counter()
+        result = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": [],
+                  "writeErrors": [], "writeConcernErrors": []}
+        with self._write() as connection:
+            for index, request in enumerate(requests):
+                kind = type(request).__name__
+                if kind == "InsertOne":
+                    self._insert(connection, request._doc)
+                    result["nInserted"] += 1
+                elif kind in ("UpdateOne", "ReplaceOne"):
+                    before, after, upserted = self._update(connection, request._filter, request._doc,
+                                                           request._upsert, replace=kind == "ReplaceOne")
+                    if before is not None:
+                        result["nMatched"] += 1
+                        result["nModified"] += 1
+                    if upserted is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": upserted})
+                elif kind == "DeleteOne":
+                    found = self._matching(connection, request._filter, limit=1)
+                    if found:
+                        connection.execute(f'DELETE FROM "{self.name}" WHERE _id = ?', (found[0][0],))
+                        result["nRemoved"] += 1
+                else:
+                    raise NotImplementedError(f"{kind} isn't supported by the SQLite store")
+        self._record("bulkWrite", started, len(requests))
+        return BulkWriteResult(result, True)
+
+    # aggregation
+
+    def aggregate(self, pipeline, **options):
+        self._table()
+        started = time.perf_counter()
+        docs = self._aggregate(list(pipeline))
+        self._record("aggregate", started, len(docs))
+        return iter(docs)
+
+    def _aggregate(self, stages, match=None):
+        while stages and "$match" in stages[0]:
+            match = {"$and": [match, stages[0]["$match"]]} if match else stages[0]["$match"]
+            stages = stages[1:]
+        if not stages:
+            return list(self.find(match))
+        stage = stages[0]
+        if "$facet" in stage:
+            docs = [{name: self._aggregate(list(facet), match) for name, facet in stage["$facet"].items()}]
+        elif "$group" in stage:
+            spec = dict(stage["$group"])
+            docs = self._group(match, spec.pop("_id"), spec)
+        elif "$bucket" in stage:
+            docs = self._bucket(match, stage["$bucket"])
+        elif "$count" in stage:
+            count = self.count_documents(match or {})
+            docs = [{stage["$count"]: count}] if count else []
+        else:
+            docs = list(self.find(match))
+            return self._after(docs, stages)
+        return self._after(docs, stages[1:])
+
+    def _expression(self, value, query):
+        # an aggregation expression as SQL, (sql, is a date)
+        if isinstance(value, str) and value.startswith("$"):
+            field = value[1:]
+            return query.field(field), field.split(".")[-1] in DATE_FIELDS
+        if isinstance(value, dict) and len(value) == 1:
+            op, argument = next(iter(value.items()))
+            if op in ("$year", "$month"):
+                inner, _ = self._expression(argument, query)
+                return (f"CAST(substr({inner}, 1, 4) AS INTEGER)" if op == "$year"
+                        else f"CAST(substr({inner}, 6, 2) AS INTEGER)"), False
+            if op == "$cond" and isinstance(argument, list) and len(argument) == 3 and \
+                    isinstance(argument[0], dict) and list(argument[0]) == ["$isNumber"]:
+                inner, _ = self._expression(argument[0]["$isNumber"], query)
+                then, _ = self._expression(argument[1], query)
+                otherwise, _ = self._expression(argument[2], query)
+                return f"(CASE WHEN typeof({inner}) IN ('integer', 'real') THEN {then} ELSE {otherwise} END)", False
+            raise NotImplementedError(f"Expression {op} isn't supported by the SQLite store")
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return repr(value), False
+        raise NotImplementedError(f"Expression {value!r} isn't supported by the SQLite store")
+
+    def _accumulator(self, spec, query):
+        op, argument = next(iter(spec.items()))
+        inner, _ = self._expression(argument, query) if argument != {} else ("1", False)
+        numeric = f"(CASE WHEN typeof({inner}) IN ('integer', 'real') THEN {inner} END)"
+        if op == "$sum":
+            return f"coalesce(sum({numeric}), 0)"
+        if op == "$avg":
+            return f"avg({numeric})"
+        if op in ("$min", "$max"):
+            return f"{op[1:]}({inner})"
+        if op == "$count":
+            return "count(*)"
+        raise NotImplementedError(f"Accumulator {op} isn't supported by the SQLite store")
+
+    def _grouped(self, query, where, keys, accumulators):
+        # keys is [(name, sql, is a date)], one document per group
+        selects = [sql for _, sql, _ in keys] + [self._accumulator(spec, query) for spec in accumulators.values()]
+        sql = f'SELECT {", ".join(selects) or "1"} FROM "{self.name}" WHERE {where}'
+        if keys:
+            sql += f" GROUP BY {', '.join(str(i + 1) for i in range(len(keys)))}"
+        rows = self.database.connection().execute(sql, query.params).fetchall()
+        docs = []
+        for row in rows:
+            values = [datetime.fromisoformat(v) if date and isinstance(v, str) else v
+                      for v, (_, _, date) in zip(row, keys)]
+            doc = {"_id": values[0] if len(keys) == 1 and keys[0][0] is None
+                   else {name: value for (name, _, _), value in zip(keys, values)} if keys else None}
+            doc.update(zip(accumulators, row[len(keys):]))
+            docs.append(doc)
+        return docs
+
+    def _group(self, match, group_id, accumulators):
+        query = Query()
+        where = query.where(match)
+        if group_id is None:
+            keys = []
+        elif isinstance(group_id, dict) and not any(name.startswith("$") for name in group_id):
+            keys = [(name, *self._expression(value, query)) for name, value in group_id.items()]
+        else:
+            keys = [(None, *self._expression(group_id, query))]
+        docs = self._grouped(query, where, keys, accumulators)
+        if group_id is None and docs and not self.count_documents(match or {}):
+            # MongoDB gives no group at all for no documents
+            return []
+        return docs
+
+    def _bucket(self, match, spec):
+        query = Query()
+        where = query.where(match)
+        expr, _ = self._expression(spec["groupBy"], query)
+        bounds = spec["boundaries"]
+        cases = " ".join(f"WHEN {expr} >= {low!r} AND {expr} < {high!r} THEN {low!r}" for low, high in zip(bounds, bounds[1:]))
+        default = spec.get("default")
+        query.params.append(default)
+        key_sql = f"(CASE WHEN typeof({expr}) IN ('integer', 'real') THEN (CASE {cases} END) END)"
+        key_sql = f"coalesce({key_sql}, ?)" if default is not None else key_sql
+        # the default's parameter goes after the accumulators' (none of them take any)
+        docs = self._grouped(query, where, [(None, key_sql, False)], spec.get("output", {"count": {"$sum": 1}}))
+        return sorted(docs, key=lambda doc: (doc["_id"] == default, doc["_id"] if doc["_id"] != default else 0))
+
+    def _after(self, docs, stages):
+        # what's left of the pipeline, on the already small result
+        for stage in stages:
+            name, spec = next(iter(stage.items()))
+            if name == "$sort":
+                for field, direction in reversed(list(spec.items())):
+                    docs.sort(key=lambda doc: (get_path(doc, field) is not None, get_path(doc, field)),
+                              reverse=direction == -1)
+            elif name == "$limit":
+                docs = docs[:spec]
+            elif name == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            elif name == "$merge":
+                if spec.get("whenMatched", "merge") not in ("keepExisting", "replace") or \
+                        spec.get("whenNotMatched", "insert") != "insert":
+                    raise NotImplementedError("Only $merge with keepExisting or replace is supported by the SQLite store")
+                target = self.database[spec["into"] if isinstance(spec["into"], str) else spec["into"]["coll"]]
+                verb = "INSERT OR IGNORE" if spec["whenMatched"] == "keepExisting" else "INSERT OR REPLACE"
+                with target._write() as connection:
+                    connection.executemany(f'{verb} INTO "{target.name}" (_id, doc) VALUES (?, ?)',
+                                           [(key(doc["_id"]), dumps(doc)) for doc in docs])
+                docs = []
+            else:
+                raise NotImplementedError(f"Stage {name} isn't supported by the SQLite store")
+        return docs
+
+    # indexes
+
+    def create_index(self, keys, name=None, collation=None, expireAfterSeconds=None, unique=False, **options):
+        keys = sort_spec(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        query = Query(_nocase(collation))
+        columns = ", ".join(query.compared(field) + (" DESC" if direction == -1 else "") for field, direction in keys)
+        sql = f'CREATE {"UNIQUE " if unique else ""}INDEX "{self._table()}__{name}" ON "{self.name}" ({columns})'
+        connection = self.database.connection()
+        found = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?",
+                                   (f"{self.name}__{name}",)).fetchone()
+        if found is not None and found[0] != sql:
+            # the same name on other keys (or from before casefolded collations), made again
+            connection.execute(f'DROP INDEX "{self.name}__{name}"')
+            found = None
+        if found is None:
+            # sqlite_master keeps the statement without the IF NOT EXISTS
+            connection.execute(sql.replace("INDEX", "INDEX IF NOT EXISTS", 1))
+        if expireAfterSeconds is not None:
+            self.database.ttl[self.name] = (keys[0][0], expireAfterSeconds)
+        return name
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+
+class Database:
+    def __init__(self, path):
+        self.path = path
+        self.ttl = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._collections = {}
+        self.connection().execute("PRAGMA journal_mode=WAL")
+        self.connection().execute(f"CREATE TABLE IF NOT EXISTS {COUNTS} (name TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=BUSY_SECONDS, isolation_level=None, check_same_thread=False)
+        # safe with WAL, a power cut can lose the last commits but never corrupts the file
+        connection.execute("PRAGMA synchronous=NORMAL")
+        # the delete a REPLACE does fires the count trigger too
+        connection.execute("PRAGMA recursive_triggers=ON")
+        connection.create_function("regexp", 3, _regexp, deterministic=True)
+        # in the indexes of case insensitive collations, every connection needs it
+        connection.create_function("casefold", 1, _casefold, deterministic=True)
+        return connection
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self.connect()
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def get_collection(self, name, **options):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = Collection(self, name)
+            return self._collections[name]
+
+    def list_collection_names(self):
+        rows = self.connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name != ?",
+            (COUNTS,)).fetchall()
+        return [row[0] for row in rows]
+
+    def create_collection(self, name, **options):
+        # storage options (compression and so on) are MongoDB's, there's nothing to set here
+        if name in self.list_collection_names():
+            raise CollectionInvalid(f"collection {name} already exists")
+        collection = self[name]
+        collection._table()
+        return collection
+
+    def drop_collection(self, name):
+        collection = self[name]
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(f'DROP TABLE IF EXISTS "{collection.name}"')
+        connection.execute(f"DELETE FROM {COUNTS} WHERE name = ?", (collection.name,))
+        connection.execute("COMMIT")
+        collection._created = False
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class Client:
+    # what db.get_client() returns for the SQLite backend, client[name] is the file's database
+    def __init__(self, path):
+        self.database = Database(path)
+
+    def __getitem__(self, name):
+        return self.database
+
+    def get_database(self, name=None):
+        return self.database
+
+    def close(self):
+        self.database.close()
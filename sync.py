@@ -0,0 +1,118 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+# keeps several stations running app.py against the same database current.
+# every write stamps updated_at (UTC) and a version (0 when inserted, +1 on every
+# update), a delete leaves a tombstone. each station's Poller asks every POLL_SECONDS
+# for what changed since its watermark, one indexed query per collection, and the
+# app merges that into its lists and caches instead of reloading them.
+#
+# the watermark is the newest updated_at seen, never the local clock, and every
+# poll reaches back LAG before it so a write that committed late is still picked
+# up. what was already seen in that overlap (or written by this station) is skipped.
+# updated_at comes from the writing station's clock, the stations' clocks are taken
+# to agree to well within LAG
+#
+# more than MERGE_LIMIT changes to a collection at once (a bulk import) aren't sent
+# row by row, the poll says to reload that collection instead
+
+POLL_SECONDS = float(os.environ.get("PATIENT_REGISTRY_SYNC_SECONDS", "5"))
+LAG = timedelta(seconds=10)
+MERGE_LIMIT = 500
+# tombstones are removed by a TTL index after this long, a station offline for
+# longer reloads everything when it starts anyway
+TOMBSTONE_DAYS = 7
+
+
+def now():
+    # stations in different time zones still agree on it
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def stamped(doc):
+    # a document about to be inserted
+    doc["updated_at"] = now()
+    doc["version"] = 0
+    return doc
+
+
+def stamped_update(update):
+    # an update document, e.g. {"$set": {...}}
+    update = dict(update)
+    update["$set"] = dict(update.get("$set", {}), updated_at=now())
+    update["$inc"] = dict(update.get("$inc", {}), version=1)
+    return update
+
+
+def tombstone(tombstones_col, collection, entity_id):
+    doc = {"collection": collection, "entity_id": entity_id, "updated_at": now()}
+    tombstones_col.insert_one(doc)
+    return doc
+
+
+class Poller:
+    # collections is {name: collection}, projections an optional {name: projection}
+    def __init__(self, collections, tombstones_col, projections=None):
+        self.collections = collections
+        self.tombstones_col = tombstones_col
+        self.projections = projections or {}
+        self.watermark = now() - LAG
+        self._lock = threading.Lock()
+        # (collection, str id) -> (version, updated_at) of what this station already has,
+        # "deleted" for a tombstone, entries older than the poll window are dropped
+        self._seen = {}
+        # collection -> updated_at it was last reloaded up to, the overlap isn't read again
+        self._reloaded = {}
+
+    def mark(self, collection, entity_id, version):
+        # this station's own write, the poller won't hand it back
+        with self._lock:
+            self._seen[(collection, str(entity_id))] = (version, now())
+
+    def _new(self, key, version, updated_at):
+        seen = self._seen.get(key)
+        if seen is not None and (seen[0] == "deleted" or (version != "deleted" and seen[0] >= version)):
+            return False
+        self._seen[key] = (version, updated_at)
+        return True
+
+    def poll(self):
+        # {collection: {"changed": [documents], "deleted": [str ids]}}, only what is new,
+        # {collection: None} when it changed too much and should be reloaded
+        since = self.watermark - LAG
+        newest = self.watermark
+        changes = {}
+        fetched = []
+        for name, collection in self.collections.items():
+            reloaded = self._reloaded.get(name)
+            changed = {"$gt": reloaded} if reloaded is not None and reloaded >= since else {"$gte": since}
+            docs = list(collection.find({"updated_at": changed}, self.projections.get(name)).limit(MERGE_LIMIT + 1))
+            if len(docs) > MERGE_LIMIT:
+                latest = collection.find_one({}, {"updated_at": 1}, sort=[("updated_at", -1)])
+                newest = max(newest, latest["updated_at"])
+                self._reloaded[name] = latest["updated_at"]
+                changes[name] = None
+                continue
+            fetched.append((name, docs))
+        tombstones = list(self.tombstones_col.find({"updated_at": {"$gte": since}}))
+
+        with self._lock:
+            for name in [name for name, change in changes.items() if change is None]:
+                # everything will be read again, nothing seen of it matters now
+                self._seen = {key: seen for key, seen in self._seen.items() if key[0] != name}
+            for name, docs in fetched:
+                for doc in docs:
+                    newest = max(newest, doc["updated_at"])
+                    if self._new((name, str(doc["_id"])), doc.get("version", 0), doc["updated_at"]):
+                        changes.setdefault(name, {"changed": [], "deleted": []})["changed"].append(doc)
+            for doc in tombstones:
+                newest = max(newest, doc["updated_at"])
+                name, entity_id = doc["collection"], str(doc["entity_id"])
+                if name in self.collections and changes.get(name, {}) is not None and \
+                        self._new((name, entity_id), "deleted", doc["updated_at"]):
+                    changes.setdefault(name, {"changed": [], "deleted": []})["deleted"].append(entity_id)
+            self.watermark = newest
+            horizon = newest - LAG - LAG
+            self._seen = {key: seen for key, seen in self._seen.items() if seen[1] >= horizon}
+        return changes
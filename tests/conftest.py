@@ -0,0 +1,13 @@
+import os
+import sys
+
+import mongomock
+import pytest
+
+# the modules live at the top of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database():
+    return mongomock.MongoClient()["hospital"]
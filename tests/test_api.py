@@ -0,0 +1,156 @@
+import asyncio
+import json
+
+import pytest
+from bson import ObjectId
+
+import api
+import service
+
+
+class Writer:
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def registry(database):
+    registry = service.RegistryService(database.get_collection)
+    yield registry
+    registry.close()
+
+
+def exchange(app, method, target, body=None, length=None):
+    # one request through Api.handle, returns (status, headers, raw body)
+    data = b"" if body is None else json.dumps(body).encode("utf-8")
+    length = len(data) if length is None else length
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(f"{method} {target} HTTP/1.1\r\nConnection: close\r\n"
+                         f"Content-Length: {length}\r\n\r\n".encode("latin-1") + data)
+        reader.feed_eof()
+        writer = Writer()
+        await app.handle(reader, writer)
+        assert writer.closed
+        return bytes(writer.data)
+
+    response = asyncio.run(run())
+    head, _, rest = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in header_lines)
+    return int(status_line.split()[1]), headers, rest
+
+
+def unchunk(body):
+    # the chunks' data, and whether the last (empty) chunk came
+    data = b""
+    while body:
+        size, _, body = body.partition(b"\r\n")
+        size = int(size, 16)
+        if size == 0:
+            return data, True
+        data, body = data + body[:size], body[size + 2:]
+    return data, False
+
+
+def add_patients(registry, count):
+    return [registry.add_patient({"name": f"Patient {i}", "age": 20 + i, "gender": "Female",
+                                  "insurance": "Private"}) for i in range(count)]
+
+
+def test_missing_patient_and_unknown_route_are_404(registry):
+    app = api.Api(registry)
+    status, _, body = exchange(app, "GET", f"/patients/{ObjectId()}")
+    assert status == 404
+    assert json.loads(body) == {"error": "Patient not found"}
+    assert exchange(app, "GET", "/nowhere")[0] == 404
+    assert exchange(app, "GET", "/export/nothing")[0] == 404
+
+
+def test_malformed_content_length_is_400(registry):
+    app = api.Api(registry)
+    for length in ("ten", "-5"):
+        status, headers, body = exchange(app, "POST", "/patients", length=length)
+        assert status == 400
+        assert headers["Connection"] == "close"
+
+
+def test_overlapping_appointment_is_409_until_forced(registry):
+    app = api.Api(registry)
+    [patient] = add_patients(registry, 1)
+    booking = {"patient_id": str(patient["_id"]), "date": "2026-10-20", "time": "10:00"}
+    assert exchange(app, "POST", "/appointments", booking)[0] == 201
+    status, _, body = exchange(app, "POST", "/appointments", booking)
+    assert status == 409
+    assert len(json.loads(body)["conflicts"]) == 1
+    assert exchange(app, "POST", "/appointments?force=1", booking)[0] == 201
+
+
+def test_requests_past_max_waiting_are_503(registry):
+    app = api.Api(registry, max_waiting=0)
+    assert exchange(app, "GET", "/patients")[0] == 503
+    assert exchange(app, "GET", "/health")[0] == 200
+
+
+def test_export_is_chunked_ndjson(registry):
+    add_patients(registry, 5)
+    status, headers, body = exchange(api.Api(registry), "GET", "/export/patients")
+    assert status == 200
+    assert headers["Transfer-Encoding"] == "chunked"
+    data, complete = unchunk(body)
+    assert complete
+    assert sorted(json.loads(line)["name"] for line in data.decode("utf-8").splitlines()) == \
+        [f"Patient {i}" for i in range(5)]
+
+
+def test_export_failing_before_the_first_batch_gets_its_status(registry, monkeypatch):
+    def failing(name):
+        raise ConnectionError("no database")
+        yield
+
+    monkeypatch.setattr(registry, "export_ndjson", failing)
+    status, headers, body = exchange(api.Api(registry), "GET", "/export/patients")
+    assert status == 500
+    assert "no database" in json.loads(body)["error"]
+
+
+def test_export_closes_its_source_when_the_first_batch_fails(registry, monkeypatch):
+    class Lines:
+        closed = False
+
+        def __next__(self):
+            raise ConnectionError("no database")
+
+        def close(self):
+            self.closed = True
+
+    lines = Lines()
+    monkeypatch.setattr(registry, "export_ndjson", lambda name: lines)
+    assert exchange(api.Api(registry), "GET", "/export/patients")[0] == 500
+    assert lines.closed
+
+
+def test_export_failing_midway_ends_the_stream_without_a_last_chunk(registry, monkeypatch):
+    def failing(name):
+        yield '{"n":1}\n'
+        raise ConnectionError("no database")
+
+    monkeypatch.setattr(registry, "export_ndjson", failing)
+    status, _, body = exchange(api.Api(registry), "GET", "/export/patients")
+    assert status == 200
+    data, complete = unchunk(body)
+    assert data == b'{"n":1}\n'
+    assert not complete
+    # and no second response in the body
+    assert b"HTTP/1.1" not in body
@@ -0,0 +1,104 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import audit
+import sqlite_store
+
+NOW = datetime(2026, 10, 1)
+
+
+def log(database, *days_ago):
+    entries = [{"timestamp": NOW - timedelta(days=days), "action": f"entry {i}"} for i, days in enumerate(days_ago)]
+    database["audit_logs"].insert_many(entries)
+    return entries
+
+
+def test_archive_moves_old_months_to_collections(tmp_path):
+    # mongomock has no $merge, the SQLite store runs the same pipeline
+    database = sqlite_store.Client(str(tmp_path / "registry.sqlite3"))["hospital"]
+    log(database, 400, 400, 395, 10)
+    moved, skipped = audit.archive(database["audit_logs"], database, older_than_days=180, directory="", now=NOW)
+    assert skipped == {}
+    assert sum(moved.values()) == 3
+    assert database["audit_logs"].count_documents({}) == 1
+    archived = sum(database[name].count_documents({}) for name in database.list_collection_names()
+                   if name.startswith("audit_logs_archive_"))
+    assert archived == 3
+    database.close()
+
+
+def test_archive_leaves_a_month_that_did_not_reach_the_archive(database, monkeypatch, tmp_path):
+    entries = log(database, 400, 400)
+    copy = audit._archive_to_file
+    monkeypatch.setattr(audit, "_archive_to_file", lambda *args: copy(*args) - {entries[0]["_id"]})
+    moved, skipped = audit.archive(database["audit_logs"], database, older_than_days=180, directory=str(tmp_path),
+                                   now=NOW)
+    assert moved == {}
+    assert list(skipped.values()) == [(2, 1)]
+    assert database["audit_logs"].count_documents({}) == 2
+
+
+def test_archive_deletes_only_the_entries_it_copied(database, monkeypatch, tmp_path):
+    log(database, 400)
+    copy = audit._archive_to_file
+
+    def copy_then_log(collection, ids, month, directory):
+        archived = copy(collection, ids, month, directory)
+        # written in the archived month while the copy ran
+        collection.insert_one({"timestamp": NOW - timedelta(days=400), "action": "late"})
+        return archived
+
+    monkeypatch.setattr(audit, "_archive_to_file", copy_then_log)
+    moved, skipped = audit.archive(database["audit_logs"], database, older_than_days=180, directory=str(tmp_path),
+                                   now=NOW)
+    assert sum(moved.values()) == 1
+    assert [entry["action"] for entry in database["audit_logs"].find()] == ["late"]
+
+
+def test_file_archive_run_again_after_a_failed_delete_writes_no_duplicates(database, monkeypatch, tmp_path):
+    log(database, 400, 400, 400)
+    collection = database["audit_logs"]
+    delete_many = collection.delete_many
+    # the first run stops between writing the file and deleting
+    monkeypatch.setattr(collection, "delete_many", lambda query: None)
+    audit.archive(collection, database, older_than_days=180, directory=str(tmp_path), now=NOW)
+    assert collection.count_documents({}) == 3
+
+    monkeypatch.setattr(collection, "delete_many", delete_many)
+    moved, skipped = audit.archive(collection, database, older_than_days=180, directory=str(tmp_path), now=NOW)
+    assert sum(moved.values()) == 3
+    assert collection.count_documents({}) == 0
+    [path] = tmp_path.iterdir()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        ids = [json.loads(line)["_id"] for line in f]
+    assert len(ids) == len(set(ids)) == 3
+
+
+def test_flush_retries_the_events_the_server_turned_down(database):
+    written = database["audit_logs"]
+
+    class Refusing:
+        # writes the batch but turns down the first event (a retry already wrote it) and the third
+        def insert_many(self, events, ordered=True):
+            written.insert_many([event for i, event in enumerate(events) if i not in (0, 2)])
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": audit.DUPLICATE_KEY},
+                                                  {"index": 2, "code": 121}]})
+
+    logger = audit.AuditLogger(Refusing(), actor="test", flush_size=100, flush_seconds=60)
+    try:
+        events = [logger.record(f"entry {i}") for i in range(4)]
+        with pytest.raises(BulkWriteError):
+            logger.flush()
+        assert logger.pending() == 1
+        logger.record("entry 4")
+        logger.collection = written
+        assert logger.flush() == 2
+    finally:
+        logger.close()
+    # the retried event goes out ahead of the ones recorded since
+    assert [entry["action"] for entry in written.find()] == ["entry 1", "entry 3", "entry 2", "entry 4"]
+    assert written.count_documents({"_id": events[0]["_id"]}) == 0
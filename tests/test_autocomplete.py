@@ -0,0 +1,53 @@
+import autocomplete
+
+
+class Reading:
+    # a collection whose find runs during(patients) halfway through the read
+    def __init__(self, collection, during):
+        self.collection = collection
+        self.during = during
+
+    def find(self, *args, **kwargs):
+        docs = list(self.collection.find(*args, **kwargs))
+        for i, doc in enumerate(docs):
+            if i == len(docs) // 2:
+                self.during(self.collection)
+            yield doc
+
+
+def test_write_the_read_already_saw_is_counted_once(database):
+    patients = database["patients"]
+    patients.insert_many([{"name": name} for name in ("Ada", "Bea", "Cy", "Dee")])
+    index = autocomplete.PrefixIndex()
+
+    def add_then_delete_seen(collection):
+        # both patients were read before these writes, a replay would count them twice
+        added = collection.insert_one({"name": "Ann"}).inserted_id
+        index.add(added, "Ann")
+        ada = collection.find_one({"name": "Ada"})
+        collection.delete_one({"_id": ada["_id"]})
+        index.remove(ada["_id"], "Ada")
+
+    index.load(Reading(patients, add_then_delete_seen))
+    assert index.complete("a") == ["Ann"]
+    ann = patients.find_one({"name": "Ann"})
+    index.remove(ann["_id"], "Ann")
+    assert index.complete("a") == []
+
+
+def test_writes_after_the_read_saw_the_old_name_are_applied(database):
+    patients = database["patients"]
+    ids = patients.insert_many([{"name": name} for name in ("Ada", "Bea", "Cy", "Dee")]).inserted_ids
+    index = autocomplete.PrefixIndex()
+
+    def rename_and_delete_read(collection):
+        collection.update_one({"_id": ids[-1]}, {"$set": {"name": "Dora"}})
+        index.change(ids[-1], "Dee", "Dora")
+        collection.delete_one({"_id": ids[-2]})
+        # deleted at another station, the name isn't held here
+        index.remove(ids[-2], None)
+
+    index.load(Reading(patients, rename_and_delete_read))
+    assert index.complete("d") == ["Dora"]
+    assert index.complete("c") == []
+    assert len(index) == 3
@@ -0,0 +1,22 @@
+import csv
+import json
+
+import exporters
+import sync
+
+
+def test_every_format_leaves_the_sync_fields_out(database, tmp_path):
+    patients = database["patients"]
+    patients.insert_many([sync.stamped({"name": f"Patient {i}", "age": 20 + i}) for i in range(3)])
+    exporters.export_ndjson(patients, tmp_path / "patients.ndjson")
+    exporters.export_json(patients, tmp_path / "patients.json")
+    exporters.export_csv(patients, "patients", tmp_path / "patients.csv")
+    with open(tmp_path / "patients.ndjson", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    with open(tmp_path / "patients.json", encoding="utf-8") as f:
+        docs = json.load(f)
+    with open(tmp_path / "patients.csv", newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f))
+    assert {key for line in lines for key in line} == {"_id", "name", "age"}
+    assert {key for doc in docs for key in doc} == {"name", "age"}
+    assert not {"updated_at", "version"} & set(header)
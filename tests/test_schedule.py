@@ -0,0 +1,22 @@
+from datetime import datetime
+
+import schedule
+import sqlite_store
+
+
+def test_backfill_stamps_what_it_fills_in(tmp_path):
+    # mongomock's bulk_write doesn't take the current pymongo's requests, the SQLite store does
+    database = sqlite_store.Client(str(tmp_path / "registry.sqlite3"))["hospital"]
+    appointments = database["appointments"]
+    appointments.insert_many([
+        {"_id": "old", "date": datetime(2026, 10, 20), "time": "09:30", "consultation_type": "Specialist",
+         "version": 2, "updated_at": datetime(2020, 1, 1)},
+        {"_id": "no time", "date": datetime(2026, 10, 20), "version": 0},
+    ])
+    assert schedule.backfill(appointments) == 1
+    filled = appointments.find_one({"_id": "old"})
+    assert (filled["start"], filled["end"]) == (datetime(2026, 10, 20, 9, 30), datetime(2026, 10, 20, 10, 15))
+    assert filled["version"] == 3
+    assert filled["updated_at"] > datetime(2020, 1, 1)
+    assert appointments.find_one({"_id": "no time"})["version"] == 0
+    database.close()
@@ -0,0 +1,85 @@
+import name_search
+import search_query
+import service
+from virtual_tree import KeysetPager
+
+NAMES = ["John Smith", "Jonh Smith", "Sarah Roth", "Anna Smithson", "Mary Smith", "Michael Müller", "Michael Miller",
+         "Priya Patel"]
+
+
+def load(database, names=NAMES, copies=1):
+    patients = database["patients"]
+    patients.insert_many([{"name": name, "age": 20 + i, "insurance": "Private" if i % 2 else "Medicare"}
+                          for _ in range(copies) for i, name in enumerate(names)])
+    index = name_search.NameIndex()
+    index.load(patients)
+    return patients, index
+
+
+def names(patients, ids):
+    found = {patient["_id"]: patient["name"] for patient in patients.find({"_id": {"$in": ids}})}
+    return [found[patient_id] for patient_id in ids]
+
+
+def test_search_returns_every_checked_match_best_first(database):
+    patients, index = load(database)
+    found = names(patients, [patient_id for patient_id, score in index.search("smith")])
+    # the ones sharing only a few trigrams (Sarah Roth) aren't matches
+    assert found[-1] == "Anna Smithson"
+    assert sorted(found) == ["Anna Smithson", "John Smith", "Jonh Smith", "Mary Smith"]
+    assert names(patients, [patient_id for patient_id, score in index.search("micheal muller")])[0] == "Michael Müller"
+
+
+def test_no_cut_off_however_many_match(database):
+    patients, index = load(database, copies=400)
+    assert len(index.search("smith")) == 4 * 400
+    assert len(index.search("smith", limit=10)) == 10
+
+
+def test_resolve_checks_the_other_criteria_on_the_server(database):
+    patients, index = load(database)
+    query, ids = search_query.resolve("smith", index, patients, insurance="Medicare")
+    assert query == {"insurance": "Medicare"}
+    assert sorted(names(patients, ids)) == ["John Smith", "Mary Smith"]
+    # narrowing a name search by another name keeps only the patients both matched
+    query, ids = search_query.resolve("john", index, patients, within=(query, ids))
+    assert names(patients, ids) == ["John Smith"]
+
+
+def test_resolve_falls_back_to_the_regex_until_the_index_loads(database):
+    patients, index = load(database)
+    query, ids = search_query.resolve("smith", name_search.NameIndex(), patients)
+    assert ids is None
+    assert patients.count_documents(query) == 4
+
+
+def test_service_pages_through_the_ranked_matches(database):
+    patients, index = load(database, copies=3)
+    registry = service.RegistryService(database.get_collection)
+    registry.name_index = index
+    try:
+        pages, after = [], None
+        while True:
+            page = registry.search_patients("smith", after=after, limit=5)
+            if not page:
+                break
+            pages.extend(page)
+            after = str(page[-1]["_id"])
+        assert [patient["_id"] for patient in pages] == search_query.name_matches("smith", index)
+    finally:
+        registry.close()
+
+
+def test_pager_pages_ranked_ids_and_sorts_them_by_a_column(database):
+    patients, index = load(database, copies=30)
+    query, ids = search_query.resolve("smith", index, patients)
+    pager = KeysetPager(patients, sort_field="name", page_size=7)
+    pager.set_query(query, ids)
+    assert pager.total() == len(ids) == 120
+    assert [row["_id"] for row in pager.rows(0, 120)] == ids
+    pager.set_sort("age", ascending=False)
+    ages = [row["age"] for row in pager.rows(0, 120)]
+    assert len(ages) == 120 and ages == sorted(ages, reverse=True)
+    # a column picked stays picked for the next query
+    pager.set_query({"age": 21})
+    assert pager.sort_field == "age" and pager.total() == 30
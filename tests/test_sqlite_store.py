@@ -0,0 +1,185 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import analytics
+import counters
+import indexes
+import seed
+import sqlite_store
+
+# the same calls against mongomock and the SQLite store, the results have to match
+
+NOW = datetime(2026, 10, 1, 12)
+PATIENTS = 300
+
+
+def plain(value):
+    # what's compared: no sync stamps (they're the clock at seeding), floats rounded
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items() if k not in ("updated_at", "rebuilt_at")}
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+def by_id(docs):
+    return sorted(plain(list(docs)), key=lambda doc: str(doc["_id"]))
+
+
+@pytest.fixture(scope="module")
+def seeded(tmp_path_factory):
+    mock = mongomock.MongoClient()["hospital"]
+    client = sqlite_store.Client(str(tmp_path_factory.mktemp("sqlite") / "registry.sqlite3"))
+    lite = client["hospital"]
+    indexes.ensure_indexes(lite)
+    for database in (mock, lite):
+        seed.generate(database, PATIENTS, seed=3, now=NOW)
+    yield mock, lite
+    client.close()
+
+
+@pytest.fixture
+def stores(tmp_path):
+    client = sqlite_store.Client(str(tmp_path / "registry.sqlite3"))
+    yield mongomock.MongoClient()["hospital"], client["hospital"]
+    client.close()
+
+
+def middle(database, field):
+    docs = list(database["patients"].find({}).sort([(field, 1), ("_id", 1)]))
+    return docs[len(docs) // 2]
+
+
+def find_cases(database):
+    patient = middle(database, "name")
+    entry = list(database["audit_logs"].find({}).sort([("timestamp", -1), ("_id", -1)]).limit(40))[-1]
+    return {
+        "all by name": ("patients", {}, [("name", 1), ("_id", 1)], 25),
+        "age range": ("patients", {"age": {"$gte": 20, "$lte": 40}}, [("age", 1), ("_id", 1)], 0),
+        "insurance": ("patients", {"insurance": "Medicare"}, None, 0),
+        "insurance in": ("patients", {"insurance": {"$in": ["Medicare", "Private"]}}, None, 0),
+        "insurance not in": ("patients", {"insurance": {"$nin": ["Medicare", None]}}, None, 0),
+        "insurance not": ("patients", {"insurance": {"$ne": "Medicare"}}, None, 0),
+        "name regex": ("patients", {"name": {"$regex": "smi", "$options": "i"}}, [("name", 1), ("_id", 1)], 0),
+        "registered lately": ("patients", {"registration_date": {"$gte": NOW - timedelta(days=90)}}, None, 0),
+        "keyset after a name": ("patients", {"$or": [{"name": {"$gt": patient["name"]}},
+                                                     {"name": patient["name"], "_id": {"$gt": patient["_id"]}}]},
+                                [("name", 1), ("_id", 1)], 50),
+        "keyset before an audit entry": ("audit_logs", {"$or": [{"timestamp": {"$lt": entry["timestamp"]}},
+                                                                {"timestamp": entry["timestamp"],
+                                                                 "_id": {"$lt": entry["_id"]}}]},
+                                         [("timestamp", -1), ("_id", -1)], 40),
+        "and with or": ("patients", {"$and": [{"age": {"$gte": 50}},
+                                              {"$or": [{"gender": "Female"}, {"insurance": "None"}]}]}, None, 0),
+        "not cancelled": ("appointments", {"cancelled_at": None}, None, 0),
+        "conflicts": ("appointments", {"start": {"$gt": NOW - timedelta(days=30), "$lt": NOW},
+                                       "end": {"$gt": NOW - timedelta(days=31)}, "status": {"$ne": "Cancelled"}},
+                      [("start", 1), ("_id", 1)], 0),
+        "completed exists": ("appointments", {"completed_at": {"$exists": True}}, None, 0),
+        "one _id": ("patients", {"_id": patient["_id"]}, None, 0),
+    }
+
+
+CASES = ["all by name", "age range", "insurance", "insurance in", "insurance not in", "insurance not", "name regex",
+         "registered lately", "keyset after a name", "keyset before an audit entry", "and with or", "not cancelled",
+         "conflicts", "completed exists", "one _id"]
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_find_matches(seeded, case):
+    mock, lite = seeded
+    name, query, sort, limit = find_cases(mock)[case]
+    results = []
+    for database in (mock, lite):
+        cursor = database[name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        results.append(plain(list(cursor)) if sort else by_id(cursor))
+    assert results[0], f"{case} should match something"
+    assert results[0] == results[1]
+
+
+def test_counts_match(seeded):
+    mock, lite = seeded
+    for query in ({}, {"insurance": "Medicare"}, {"age": {"$lt": 30}}):
+        assert mock["patients"].count_documents(query) == lite["patients"].count_documents(query)
+    assert mock["patients"].count_documents({}, limit=10) == lite["patients"].count_documents({}, limit=10)
+    for name in ("patients", "appointments", "audit_logs"):
+        assert mock[name].estimated_document_count() == lite[name].estimated_document_count()
+
+
+def test_distinct_matches(seeded):
+    mock, lite = seeded
+    for name, field, query in (("patients", "insurance", None), ("patients", "gender", {"age": {"$gte": 40}}),
+                               ("appointments", "consultation_type", {"status": "Completed"})):
+        assert sorted(mock[name].distinct(field, query), key=str) == sorted(lite[name].distinct(field, query), key=str)
+
+
+def test_dashboard_aggregations_match(seeded):
+    mock, lite = seeded
+    facets = analytics.PATIENT_FACETS + analytics.APPOINTMENT_FACETS
+    assert plain(analytics.load_facets(mock["patients"], mock["appointments"], facets, now=NOW)) == \
+        plain(analytics.load_facets(lite["patients"], lite["appointments"], facets, now=NOW))
+    results = [plain(counters.rebuild(database["patients"], database["appointments"], database["stats"]))
+               for database in (mock, lite)]
+    assert results[0] == results[1]
+
+
+def test_writes_match(stores):
+    results = []
+    for database in stores:
+        patients = database["patients"]
+        first = patients.insert_one({"name": "Ana", "age": 30, "tags": {"a": 1}}).inserted_id
+        patients.insert_many([{"_id": f"p{i}", "name": f"P{i}", "age": i} for i in range(5)])
+        try:
+            patients.insert_many([{"_id": "new"}, {"_id": "p1"}, {"_id": "p9"}], ordered=False)
+        except BulkWriteError as e:
+            inserted = (e.details["nInserted"], [error["index"] for error in e.details["writeErrors"]])
+        with pytest.raises(DuplicateKeyError):
+            patients.insert_one({"_id": "p2"})
+        patients.update_one({"_id": first}, {"$set": {"tags.b": 2}, "$inc": {"age": 1, "visits": 1}})
+        patients.update_one({"_id": "p3"}, {"$unset": {"age": ""}})
+        upserted = patients.update_one({"name": "Zoe"}, {"$set": {"age": 9}, "$setOnInsert": {"new": True}},
+                                       upsert=True).upserted_id is not None
+        patients.replace_one({"_id": "p4"}, {"name": "Replaced"})
+        before = patients.find_one_and_update({"_id": "p0"}, {"$inc": {"age": 5}})
+        after = patients.find_one_and_update({"_id": "p0"}, {"$inc": {"age": 5}}, return_document=ReturnDocument.AFTER)
+        deleted = patients.find_one_and_delete({"_id": "p1"})
+        removed = patients.delete_many({"age": {"$gte": 2}}).deleted_count
+        patients.delete_one({"_id": "new"})
+        docs = [{k: v for k, v in doc.items() if k != "_id" or isinstance(v, str)}
+                for doc in patients.find({}).sort("name", 1)]
+        results.append((inserted, upserted, before, after, deleted, removed, docs,
+                        patients.estimated_document_count()))
+    assert results[0] == results[1]
+
+
+def test_case_insensitive_collation_folds_unicode(stores):
+    _, lite = stores
+    indexes.ensure_indexes(lite)
+    patients = lite["patients"]
+    patients.insert_many([{"name": "MICHAEL MÜLLER"}, {"name": "Michael Muller"}, {"name": "ÉLODIE"}])
+    found = patients.find_one({"name": "Michael Müller"}, collation=indexes.NAME_COLLATION)
+    assert found["name"] == "MICHAEL MÜLLER"
+    # strength 2 still tells accents apart
+    assert patients.count_documents({"name": "michael muller"}, collation=indexes.NAME_COLLATION) == 1
+    assert [doc["name"] for doc in patients.find({"name": {"$gte": "élo", "$lt": "élo￿"}},
+                                                 collation=indexes.NAME_COLLATION)] == ["ÉLODIE"]
+    plan = patients.find({"name": "x"}, collation=indexes.NAME_COLLATION).explain()
+    assert "COLLSCAN" not in str(plan)
+
+
+def test_registry_queries_use_an_index(seeded):
+    _, lite = seeded
+    # the literal name match before the name index has loaded reads every patient, and says so
+    assert indexes.check_queries(lite) == [("search by name while the name index loads", ["COLLSCAN"])]
+    assert indexes.explain(lite, "patients", {"insurance": {"$ne": "Medicare"}}) == ["COLLSCAN"]
+    assert indexes.explain(lite, "patients", {}, [("name", 1), ("_id", 1)]) == [indexes.FULL_IXSCAN]
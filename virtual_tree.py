@@ -0,0 +1,543 @@
+import threading
+import tkinter as tk
+from tkinter import ttk
+from collections import OrderedDict
+
+import perf
+
+# ids per $in when a ranked list is sorted by a column
+ID_CHUNK = 10000
+
+
+class KeysetPager:
+    # pages through a collection ordered by (sort_field, _id) so each page starts
+    # right after the last key of the previous one instead of skipping from the top.
+    # pages may be fetched on a worker thread while the Tk thread reads the cache
+    # count_limit caps the count of a filtered query, the total is then an estimate
+    # (capped is True) that grows as the view scrolls towards its end
+    # cache, if given, swaps each fetched page for its shared records (see patient_cache.py)
+    # set_query with ids pages through those _ids instead, in the order given (a ranked
+    # search, sort_field is None) until set_sort orders them by a field
+    def __init__(self, collection, query=None, projection=None, sort_field="_id",
+                 ascending=True, page_size=100, max_pages=20, count_limit=None, cache=None):
+        self._lock = threading.RLock()
+        self._version = 0
+        self.collection = collection
+        self.query = query or {}
+        self.ids = None
+        self.default_sort = (sort_field, ascending)
+        self.projection = projection
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.count_limit = count_limit
+        self.cache = cache
+        self.set_sort(sort_field, ascending)
+
+    def set_sort(self, field, ascending=True):
+        self.sort_field = field
+        self.ascending = ascending
+        self.reset()
+
+    def set_query(self, query, ids=None):
+        self.query = query or {}
+        self.ids = ids
+        if ids is not None:
+            self.sort_field, self.ascending = None, True
+        elif self.sort_field is None:
+            self.sort_field, self.ascending = self.default_sort
+        self.reset()
+
+    def filtered(self):
+        return bool(self.query) or self.ids is not None
+
+    def reset(self):
+        with self._lock:
+            # anything fetched for an older version is thrown away when it arrives
+            self._version += 1
+            self._pages = OrderedDict()
+            # page number -> (sort value, _id) of the last row on that page
+            self._anchors = {}
+            self._total = None
+            self._count_cap = self.count_limit
+            self.capped = False
+            # the ids in the order shown, read when first needed
+            self._order = None
+
+    def total(self):
+        with self._lock:
+            if self._total is not None:
+                return self._total
+            version, query, cap = self._version, self.query, self._count_cap
+        capped = False
+        if self.ids is not None:
+            total = len(self._ordered())
+        elif query and cap:
+            total = self.collection.count_documents(query, limit=cap)
+            capped = total >= cap
+        elif query:
+            total = self.collection.count_documents(query)
+        else:
+            total = self.collection.estimated_document_count()
+        with self._lock:
+            if version == self._version:
+                self._total = total
+                self.capped = capped
+        return total
+
+    def grow(self):
+        # the view got near the end of a capped count, count further (the pages stay)
+        with self._lock:
+            if self.capped:
+                self._count_cap *= 4
+                self._total = None
+                self.capped = False
+
+    def cached_total(self):
+        return self._total
+
+    def sort_spec(self):
+        direction = 1 if self.ascending else -1
+        if self.sort_field == "_id":
+            return [("_id", direction)]
+        return [(self.sort_field, direction), ("_id", direction)]
+
+    def key(self, doc):
+        return (doc.get(self.sort_field), doc["_id"])
+
+    def _after(self, key):
+        value, last_id = key
+        op = "$gt" if self.ascending else "$lt"
+        if self.sort_field == "_id":
+            return {"_id": {op: last_id}}
+        field = self.sort_field
+        # nulls sort first ascending and last descending, and $gt/$lt never match them
+        if value is None:
+            if self.ascending:
+                return {"$or": [{field: {"$ne": None}}, {field: None, "_id": {op: last_id}}]}
+            return {field: None, "_id": {op: last_id}}
+        after = [{field: {op: value}}, {field: value, "_id": {op: last_id}}]
+        if not self.ascending:
+            after.append({field: None})
+        return {"$or": after}
+
+    def compare(self, a, b):
+        # orders two (value, _id) keys the way the server sorts them for this view
+        a = ((0,) if a[0] is None else (1, a[0]), a[1])
+        b = ((0,) if b[0] is None else (1, b[0]), b[1])
+        result = (a > b) - (a < b)
+        return result if self.ascending else -result
+
+    def adjust_total(self, delta):
+        with self._lock:
+            if self._total is not None:
+                self._total = max(0, self._total + delta)
+
+    def cached(self, iid):
+        with self._lock:
+            for rows in self._pages.values():
+                for doc in rows:
+                    if str(doc["_id"]) == iid:
+                        return doc
+        return None
+
+    def invalidate_from(self, key):
+        # a row added or removed at key shifts every page that ends at or after it,
+        # pages wholly before it (and their anchors) stay usable
+        with self._lock:
+            self._version += 1
+            self._invalidate_from(key)
+
+    def _invalidate_from(self, key):
+        try:
+            stale = [page for page in self._pages
+                     if page not in self._anchors or self.compare(self._anchors[page], key) >= 0]
+            stale_anchors = [page for page, anchor in self._anchors.items() if self.compare(anchor, key) >= 0]
+        except TypeError:
+            # mixed value types in the sort field, nothing to compare against
+            self._pages.clear()
+            self._anchors.clear()
+            return
+        for page in stale:
+            del self._pages[page]
+        for page in stale_anchors:
+            del self._anchors[page]
+
+    def _filter(self, extra):
+        if not extra:
+            return self.query
+        if not self.query:
+            return extra
+        return {"$and": [self.query, extra]}
+
+    def _ordered(self):
+        with self._lock:
+            if self._order is not None:
+                return self._order
+            version, ids, field, ascending = self._version, self.ids, self.sort_field, self.ascending
+        order = ids
+        if field is not None:
+            values = {}
+            for i in range(0, len(ids), ID_CHUNK):
+                for doc in self.collection.find({"_id": {"$in": ids[i:i + ID_CHUNK]}}, {field: 1}):
+                    values[doc["_id"]] = doc.get(field)
+            present = [patient_id for patient_id in ids if patient_id in values]
+            try:
+                order = sorted(present, key=lambda i: ((0,) if values[i] is None else (1, values[i]), i),
+                               reverse=not ascending)
+            except TypeError:
+                # mixed value types in the field, left as they were
+                order = present
+        with self._lock:
+            if version == self._version:
+                self._order = order
+        return order
+
+    def _load_ranked_page(self, page, version, since):
+        start = page * self.page_size
+        chunk = self._ordered()[start:start + self.page_size]
+        docs = {doc["_id"]: doc for doc in self.collection.find({"_id": {"$in": chunk}}, self.projection)}
+        # one that's gone since the search is left out
+        rows = [docs[patient_id] for patient_id in chunk if patient_id in docs]
+        if self.cache is not None:
+            rows = self.cache.put_many(rows, since)
+        with self._lock:
+            if version == self._version:
+                self._pages[page] = rows
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+        return rows
+
+    def _load_page(self, page, fetch=True):
+        with self._lock:
+            if page in self._pages:
+                self._pages.move_to_end(page)
+                return self._pages[page]
+            if not fetch:
+                return None
+            version = self._version
+            ranked = self.ids is not None
+
+            # continue from the closest page before this one whose last key is known,
+            # a scrollbar jump only has to skip the gap in between
+            known = [p for p in self._anchors if p < page]
+            if known:
+                nearest = max(known)
+                query = self._filter(self._after(self._anchors[nearest]))
+                skip = (page - nearest - 1) * self.page_size
+            else:
+                query = self.query
+                skip = page * self.page_size
+            sort = self.sort_spec()
+            since = self.cache.stamp() if self.cache is not None else None
+
+        if ranked:
+            return self._load_ranked_page(page, version, since)
+        cursor = self.collection.find(query, self.projection).sort(sort)
+        if skip:
+            cursor = cursor.skip(skip)
+        rows = list(cursor.limit(self.page_size))
+        if self.cache is not None:
+            rows = self.cache.put_many(rows, since)
+
+        with self._lock:
+            if version == self._version:
+                # a short page is the end of the list and can still grow, so it gets no anchor
+                if len(rows) == self.page_size:
+                    self._anchors[page] = self.key(rows[-1])
+                self._pages[page] = rows
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+        return rows
+
+    def rows(self, start, count, fetch=True):
+        # with fetch=False only the page cache is used and None means a page is missing
+        start = max(0, start)
+        if count <= 0:
+            return []
+        first = start // self.page_size
+        last = (start + count - 1) // self.page_size
+        window = []
+        for page in range(first, last + 1):
+            rows = self._load_page(page, fetch)
+            if rows is None:
+                return None
+            window.extend(rows)
+            # a ranked page is short when a patient is gone, that's not the end
+            if len(rows) < self.page_size and self.ids is None:
+                break
+        offset = start - first * self.page_size
+        return window[offset:offset + count]
+
+
+class VirtualTree:
+    # keeps only the rows that fit in the Treeview as Tk items, the scrollbar
+    # tracks the position in the whole result set held by the pager.
+    # run(view, fn, on_done) fetches missing pages, by default right here on the Tk thread
+    # on_total(total, capped) is told the row count after every render
+    def __init__(self, tree, scrollbar, pager, row_values, sort_columns=None, overscan=10,
+                 run=None, name="rows", on_total=None):
+        self.run = run or (lambda view, fn, on_done: on_done(fn()))
+        self.name = name
+        self.on_total = on_total
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.pager = pager
+        self.row_values = row_values
+        self.sort_columns = sort_columns or {}
+        self.overscan = overscan
+        self.offset = 0
+        self.visible = int(tree.cget("height"))
+        self.rows = []
+        self.selected = None
+        self._pending = None
+        self._headings = {col: tree.heading(col, "text") for col in self.sort_columns}
+
+        scrollbar.configure(command=self._on_scrollbar)
+        tree.configure(yscrollcommand="")
+        tree.bind("<Configure>", self._on_resize)
+        tree.bind("<MouseWheel>", self._on_wheel)
+        tree.bind("<Button-4>", lambda e: self._scroll_event(-3))
+        tree.bind("<Button-5>", lambda e: self._scroll_event(3))
+        tree.bind("<Up>", lambda e: self._on_key(-1))
+        tree.bind("<Down>", lambda e: self._on_key(1))
+        tree.bind("<Prior>", lambda e: self._scroll_event(-self.visible))
+        tree.bind("<Next>", lambda e: self._scroll_event(self.visible))
+        tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+
+        for col in self.sort_columns:
+            tree.heading(col, command=lambda c=col: self.sort_by(c))
+        self._update_headings()
+
+    def reload(self):
+        self.pager.reset()
+        self.render()
+
+    def set_query(self, query, ids=None):
+        self.pager.set_query(query, ids)
+        self.offset = 0
+        self.clear_selection()
+        self._update_headings()
+        self.render()
+
+    def sort_by(self, column):
+        field = self.sort_columns[column]
+        ascending = not self.pager.ascending if field == self.pager.sort_field else True
+        self.pager.set_sort(field, ascending)
+        self.offset = 0
+        self._update_headings()
+        self.render()
+
+    def scroll(self, rows):
+        self.offset = max(0, self.offset + rows)
+        self.schedule_render()
+
+    def schedule_render(self):
+        if self._pending is None:
+            self._pending = self.tree.after_idle(self.render)
+
+    def render(self):
+        if self._pending is not None:
+            self.tree.after_cancel(self._pending)
+            self._pending = None
+
+        total = self.pager.cached_total()
+        if total is not None and self.pager.capped and self.offset + self.visible + self.overscan >= total:
+            self.pager.grow()
+            total = None
+        window = None
+        if total is not None:
+            self.offset = max(0, min(self.offset, total - self.visible))
+            start = max(0, self.offset - self.overscan)
+            # the overscan around the window is fetched too so short scrolls stay in the page cache
+            count = self.visible + self.offset - start + self.overscan
+            window = self.pager.rows(start, count, fetch=False)
+        if window is None:
+            self._fetch()
+            return
+
+        rows = window[self.offset - start:self.offset - start + self.visible]
+        with perf.timed("render", f"{self.name} list", len(rows)):
+            self.tree.delete(*self.tree.get_children())
+            for doc in rows:
+                self.tree.insert("", tk.END, iid=str(doc["_id"]), values=self.row_values(doc))
+        self.rows = rows
+        if self.selected and self.tree.exists(self.selected):
+            self.tree.selection_set(self.selected)
+        self._update_scrollbar(total)
+        if self.on_total is not None:
+            self.on_total(total, self.pager.capped)
+
+    def _fetch(self):
+        offset, visible, overscan = self.offset, self.visible, self.overscan
+
+        def load():
+            total = self.pager.total()
+            first = max(0, min(offset, total - visible))
+            start = max(0, first - overscan)
+            self.pager.rows(start, visible + first - start + overscan)
+
+        self.run(self.name, load, lambda result: self.render())
+
+    def insert(self, doc):
+        if self.pager.filtered():
+            # a filtered view can't tell locally whether the row belongs in it
+            self.reload()
+            return
+        self.pager.adjust_total(1)
+        self._place(doc)
+        self._after_change()
+
+    def update(self, doc):
+        iid = str(doc["_id"])
+        old = self._row(iid) or self.pager.cached(iid)
+        if self.pager.filtered() or old is None:
+            self.reload()
+            return
+        row = dict(old)
+        row.update(doc)
+        old_key, new_key = self.pager.key(old), self.pager.key(row)
+        if old_key == new_key:
+            old.update(doc)
+            if self.tree.exists(iid):
+                self.tree.item(iid, values=self.row_values(old))
+            return
+        # the sort key changed so the row moves
+        self._drop(iid, old_key)
+        self._place(row)
+        self._after_change()
+
+    def merge(self, doc, new=False):
+        # a change made somewhere else: a row this view holds is updated, a new one
+        # is placed, anything else is updated the same way (it reloads)
+        iid = str(doc["_id"])
+        if new and self._row(iid) is None and self.pager.cached(iid) is None:
+            self.insert(doc)
+        else:
+            self.update(doc)
+
+    def remove(self, iid):
+        old = self._row(iid) or self.pager.cached(iid)
+        if self.pager.filtered() or old is None:
+            self.reload()
+            return
+        self.pager.adjust_total(-1)
+        self._drop(iid, self.pager.key(old))
+        self._after_change()
+
+    def _row(self, iid):
+        for doc in self.rows:
+            if str(doc["_id"]) == iid:
+                return doc
+        return None
+
+    def _before_window(self, key):
+        return self.offset > 0 and bool(self.rows) and self.pager.compare(key, self.pager.key(self.rows[0])) < 0
+
+    def _drop(self, iid, key):
+        self.pager.invalidate_from(key)
+        row = self._row(iid)
+        if row is not None:
+            self.rows.remove(row)
+            self.tree.delete(iid)
+        elif self._before_window(key):
+            # keep the same rows on screen
+            self.offset = max(0, self.offset - 1)
+
+    def _place(self, doc):
+        key = self.pager.key(doc)
+        self.pager.invalidate_from(key)
+        if self._before_window(key):
+            self.offset += 1
+            return
+        index = 0
+        while index < len(self.rows) and self.pager.compare(self.pager.key(self.rows[index]), key) < 0:
+            index += 1
+        # past the last row only counts as inside the window when the window ends the list
+        total = self.pager.cached_total() or 0
+        if index >= self.visible or (index == len(self.rows) and self.offset + index < total - 1):
+            return
+        iid = str(doc["_id"])
+        self.rows.insert(index, doc)
+        self.tree.insert("", index, iid=iid, values=self.row_values(doc))
+        if self.selected == iid:
+            self.tree.selection_set(iid)
+        if len(self.rows) > self.visible:
+            last = self.rows.pop()
+            self.tree.delete(str(last["_id"]))
+
+    def _after_change(self):
+        total = self.pager.cached_total()
+        if total is None or len(self.rows) < min(self.visible, total):
+            # a row left the window, pull the next one in from the server
+            self.schedule_render()
+        else:
+            self._update_scrollbar(total)
+
+    def selected_id(self):
+        return self.selected
+
+    def clear_selection(self):
+        self.selected = None
+        self.tree.selection_remove(*self.tree.selection())
+
+    def _update_scrollbar(self, total):
+        if total <= 0:
+            self.scrollbar.set(0, 1)
+            return
+        first = self.offset / total
+        last = min(1.0, (self.offset + self.visible) / total)
+        self.scrollbar.set(first, last)
+
+    def _update_headings(self):
+        for col, text in self._headings.items():
+            if self.sort_columns[col] == self.pager.sort_field:
+                text = f"{text} {'▲' if self.pager.ascending else '▼'}"
+            self.tree.heading(col, text=text)
+
+    def _on_scrollbar(self, action, *args):
+        if action == "moveto":
+            self.offset = int(float(args[0]) * (self.pager.cached_total() or 0))
+        elif action == "scroll":
+            amount = int(args[0])
+            self.offset += amount * self.visible if args[1] == "pages" else amount
+        self.offset = max(0, self.offset)
+        self.schedule_render()
+
+    def _on_wheel(self, event):
+        steps = -int(event.delta / 120) or (-1 if event.delta > 0 else 1)
+        return self._scroll_event(steps * 3)
+
+    def _scroll_event(self, rows):
+        self.scroll(rows)
+        return "break"
+
+    def _on_key(self, step):
+        children = self.tree.get_children()
+        if not children:
+            return "break"
+        focus = self.tree.focus()
+        index = children.index(focus) if focus in children else -1
+        if 0 <= index + step < len(children):
+            return None
+        # stepping off the edge of the window moves the window instead
+        self.offset = max(0, self.offset + step)
+        self.render()
+        children = self.tree.get_children()
+        if children:
+            item = children[0] if step < 0 else children[-1]
+            self.tree.focus(item)
+            self.tree.selection_set(item)
+        return "break"
+
+    def _on_select(self, event):
+        selection = self.tree.selection()
+        if selection:
+            self.selected = selection[0]
+
+    def _on_resize(self, event):
+        rowheight = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        # one row's worth of height goes to the heading
+        visible = max(1, event.height // rowheight - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.schedule_render()
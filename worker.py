@@ -0,0 +1,103 @@
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DataWorker:
+    # runs database calls on a thread pool and hands the results back to the Tk
+    # thread through a queue drained with root.after, Tk widgets must never be
+    # touched from the pool threads
+    def __init__(self, root, max_workers=4, poll_ms=25):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_busy = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="data")
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        # view -> generation of the newest request, older results for it are dropped
+        self._latest = {}
+        self._futures = {}
+        self._pending = 0
+        self._closed = False
+        self._poll()
+
+    def submit(self, view, fn, *args, on_done=None, on_error=None, quiet=False):
+        # view names a screen area (e.g. "dashboard"), a newer request for the same
+        # view makes the older one stale, view=None is never dropped (writes).
+        # quiet work (background polling) doesn't turn the busy indicator on
+        counted = not quiet
+        with self._lock:
+            generation = self._latest.get(view, 0) + 1
+            if view is not None:
+                self._latest[view] = generation
+                previous = self._futures.pop(view, None)
+                if previous is not None and previous[0].cancel() and previous[1]:
+                    self._pending -= 1
+            if counted:
+                self._pending += 1
+        future = self._executor.submit(self._run, view, generation, fn, args, on_done, on_error, counted)
+        if view is not None:
+            with self._lock:
+                self._futures[view] = (future, counted)
+        if counted:
+            self._notify_busy()
+        return generation
+
+    def post(self, callback, *args):
+        # lets a pool thread run something small on the Tk thread, e.g. progress
+        self._results.put((None, 0, callback, args, False))
+
+    def is_current(self, view, generation):
+        return self._latest.get(view) == generation
+
+    def busy(self):
+        return self._pending > 0
+
+    def shutdown(self):
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, view, generation, fn, args, on_done, on_error, counted):
+        if view is not None and not self.is_current(view, generation):
+            self._results.put((view, generation, None, (), counted))
+            return
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self._results.put((view, generation, on_error or self._report, (e,), counted))
+        else:
+            self._results.put((view, generation, on_done, (result,), counted))
+
+    def _report(self, error):
+        self.root.report_callback_exception(type(error), error, error.__traceback__)
+
+    def _poll(self):
+        if self._closed:
+            return
+        finished = False
+        try:
+            while True:
+                view, generation, callback, args, counted = self._results.get_nowait()
+                if counted:
+                    finished = True
+                    with self._lock:
+                        self._pending -= 1
+                        if self._latest.get(view) == generation:
+                            self._futures.pop(view, None)
+                if callback is None or (view is not None and not self.is_current(view, generation)):
+                    continue
+                try:
+                    callback(*args)
+                except Exception:
+                    # same as an exception in any other Tk callback, keep polling
+                    self.root.report_callback_exception(*sys.exc_info())
+        except queue.Empty:
+            pass
+        if finished:
+            self._notify_busy()
+        self.root.after(self.poll_ms, self._poll)
+
+    def _notify_busy(self):
+        if self.on_busy is not None:
+            self.on_busy(self._pending > 0)